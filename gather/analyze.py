@@ -2,8 +2,11 @@ from enum import Enum
 import collections
 import os.path
 import re
+import string
 
 from gather import graph
+from gather.fs import OS_FILESYSTEM
+from gather.progress import NoOpProgress
 
 
 __all__ = ("Collector", "Ambiguity")
@@ -29,19 +32,39 @@ NameInfo = collections.namedtuple(
         "prefix",
         "suffix",
         "set_key",
+        "size",
+        "mtime",
     )
 )
+NameInfo.__new__.__defaults__ = (None, None)
 
 DIGIT_PATTERN = re.compile(r"(\d+)\D*$")
-def extract_name_info(path):
+def extract_name_info(path, size=None, mtime=None):
     container, name = os.path.split(path)
     digit_match = DIGIT_PATTERN.search(name)
 
     if digit_match is None:
         return None
 
-    number = digit_match.group(1)
-    number_start, number_end = digit_match.span(1)
+    return _name_info(path, container, name, digit_match.span(1), size, mtime)
+
+
+FIELD_PATTERN = re.compile(r"\d+")
+def extract_field_name_infos(path, size=None, mtime=None):
+    """
+    Returns a NameInfo for each run of digits in the name at `path`, in the
+    order they appear.
+    """
+    container, name = os.path.split(path)
+    return [
+        _name_info(path, container, name, field_match.span(), size, mtime)
+        for field_match in FIELD_PATTERN.finditer(name)
+    ]
+
+
+def _name_info(path, container, name, number_span, size, mtime):
+    number_start, number_end = number_span
+    number = name[number_start:number_end]
 
     prefix = name[:number_start]
     suffix = name[number_end:]
@@ -56,14 +79,41 @@ def extract_name_info(path):
         prefix = prefix,
         suffix = suffix,
         set_key = (container, prefix, suffix),
+        size = size,
+        mtime = mtime,
     )
 
 
 class SequenceInfo(object):
-    def __init__(self, paths, first_info, last_info):
+    def __init__(
+        self,
+        paths,
+        first_info,
+        last_info,
+        children = (),
+        members = (),
+        gathered_dirs = (),
+    ):
         self.paths = tuple(paths)
         self.first = first_info
         self.last = last_info
+        self.children = tuple(children)
+        self.members = tuple(members)
+        # previously gathered directories that members are in, the one
+        # holding the most first
+        self.gathered_dirs = tuple(gathered_dirs)
+
+        self.size = None
+        self.newest_mtime = None
+        if len(self.members) > 0:
+            if all(m.size is not None for m in self.members):
+                self.size = sum(m.size for m in self.members)
+            if all(m.mtime is not None for m in self.members):
+                self.newest_mtime = max(m.mtime for m in self.members)
+
+    @property
+    def file_count(self):
+        return len(self.paths)
 
     def __str__(self):
         return os.path.join(
@@ -77,11 +127,12 @@ class SequenceInfo(object):
         )
 
     def __repr__(self):
-        return "%s(%r, %r, %r)" % (
+        return "%s(%r, %r, %r, %r)" % (
             type(self).__name__,
             self.paths,
             self.first,
             self.last,
+            self.children,
         )
 
     # the following properties are (should be) common to the set -
@@ -106,54 +157,297 @@ def lookup_key(name_info, digit_count_delta=0, value_delta=0):
     )
 
 
+def is_successor(a, b):
+    """
+    Returns True if NameInfo `b` would directly follow NameInfo `a` in a
+    sequence, disregarding their set keys.
+    """
+    if b.value != a.value + 1:
+        return False
+    if b.digit_count == a.digit_count:
+        return True
+    return (
+        b.digit_count == a.digit_count + 1 and
+        re.match(r"^9+$", a.number) is not None
+    )
+
+
 class Direction(Enum):
     previous = -1
     next = 1
 
 
 class Collector(object):
-    def __init__(self):
+    """
+    Detects sequences among collected file names.
+
+    :param progress: An optional `gather.progress.NoOpProgress` to notify
+      of each file parsed and sequence found.
+    :param hierarchical: If True, also index the numbered directories that
+      contain each collected file, so that `directory_sequences` can
+      report on them.
+    :param gathered: An optional `GatheredDirectoryPattern`. Files inside
+      directories it matches are collected as if they were still in the
+      directory above, so that new files can be added to the sequences
+      gathered there previously. A gathered directory that also holds files
+      outside its range, or of another sequence, is left alone, since
+      renaming it would move them too, and is reported by
+      `mixed_gathered_directories`.
+    :param fs: The filesystem that gathered directories are listed on.
+    """
+    def __init__(
+        self,
+        progress = None,
+        hierarchical = False,
+        gathered = None,
+        fs = OS_FILESYSTEM,
+    ):
+        self._progress = progress or NoOpProgress()
         self._node_lookup = dict()
         self._all_nodes = [ ]
         self._ambiguous_nodes = set()
         self._ambiguities = [ ]
 
-    def collect(self, path):
-        name_info = extract_name_info(path)
+        self._gathered = gathered
+        self._fs = fs
+        self._gathered_owners = { }
+        self._mixed_gathered = [ ]
+
+        if hierarchical:
+            self._directories = Collector()
+            self._seen_directories = set()
+        else:
+            self._directories = None
+
+    def collect(self, path, size=None, mtime=None):
+        self._progress.parsed_file()
+
+        if (self._gathered is not None and
+                self._collect_if_gathered(path, size, mtime)):
+            return
+
+        if self._directories is not None:
+            self._collect_directories(os.path.dirname(path))
+
+        name_info = extract_name_info(path, size, mtime)
         if name_info is None:
             return
 
-        node = graph.Node(name_info)
-        self._node_lookup[lookup_key(name_info)] = node
-        self._all_nodes.append(node)
-        self._insert(node)
+        self._add(name_info)
 
     def collect_all(self, path_iter):
+        """
+        Collects each item in `path_iter`, which may be a path, or a
+        (path, size, mtime) tuple such as `gather.scan.ScannedFile`.
+        """
         for path in path_iter:
-            self.collect(path)
+            if isinstance(path, str):
+                self.collect(path)
+            else:
+                self.collect(*path)
+
+    def close(self):
+        pass
 
     def has_ambiguities(self):
         return len(self._ambiguities) > 0
 
+    def mixed_gathered_directories(self):
+        """
+        Returns the previously gathered directories that were left alone
+        because they hold files that don't belong to their sequence.
+        """
+        return list(self._mixed_gathered)
+
     def ambiguities(self):
         yield from self._ambiguities
 
     def sequences(self):
+        for sequence in self._sequences():
+            self._progress.found_sequence()
+            yield sequence
+
+    def directory_sequences(self):
+        """
+        Yields sequences of numbered directories, with everything found
+        inside their members nested beneath them. This only yields anything
+        if the Collector was created with `hierarchical=True`.
+
+        The `children` of each yielded SequenceInfo are the directory
+        sequences, then the file sequences, found within its members. File
+        sequences whose numbering continues from one member directory to the
+        next are joined into a single SequenceInfo that spans them, and
+        whose `children` are the sequences from each directory.
+        """
+        if self._directories is None:
+            return
+
+        dir_sequences = [
+            s for s in self._directories._sequences() if len(s.paths) > 1
+        ]
+
+        owners = { }
+        for index, dir_sequence in enumerate(dir_sequences):
+            for position, member in enumerate(dir_sequence.paths):
+                owners[member] = (index, position)
+
+        nested_dirs = [ [ ] for _ in dir_sequences ]
+        nested_files = [ [ ] for _ in dir_sequences ]
+        segments = [ collections.OrderedDict() for _ in dir_sequences ]
+        top_level = [ ]
+
+        for index, dir_sequence in enumerate(dir_sequences):
+            owner = _find_owner(owners, dir_sequence.container)
+            if owner is None:
+                top_level.append(index)
+            else:
+                nested_dirs[owner[0]].append(index)
+
+        for sequence in self._sequences():
+            owner = _find_owner(owners, sequence.container)
+            if owner is None:
+                continue
+            index, position = owner
+            if sequence.container == dir_sequences[index].paths[position]:
+                segments[index].setdefault(
+                    (sequence.prefix, sequence.suffix), [ ]
+                ).append((position, sequence.first.value, sequence))
+            elif len(sequence.paths) > 1:
+                nested_files[index].append(sequence)
+
+        def nest(index):
+            dir_sequence = dir_sequences[index]
+            children = [ nest(i) for i in nested_dirs[index] ]
+            for chain in segments[index].values():
+                chain.sort(key=lambda segment: segment[:2])
+                children.extend(
+                    s for s in _join_spanning(
+                        (segment[0], segment[2]) for segment in chain
+                    )
+                    if len(s.paths) > 1
+                )
+            children.extend(nested_files[index])
+            return SequenceInfo(
+                dir_sequence.paths,
+                dir_sequence.first,
+                dir_sequence.last,
+                children,
+                dir_sequence.members,
+            )
+
+        for index in top_level:
+            yield nest(index)
+
+    def _sequences(self):
+        return self._chain_sequences()
+
+    def _chain_sequences(self):
         for head in graph.extract_connected(self._all_nodes):
             sequence = self._node_chain_to_sequence(head)
             if sequence is not None:
                 yield sequence
 
+    def _collect_directories(self, container):
+        while container not in self._seen_directories:
+            self._seen_directories.add(container)
+            self._directories.collect(container)
+
+            parent = os.path.dirname(container)
+            if parent == container:
+                break
+            container = parent
+
+    def _add(self, name_info):
+        node = graph.Node(name_info)
+        self._node_lookup[lookup_key(name_info)] = node
+        self._all_nodes.append(node)
+        self._insert(node)
+
+    def _collect_if_gathered(self, path, size, mtime):
+        """
+        If `path` is a previously gathered directory, or a file inside one,
+        collects it as such and returns True.
+        """
+        container, name = os.path.split(path)
+
+        owner = self._gathered_owner(container)
+        if owner is _MIXED:
+            return True
+        if owner is not None:
+            name_info = _gathered_member(owner, path, size, mtime)
+            if name_info is not None:
+                self._add_gathered(name_info)
+            return True
+
+        if self._gathered.match(name) is not None and self._fs.isdir(path):
+            self._collect_gathered_directory(path)
+            return True
+
+        return False
+
+    def _gathered_owner(self, container):
+        try:
+            return self._gathered_owners[container]
+        except KeyError:
+            pass
+
+        bounds = self._gathered.match(os.path.basename(container))
+        owner = None
+        if bounds is not None:
+            owner = (os.path.dirname(container), bounds)
+            if not _only_members(owner, container, self._fs):
+                owner = _MIXED
+                self._mixed_gathered.append(container)
+        self._gathered_owners[container] = owner
+        return owner
+
+    def _collect_gathered_directory(self, path):
+        owner = self._gathered_owner(path)
+        if owner is _MIXED:
+            return
+        try:
+            entries = list(self._fs.scandir(path))
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.is_file():
+                name_info = _gathered_member(owner, entry.path, None, None)
+                if name_info is not None:
+                    self._add_gathered(name_info)
+
+    def _add_gathered(self, name_info):
+        self._add(name_info)
+
     def _node_chain_to_sequence(self, head):
-        paths = [ ]
+        members = [ ]
 
-        node = head # pylint
         for node in head.chain():
             if node in self._ambiguous_nodes:
                 return None
-            paths.append(node.element.path)
-
-        return SequenceInfo(paths, head.element, node.element)
+            members.append(node.element)
+
+        return self._make_sequence(members)
+
+    def _make_sequence(self, members):
+        """
+        Returns a SequenceInfo for the NameInfos `members`, in order.
+        """
+        gathered_dirs = ()
+        if self._gathered is not None:
+            counts = collections.Counter(
+                os.path.dirname(m.path) for m in members
+            )
+            counts.pop(members[0].container, None)
+            gathered_dirs = [ d for d, _ in counts.most_common() ]
+
+        return SequenceInfo(
+            (m.path for m in members),
+            members[0],
+            members[-1],
+            members = members,
+            gathered_dirs = gathered_dirs,
+        )
 
     def _insert(self, node):
         name_info = node.element
@@ -206,3 +500,254 @@ class Collector(object):
                 tuple(n.element.path for n in choices)
             )
         )
+
+
+class FieldSelectingCollector(Collector):
+    """
+    A Collector for names with more than one run of digits, that decides
+    which run is the sequence number separately for each family of names.
+
+    A family is every name in the same directory that is identical apart
+    from its digits. Every run of digits in every name is indexed as a
+    candidate, under a set key that already distinguishes it from the other
+    runs, so indexing is linear in the number of files times the number of
+    runs per name. Once collection is done, each family uses the run that
+    places the most files in sequences of two or more, preferring fewer,
+    longer sequences, and then the last run, which is what Collector would
+    have used.
+    """
+    def __init__(
+        self,
+        progress = None,
+        hierarchical = False,
+        gathered = None,
+        fs = OS_FILESYSTEM,
+    ):
+        super().__init__(progress, hierarchical, gathered, fs)
+        # set key -> (family, field index)
+        self._fields = { }
+        self._ambiguity_keys = [ ]
+        self._selected = None
+
+    def collect(self, path, size=None, mtime=None):
+        self._progress.parsed_file()
+        self._selected = None
+
+        if (self._gathered is not None and
+                self._collect_if_gathered(path, size, mtime)):
+            return
+
+        if self._directories is not None:
+            self._collect_directories(os.path.dirname(path))
+
+        infos = extract_field_name_infos(path, size, mtime)
+        if len(infos) == 0:
+            return
+
+        family = (infos[0].container, tuple(FIELD_PATTERN.split(infos[0].name)))
+        for field, name_info in enumerate(infos):
+            self._fields[name_info.set_key] = (family, field)
+            self._add(name_info)
+
+    def has_ambiguities(self):
+        return any(True for _ in self.ambiguities())
+
+    def ambiguities(self):
+        selected = self._select_fields()
+        for key, ambiguity in zip(self._ambiguity_keys, self._ambiguities):
+            family, field = self._fields[key]
+            if selected[family] == field:
+                yield ambiguity
+
+    def _sequences(self):
+        selected = self._select_fields()
+        for sequence in self._chain_sequences():
+            family, field = self._fields[sequence.first.set_key]
+            if selected[family] == field:
+                yield sequence
+
+    def _select_fields(self):
+        if self._selected is not None:
+            return self._selected
+
+        # family -> field -> [ files in sequences, -number of sequences ]
+        scores = collections.defaultdict(dict)
+        # every field scores, so that one with no sequences can be selected
+        for family, field in self._fields.values():
+            scores[family].setdefault(field, [ 0, 0 ])
+        for sequence in self._chain_sequences():
+            if len(sequence.paths) > 1:
+                family, field = self._fields[sequence.first.set_key]
+                score = scores[family][field]
+                score[0] += len(sequence.paths)
+                score[1] -= 1
+
+        self._selected = {
+            family: max(
+                field_scores,
+                key = lambda field: (field_scores[field], field)
+            )
+            for family, field_scores in scores.items()
+        }
+        return self._selected
+
+    def _add_gathered(self, name_info):
+        # previously gathered directories were named after the last run of
+        # digits, so that's the field their members are in
+        family = (name_info.container, tuple(FIELD_PATTERN.split(name_info.name)))
+        field = len(FIELD_PATTERN.findall(name_info.prefix))
+        self._fields[name_info.set_key] = (family, field)
+        self._add(name_info)
+
+    def _add_ambiguity(self, direction, node, choices):
+        super()._add_ambiguity(direction, node, choices)
+        self._ambiguity_keys.append(node.element.set_key)
+
+
+TEMPLATE_FIELD_PATTERNS = {
+    "name_prefix": r".*?",
+    "suffix":      r".*?",
+    "first":       r"\d+",
+    "last":        r"\d+",
+    "field":       r"#+",
+}
+class GatheredDirectoryPattern(object):
+    """
+    Recognizes the names of directories created from a directory template,
+    and recovers the prefix, suffix and range of the sequence each was
+    created for.
+
+    Only templates that start with {path_prefix} and have no path
+    separators after it can be recognized, since any other template can put
+    directories somewhere other than beside the files they were made from.
+    """
+    def __init__(self, template):
+        parts = list(string.Formatter().parse(template))
+        if len(parts) == 0 or parts[0][:2] != ("", "path_prefix"):
+            raise ValueError("Template must start with {path_prefix}")
+
+        expression = [ "^" ]
+        seen = set()
+        for index, (literal, field, _spec, _conversion) in enumerate(parts):
+            if os.sep in literal or (os.altsep and os.altsep in literal):
+                raise ValueError("Template must not contain path separators after {path_prefix}")
+            expression.append(re.escape(literal))
+
+            if field is None:
+                continue
+            if index == 0:
+                field = "name_prefix"
+            elif field not in TEMPLATE_FIELD_PATTERNS:
+                raise ValueError("Template field {%s} can't be recognized" % field)
+
+            if field in seen:
+                expression.append("(?P=%s)" % field)
+            else:
+                seen.add(field)
+                expression.append(
+                    "(?P<%s>%s)" % (field, TEMPLATE_FIELD_PATTERNS[field])
+                )
+
+        expression.append("$")
+        self._pattern = re.compile("".join(expression))
+
+    def match(self, name):
+        """
+        Returns a dict of the template fields in directory name `name`, or
+        None if it can't have been made from the template.
+        """
+        name_match = self._pattern.match(name)
+        if name_match is None:
+            return None
+        return name_match.groupdict()
+
+
+# the owner of a gathered directory that holds files not in its sequence
+_MIXED = object()
+
+
+def _only_members(owner, container, fs):
+    """
+    Returns True if every file in the gathered directory `container` is in
+    the range its name gives.
+    """
+    try:
+        entries = list(fs.scandir(container))
+    except OSError:
+        return True
+
+    return all(
+        _gathered_member(owner, entry.path, None, None) is not None
+        for entry in entries
+        if entry.is_file()
+    )
+
+
+def _gathered_member(owner, path, size, mtime):
+    parent, bounds = owner
+    name_info = extract_name_info(path, size, mtime)
+    if name_info is None:
+        return None
+
+    if (bounds.get("name_prefix", name_info.prefix) != name_info.prefix or
+            bounds.get("suffix", name_info.suffix) != name_info.suffix):
+        return None
+    if "first" in bounds and name_info.value < int(bounds["first"]):
+        return None
+    if "last" in bounds and name_info.value > int(bounds["last"]):
+        return None
+    if "field" in bounds and name_info.digit_count != len(bounds["field"]):
+        return None
+
+    return name_info._replace(
+        container = parent,
+        set_key = (parent, name_info.prefix, name_info.suffix),
+    )
+
+
+def _find_owner(owners, path):
+    while True:
+        owner = owners.get(path)
+        if owner is not None:
+            return owner
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _join_spanning(sequences):
+    """
+    Joins file sequences from consecutive directories where the numbering of
+    one continues on from the previous. `sequences` are (position, sequence)
+    tuples, where position is that of the sequence's directory in its
+    directory sequence. They must all share a prefix and suffix, and be in
+    directory order.
+    """
+    run = [ ]
+    last_position = None
+    for position, sequence in sequences:
+        if len(run) > 0 and (
+                position != last_position + 1 or
+                not is_successor(run[-1].last, sequence.first)):
+            yield _spanning_sequence(run)
+            run = [ ]
+        run.append(sequence)
+        last_position = position
+
+    if len(run) > 0:
+        yield _spanning_sequence(run)
+
+
+def _spanning_sequence(run):
+    if len(run) == 1:
+        return run[0]
+
+    return SequenceInfo(
+        (path for sequence in run for path in sequence.paths),
+        run[0].first,
+        run[-1].last,
+        run,
+        (member for sequence in run for member in sequence.members),
+    )
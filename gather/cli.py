@@ -1,12 +1,23 @@
 from argparse import ArgumentParser
+import os
+import signal
 import sys
 
 from gather import (
     __version__,
+    analyze,
     core,
+    estimate,
     handlers,
+    locking,
     log,
     params,
+    profiling,
+    progress,
+    scan,
+    service,
+    shard,
+    throttle,
     util,
 )
 
@@ -33,6 +44,81 @@ def get_arg_parser():
         contents for file sets as well."""
     )
 
+    p.add_argument(
+        "-L", "--follow-links",
+        action = "store_true",
+        default = False,
+        help = """When recursing, also descend into symbolic links to
+        directories. Each directory is scanned only once, so links that form a
+        cycle are safe."""
+    )
+
+    p.add_argument(
+        "-i", "--include",
+        action = "append",
+        default = [ ],
+        metavar = "PATTERN",
+        help = """Only consider files whose names match %(metavar)s. This can
+        be specified more than once to accept names matching any of the
+        patterns. A pattern is a shell-style wildcard, unless it begins with
+        `re:`, in which case the rest is a regular expression."""
+    )
+
+    p.add_argument(
+        "-x", "--exclude",
+        action = "append",
+        default = [ ],
+        metavar = "PATTERN",
+        help = """Ignore files whose names match %(metavar)s, and when
+        recursing, don't enter directories whose names match it. Can be
+        specified more than once. Patterns have the same form as for
+        --include."""
+    )
+
+    p.add_argument(
+        "--max-depth",
+        type = int,
+        default = None,
+        metavar = "LEVELS",
+        help = """When recursing, descend at most %(metavar)s levels below
+        each directory specified on the command line. 0 only considers files
+        immediately inside them. The default is no limit."""
+    )
+
+    p.add_argument(
+        "--auto-field",
+        action = "store_true",
+        default = False,
+        help = """For names containing more than one number, such as
+        0001_shotA_v2.exr, work out which number is the sequence number
+        separately for each group of otherwise identical names, by choosing
+        the one that forms the longest sequences. Without this option the
+        last number in each name is always used."""
+    )
+
+    p.add_argument(
+        "--collector",
+        choices = util.enum_name_set(params.CollectorEngine),
+        default = params.CollectorEngine.memory.name,
+        metavar = "ENGINE",
+        help = """Specify where names are kept while looking for sequences.
+        `memory` is fastest. `sqlite` keeps the state of name analysis in a
+        temporary database on disk, in the directory named by SQLITE_TMPDIR
+        or TMPDIR, rather than in memory. The scanned paths and the plan are
+        still held in memory. It can't be used with --auto-field. """ + DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "-H", "--hierarchical",
+        action = "store_true",
+        default = False,
+        help = """Also report sequences of numbered directories, such as
+        take01 to take12, with the sequences found inside them. File
+        sequences whose numbering continues from one such directory to the
+        next are reported as a single sequence. Files are still gathered
+        within their own directories."""
+    )
+
     p.add_argument(
         "-d", "--dir",
         default = params.DEFAULT_DIR_TEMPLATE,
@@ -57,6 +143,19 @@ def get_arg_parser():
         number of the first file in the set. """ + DEFAULT_EPILOG
     )
 
+    p.add_argument(
+        "--append",
+        action = "store_true",
+        default = False,
+        help = """Recognize directories that an earlier run created with the
+        same --dir template, and add newly arrived files to them. When new
+        files extend a gathered sequence, its directory is renamed to match
+        the new first and last numbers rather than a new directory being
+        created. A gathered directory that holds files outside its range is
+        reported and left alone. Use with -r so that the files already
+        inside are found. The template must start with {path_prefix}."""
+    )
+
     p.add_argument(
         "-m", "--min",
         type = int,
@@ -66,6 +165,24 @@ def get_arg_parser():
         DEFAULT_EPILOG
     )
 
+    p.add_argument(
+        "--min-bytes",
+        type = util.parse_bytes,
+        default = 0,
+        metavar = "SIZE",
+        help = """Ignore sequences whose files total less than %(metavar)s
+        bytes. A suffix of K, M, G, T or P multiplies by powers of 1000."""
+    )
+
+    p.add_argument(
+        "--settle",
+        type = float,
+        default = 0,
+        metavar = "SECONDS",
+        help = """Ignore sequences in which any file was modified in the last
+        %(metavar)s seconds, as they may still be being written."""
+    )
+
     p.add_argument(
         "-a", "--ambiguities",
         choices = util.enum_name_set(params.AmbiguityBehavior),
@@ -105,6 +222,133 @@ def get_arg_parser():
         DEFAULT_EPILOG
     )
 
+    p.add_argument(
+        "--rollback-workers",
+        type = int,
+        default = 1,
+        metavar = "COUNT",
+        help = """Roll back with up to %(metavar)s concurrent filesystem
+        operations. Moves back into or out of the same directory run
+        concurrently, while each directory is only removed once everything
+        has been moved out of it. This can shorten rollback considerably on
+        network filesystems. """ + DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "--engine",
+        choices = util.enum_name_set(params.ExecutionEngine),
+        default = params.ExecutionEngine.dirfd.name,
+        metavar = "ENGINE",
+        help = """Specify how files are moved. `dirfd` renames files relative
+        to open directory handles, which saves looking up every directory in
+        every path again, and falls back to `path` on platforms that don't
+        support it. `path` moves each file by its full path. `uring` submits
+        renames in batches through io_uring, on Linux 5.15 or later, and
+        falls back to `dirfd` elsewhere.  """ +
+        DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "--lock-dir",
+        default = None,
+        metavar = "DIR",
+        help = """Coordinate with other gather processes working on the same
+        tree, by locking each directory files are moved from or to through a
+        lock file in %(metavar)s. Sequences whose directories another process
+        has locked are skipped rather than waited for, as are sequences whose
+        files have gone by the time their directories are locked. For workers
+        on several hosts, %(metavar)s must be on a filesystem that supports
+        POSIX locks across hosts, such as NFS, and every host must mount the
+        tree at the same path. The directory is created if necessary."""
+    )
+
+    p.add_argument(
+        "--shard",
+        type = shard.parse_shard,
+        default = None,
+        metavar = "INDEX/COUNT",
+        help = """Gather only one of COUNT disjoint shares of the sequences,
+        numbered from 0, so that one run over a large tree can be split
+        between processes or hosts that each run with the same options and a
+        different INDEX. The tree is divided by hashing the directories
+        --shard-depth levels below each directory specified on the command
+        line, and each process only scans its own. The --dir template must
+        start with {path_prefix} and have no path separators, so that every
+        sequence is gathered beside its files."""
+    )
+
+    p.add_argument(
+        "--shard-depth",
+        type = int,
+        default = 1,
+        metavar = "LEVELS",
+        help = """With --shard, divide the tree at %(metavar)s levels below
+        each directory specified on the command line. Deeper levels balance
+        the shares better in trees with few directories at the top. """ +
+        DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "--json-summary",
+        default = None,
+        metavar = "FILE",
+        help = """Write a summary of the run to %(metavar)s as JSON,
+        including the new directories made. Summaries from each share of a
+        run with --shard can be merged with `python -m gather.shard`."""
+    )
+
+    p.add_argument(
+        "--serve",
+        default = None,
+        metavar = "SOCKET",
+        help = """Instead of gathering, run as a service that keeps the
+        sequences below PATHS indexed, and answers queries about them, or
+        gathers them on request, over a Unix domain socket created at
+        %(metavar)s. See `gather.service` for the requests it accepts.
+        Requires -r."""
+    )
+
+    p.add_argument(
+        "--refresh-interval",
+        type = float,
+        default = 30.0,
+        metavar = "SECONDS",
+        help = """With --serve, check for changes to the indexed directories
+        every %(metavar)s seconds. Only directories whose modification times
+        have changed are listed again. """ + DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "--max-ops-per-sec",
+        type = float,
+        default = None,
+        metavar = "RATE",
+        help = """Perform at most %(metavar)s filesystem operations per second,
+        counting each directory listing while scanning, and each move or
+        directory creation while gathering."""
+    )
+
+    p.add_argument(
+        "--max-bytes-per-sec",
+        type = util.parse_bytes,
+        default = None,
+        metavar = "SIZE",
+        help = """Move at most %(metavar)s bytes of files per second. Only
+        moves between filesystems, which copy the files, are counted.
+        Suffixes are accepted as for --min-bytes. Sizes are only known when
+        they are needed by some other option, such as --summary or
+        --progress, so this turns on reading them."""
+    )
+
+    p.add_argument(
+        "--adaptive",
+        action = "store_true",
+        default = False,
+        help = """Slow down when filesystem operations start taking
+        noticeably longer than usual, such as when a shared file server is
+        under load, and speed back up when they recover."""
+    )
+
     p.add_argument(
         "-n", "--dry-run",
         action = "store_true",
@@ -112,6 +356,37 @@ def get_arg_parser():
         help = """List proposed changes without making them."""
     )
 
+    p.add_argument(
+        "--estimate",
+        action = "store_true",
+        default = False,
+        help = """Instead of gathering, scan and analyze a random sample of
+        the directories below PATHS, and report how many files and sequences
+        a run would find and move, with 95%% confidence intervals, and how
+        long it would take. Requires -r. Nothing is moved, so moves are
+        projected at a fixed time for each file, of a rename on a local
+        disk."""
+    )
+
+    p.add_argument(
+        "--sample",
+        type = float,
+        default = 0.01,
+        metavar = "FRACTION",
+        help = """With --estimate, the fraction of directories to sample.
+        Directories are sampled at the shallowest level with at least 100 of
+        them, and everything above that level is scanned in full. """ +
+        DEFAULT_EPILOG
+    )
+
+    p.add_argument(
+        "--seed",
+        type = int,
+        default = None,
+        help = """With --estimate, seed the random sample, so that the same
+        directories are chosen each time."""
+    )
+
     p.add_argument(
         "-v", "--verbose",
         action = "count",
@@ -126,6 +401,34 @@ def get_arg_parser():
         help = """Decrease logging level."""
     )
 
+    p.add_argument(
+        "-S", "--summary",
+        action = "store_true",
+        default = False,
+        help = """Report one line per sequence moved, instead of listing every
+        file."""
+    )
+
+    p.add_argument(
+        "-P", "--progress",
+        action = "store_true",
+        default = False,
+        help = """Report counts, rates and an estimated time remaining to
+        standard error while scanning and moving files. On a terminal the
+        report is redrawn at most 4 times a second, otherwise a line is
+        written every few seconds. Best combined with -q."""
+    )
+
+    p.add_argument(
+        "--profile",
+        default = None,
+        metavar = "DIR",
+        help = """Profile each phase of the run with cProfile and tracemalloc,
+        and write the statistics, the largest allocations and a summary of
+        time and memory use per phase to %(metavar)s. This slows the run down
+        considerably, but doesn't change what it does."""
+    )
+
     p.add_argument(
         "--version",
         action="version",
@@ -147,14 +450,102 @@ LOG_LEVELS = (
     log.DEBUG,
 )
 def run(argv1=None):
-    args = get_arg_parser().parse_args(argv1)
+    parser = get_arg_parser()
+    args = parser.parse_args(argv1)
+
+    if args.auto_field and args.collector == params.CollectorEngine.sqlite.name:
+        parser.error("--auto-field can't be used with --collector sqlite")
+
+    if args.append:
+        try:
+            analyze.GatheredDirectoryPattern(args.dir)
+        except ValueError as error:
+            parser.error("--append: %s" % error)
+
+    if args.rollback_workers < 1:
+        parser.error("--rollback-workers must be at least 1")
+
+    if args.shard_depth < 0:
+        parser.error("--shard-depth must not be negative")
+
+    if args.max_ops_per_sec is not None and args.max_ops_per_sec <= 0:
+        parser.error("--max-ops-per-sec must be more than 0")
+    if args.max_bytes_per_sec is not None and args.max_bytes_per_sec <= 0:
+        parser.error("--max-bytes-per-sec must be more than 0")
+
+    if args.serve is not None:
+        if not args.recurse:
+            parser.error("--serve requires -r")
+        if args.estimate or args.shard is not None:
+            parser.error("--serve can't be used with --estimate or --shard")
+        if args.refresh_interval <= 0:
+            parser.error("--refresh-interval must be positive")
+
+    if args.estimate and not args.recurse:
+        parser.error("--estimate requires -r")
+    if args.estimate and args.shard is not None:
+        parser.error("--estimate can't be used with --shard")
+    if not 0 < args.sample <= 1:
+        parser.error("--sample must be more than 0 and at most 1")
+
+    meter = make_progress_meter() if args.progress else None
+
+    name_filter = scan.NameFilter(args.include, args.exclude)
+
+    # sizes and times are only read if something will use them
+    capture_stat = (
+        args.progress or
+        args.summary or
+        args.min_bytes > 0 or
+        args.settle > 0 or
+        args.max_bytes_per_sec is not None or
+        args.json_summary is not None
+    )
+
+    io_throttle = None
+    if (args.max_ops_per_sec is not None or
+            args.max_bytes_per_sec is not None or
+            args.adaptive):
+        io_throttle = throttle.Throttle(
+            max_ops_per_sec = args.max_ops_per_sec,
+            max_bytes_per_sec = args.max_bytes_per_sec,
+            backoff = throttle.AdaptiveBackoff() if args.adaptive else None,
+        )
 
-    paths = (
-        util.recurse_file_iterator(args.paths)
-        if args.recurse
-        else args.paths
+    run_shard = None
+    if args.shard is not None:
+        index, count = args.shard
+        try:
+            run_shard = shard.Shard(
+                index,
+                count,
+                args.dir,
+                depth = args.shard_depth,
+                hierarchical = args.hierarchical,
+            )
+        except ValueError as error:
+            parser.error("--shard: %s" % error)
+
+    scan_options = dict(
+        follow_links = args.follow_links,
+        progress = meter,
+        name_filter = name_filter,
+        max_depth = args.max_depth,
+        capture_stat = capture_stat,
+        throttle = io_throttle,
+        shard = run_shard,
     )
 
+    if args.recurse:
+        paths = scan.recurse_file_iterator(args.paths, **scan_options)
+    else:
+        paths = scan.filter_paths(
+            args.paths,
+            name_filter,
+            capture_stat,
+            shard = run_shard,
+        )
+
     log_level = decide_log_level(LOG_LEVELS, log.INFO, args.verbose, args.quiet)
 
     logger = log.Logger(min_level=log_level)
@@ -165,19 +556,102 @@ def run(argv1=None):
         shared_directory_behavior = params.SharedDirectoryBehavior[args.shared],
         rollback_behavior = params.RollbackBehavior[args.rollback],
         dry_run = args.dry_run,
+        hierarchical = args.hierarchical,
+        min_bytes = args.min_bytes,
+        settle_seconds = args.settle,
+        engine = params.ExecutionEngine[args.engine],
+        auto_field = args.auto_field,
+        append = args.append,
+        collector = params.CollectorEngine[args.collector],
+        rollback_workers = args.rollback_workers,
     )
 
-    handler = handlers.CliReporter(config, logger)
-
-    result = core.gather(
-        paths = paths,
-        config = config,
-        handler = handler,
+    if args.estimate:
+        if meter is not None:
+            meter.begin_scan()
+        result = estimate.estimate(
+            args.paths,
+            config,
+            fraction = args.sample,
+            seed = args.seed,
+            **scan_options
+        )
+        if meter is not None:
+            meter.finish()
+        for warning in result.warnings:
+            logger.warning(warning)
+        for line in estimate.describe(result):
+            logger.info(line)
+        return 0
+
+    if args.serve is not None:
+        sequence_service = service.SequenceService(
+            args.paths,
+            config,
+            interval = args.refresh_interval,
+            **scan_options
+        )
+        # stop cleanly, removing the socket, when asked to by a service manager
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            sequence_service.serve(args.serve)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    reporter_class = (
+        handlers.SummaryReporter
+        if args.summary
+        else handlers.CliReporter
     )
+    handler = reporter_class(config, logger)
+
+    summary = None
+    if args.json_summary is not None:
+        summary = shard.ShardSummary(config, args.paths, run_shard)
+        handler = handlers.HandlerChain(handler, summary)
+
+    directory_locks = None
+    if args.lock_dir is not None:
+        os.makedirs(args.lock_dir, exist_ok=True)
+        directory_locks = locking.DirectoryLocks(args.lock_dir)
+
+    profiler = (
+        profiling.PhaseProfiler(args.profile)
+        if args.profile is not None
+        else None
+    )
+
+    result = None
+    try:
+        result = core.gather(
+            paths = paths,
+            config = config,
+            handler = handler,
+            progress = meter,
+            throttle = io_throttle,
+            profiler = profiler,
+            locks = directory_locks,
+        )
+    finally:
+        if profiler is not None:
+            profiler.finish()
+        if summary is not None:
+            summary.write(args.json_summary, result)
 
     return result.value
 
 
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def make_progress_meter():
+    if sys.stderr.isatty():
+        return progress.ProgressMeter(sys.stderr, interval=0.25)
+    return progress.ProgressMeter(sys.stderr, interval=5.0)
+
+
 def decide_log_level(selectable_levels, default_level, verbose, quiet):
     index = max(
         0,
@@ -1,51 +1,137 @@
+import collections
+import functools
 import os
+import time
 
-from gather.analyze import Collector
+from gather.analyze import (
+    Collector,
+    FieldSelectingCollector,
+    GatheredDirectoryPattern,
+)
+from gather.fs import OS_FILESYSTEM
 from gather.handlers import NoOpHandler
+from gather.locking import NoOpLocks
+from gather.ondisk import SqliteCollector
 from gather.params import (
     AmbiguityBehavior,
     CancelReason,
+    CollectorEngine,
+    Conflict,
+    ExecutionEngine,
     GatherResult,
     RollbackBehavior,
     SharedDirectoryBehavior,
+    SkipReason,
 )
+from gather.profiling import NoOpProfiler
+from gather.progress import NoOpProgress
 from gather.transaction import (
+    DIRFD_SUPPORTED,
+    DirFdTransaction,
     DryRunner,
     FilesystemTransaction,
     RollbackError,
+    UringTransaction,
 )
+from gather.uring import uring_supported
 import gather.util as util
 
 
-def gather(paths, config, handler=None):
+def gather(
+    paths,
+    config,
+    handler = None,
+    progress = None,
+    throttle = None,
+    profiler = None,
+    locks = None,
+    fs = OS_FILESYSTEM,
+):
     if handler is None:
         handler = NoOpHandler()
+    if progress is None:
+        progress = NoOpProgress()
+    if profiler is None:
+        profiler = NoOpProfiler()
 
-    collector = Collector()
-    collector.collect_all(paths)
+    progress.begin_scan()
+    collector = make_collector(config, progress, fs)
 
-    plan, cancel_reasons = generate_plan(
-        collector,
-        sequence_name_generator(config.dir_template),
-        config.min_sequence_length,
-        config.ambiguity_behavior,
-        config.shared_directory_behavior,
-        handler,
-    )
+    try:
+        with profiler.phase("collect"):
+            collector.collect_all(paths)
+
+        progress.begin_analysis()
+        if config.collector == CollectorEngine.sqlite:
+            # streamed from disk while the plan is generated, rather than
+            # all held in memory at once
+            sequences = collector.sequences()
+        else:
+            with profiler.phase("sequences"):
+                sequences = list(collector.sequences())
+
+        with profiler.phase("generate_plan"):
+            plan, cancel_reasons = generate_plan(
+                collector,
+                sequence_name_generator(config.dir_template),
+                config.min_sequence_length,
+                config.ambiguity_behavior,
+                config.shared_directory_behavior,
+                handler,
+                min_bytes = config.min_bytes,
+                settle_seconds = config.settle_seconds,
+                sequences = sequences,
+                fs = fs,
+            )
+    finally:
+        collector.close()
 
     if config.dry_run:
         transactor = DryRunner()
+        locks = None
     else:
         if len(cancel_reasons) > 0:
+            progress.finish()
             return GatherResult.cancel
-        transactor = FilesystemTransaction()
+        transactor = make_transaction(
+            config.engine,
+            throttle,
+            fs,
+            config.rollback_workers,
+        )
+
+    try:
+        with profiler.phase("execute_plan"):
+            return execute_plan(
+                plan,
+                transactor,
+                config.rollback_behavior,
+                handler,
+                progress,
+                locks,
+                fs,
+            )
+    finally:
+        transactor.close()
+        progress.finish()
+
 
-    return execute_plan(
-        plan,
-        transactor,
-        config.rollback_behavior,
-        handler,
+def make_collector(config, progress=None, fs=OS_FILESYSTEM):
+    """
+    Returns the Collector that `config` asks for.
+    """
+    if config.collector == CollectorEngine.sqlite:
+        collector_class = SqliteCollector
+    elif config.auto_field:
+        collector_class = FieldSelectingCollector
+    else:
+        collector_class = Collector
+    gathered = (
+        GatheredDirectoryPattern(config.dir_template)
+        if config.append
+        else None
     )
+    return collector_class(progress, config.hierarchical, gathered, fs=fs)
 
 
 def generate_plan(
@@ -55,23 +141,64 @@ def generate_plan(
     ambiguity_behavior,
     shared_directory_behavior,
     handler,
+    min_bytes = 0,
+    settle_seconds = 0,
+    now = None,
+    sequences = None,
+    fs = OS_FILESYSTEM,
 ):
     plan = [ ]
     cancel_reasons = set()
 
+    nested = list(collector.directory_sequences())
+    if len(nested) > 0:
+        handler.handle_directory_sequences(nested)
+
+    mixed = collector.mixed_gathered_directories()
+    if len(mixed) > 0:
+        handler.handle_mixed_gathered_directories(mixed)
+
     if collector.has_ambiguities():
         handler.handle_ambiguities(collector.ambiguities())
         if ambiguity_behavior == AmbiguityBehavior.cancel:
             cancel_reasons.add(CancelReason.ambiguities)
 
+    if sequences is None:
+        sequences = collector.sequences()
+
     qualifying, rejected = util.filter_partition(
         lambda s: len(s.paths) >= min_sequence_length,
-        collector.sequences()
+        sequences
     )
 
     if len(rejected) > 0:
         handler.handle_rejected_sequences(rejected)
 
+    # sequences whose files can't all be found are not eligible
+    if min_bytes > 0:
+        qualifying, small = util.filter_partition(
+            lambda s: (
+                _stat_sequence(s, fs).size is not None and
+                s.size >= min_bytes
+            ),
+            qualifying
+        )
+        if len(small) > 0:
+            handler.handle_small_sequences(small)
+
+    if settle_seconds > 0:
+        if now is None:
+            now = time.time()
+        qualifying, unsettled = util.filter_partition(
+            lambda s: (
+                _stat_sequence(s, fs).newest_mtime is not None and
+                now - s.newest_mtime >= settle_seconds
+            ),
+            qualifying
+        )
+        if len(unsettled) > 0:
+            handler.handle_unsettled_sequences(unsettled)
+
     for parent, dir_sequences in util.group(qualifying, key_function=sequence_namer):
         if len(dir_sequences) > 1:
             handler.handle_shared_sequences(parent, dir_sequences)
@@ -81,7 +208,18 @@ def generate_plan(
                     cancel_reasons.add(CancelReason.shared_directories)
                 continue
 
-        plan.extend((parent, sequence.paths) for sequence in dir_sequences)
+        plan.extend(
+            (parent, sequence) for sequence in dir_sequences
+            if not is_gathered(parent, sequence)
+        )
+
+    # keep moves out of the same directory together
+    plan.sort(key=lambda item: item[1].container)
+
+    conflicts = find_conflicts(plan, fs)
+    if len(conflicts) > 0:
+        handler.handle_conflicts(conflicts)
+        cancel_reasons.add(CancelReason.destination_conflicts)
 
     if len(cancel_reasons) > 0:
         handler.handle_cancel_reasons(cancel_reasons)
@@ -91,19 +229,277 @@ def generate_plan(
     return plan, cancel_reasons
 
 
-def execute_plan(plan, transactor, error_behavior, handler):
+def _stat_sequence(sequence, fs):
+    """
+    Fills in the size and newest modification time of `sequence` from
+    `fs`, if they weren't captured while scanning, and returns it. They are
+    left None if any of its files can't be found.
+    """
+    if sequence.size is not None and sequence.newest_mtime is not None:
+        return sequence
+
+    try:
+        stats = [ fs.stat(path) for path in sequence.paths ]
+    except OSError:
+        return sequence
+    sequence.size = sum(st.st_size for st in stats)
+    sequence.newest_mtime = max(st.st_mtime for st in stats)
+    return sequence
+
+
+def is_gathered(parent, sequence):
+    """
+    Returns True if `sequence` has already been gathered into `parent`, so
+    there is nothing to do.
+    """
+    return (
+        len(sequence.gathered_dirs) == 1 and
+        sequence.gathered_dirs[0] == parent and
+        all(os.path.dirname(p) == parent for p in sequence.paths)
+    )
+
+
+def planned_moves(parent, sequence):
+    """
+    Yields a (path, size) tuple for each file in `sequence` that has to be
+    moved into `parent`. When adding to a previously gathered directory,
+    that directory is renamed to `parent`, so its files are not included.
+    """
+    base = sequence.gathered_dirs[0] if sequence.gathered_dirs else None
+
+    if len(sequence.members) == len(sequence.paths):
+        moves = ((m.path, m.size) for m in sequence.members)
+    else:
+        moves = ((path, None) for path in sequence.paths)
+
+    if base is None:
+        return moves
+    return (
+        (path, size) for path, size in moves
+        if os.path.dirname(path) != base
+    )
+
+
+def make_transaction(engine, throttle=None, fs=OS_FILESYSTEM, rollback_workers=1):
+    if fs is not OS_FILESYSTEM:
+        return FilesystemTransaction(throttle, fs, rollback_workers)
+    if engine == ExecutionEngine.uring and uring_supported():
+        return UringTransaction(throttle, rollback_workers=rollback_workers)
+    if engine in (ExecutionEngine.dirfd, ExecutionEngine.uring) and DIRFD_SUPPORTED:
+        return DirFdTransaction(throttle, rollback_workers=rollback_workers)
+    return FilesystemTransaction(throttle, rollback_workers=rollback_workers)
+
+
+def find_conflicts(plan, fs=OS_FILESYSTEM):
+    """
+    Finds every planned move that would fail because its destination is
+    already taken, either by another move in the plan or by something on
+    disk.
+
+    Destinations are indexed by target directory and name, and each target
+    directory is listed once, so this makes no per-file filesystem calls.
+
+    :param plan: A list of (target_dir, SequenceInfo) tuples, as generated
+      by `generate_plan`.
+    :return: A list of `gather.params.Conflict`.
+    """
+    by_parent = collections.OrderedDict()
+    renames = { }
+    conflicts = [ ]
+
+    for parent, sequence in plan:
+        names = by_parent.setdefault(parent, collections.OrderedDict())
+        for path, _ in planned_moves(parent, sequence):
+            names.setdefault(os.path.basename(path), [ ]).append(path)
+
+        if len(sequence.gathered_dirs) > 0:
+            base = sequence.gathered_dirs[0]
+            if base != parent:
+                if parent in renames:
+                    conflicts.append(Conflict(
+                        parent,
+                        (renames[parent], base),
+                        fs.lexists(parent),
+                    ))
+                elif fs.lexists(parent):
+                    conflicts.append(Conflict(parent, (base,), True))
+                renames[parent] = base
+
+    for parent, names in by_parent.items():
+        try:
+            # a previously gathered directory that will be renamed to
+            # parent holds the files that will be there
+            listed = renames.get(parent, parent)
+            existing = set(entry.name for entry in fs.scandir(listed))
+        except (FileNotFoundError, PermissionError):
+            existing = set()
+        except NotADirectoryError:
+            # something that isn't a directory is in the way of the target
+            # directory itself
+            conflicts.append(Conflict(
+                parent,
+                tuple(p for sources in names.values() for p in sources),
+                False,
+                True
+            ))
+            continue
+
+        for name, sources in names.items():
+            exists = name in existing
+            if exists or len(sources) > 1:
+                conflicts.append(Conflict(
+                    os.path.join(parent, name),
+                    tuple(sources),
+                    exists
+                ))
+
+    return conflicts
+
+
+def execute_plan(
+    plan,
+    transactor,
+    error_behavior,
+    handler,
+    progress = None,
+    locks = None,
+    fs = OS_FILESYSTEM,
+):
+    """
+    :param locks: An optional `gather.locking.DirectoryLocks`. Each
+      sequence is only moved if the directories it is moved from and to
+      can all be locked, and its files are still there once they are.
+      Otherwise it is skipped, and left for whichever process holds them.
+      With RollbackBehavior.set, the locks are released once the sequence
+      is committed. With RollbackBehavior.all, an error in any sequence
+      undoes them all, so every lock is held until the plan is done.
+    :param fs: The filesystem to check sources on, with `locks`.
+    """
+    if progress is None:
+        progress = NoOpProgress()
+    if locks is None:
+        locks = NoOpLocks()
+
+    moves = [ list(planned_moves(parent, sequence)) for parent, sequence in plan ]
+    progress.begin_execution(
+        sum(len(sequence_moves) for sequence_moves in moves),
+        sum(size or 0 for sequence_moves in moves for _, size in sequence_moves),
+    )
+
+    # per-file events cost a call per file, so only dispatch them to
+    # handlers and progress that actually do something with them
+    file_events = handler.wants_file_events()
+    progress_events = progress.wants_moved_files()
+
     rollbacks = 0
-    for parent, paths in plan:
-        handler.before_sequence_move(parent)
+    try:
+        for (parent, sequence), sequence_moves in zip(plan, moves):
+            result = _execute_sequence(
+                parent,
+                sequence,
+                sequence_moves,
+                transactor,
+                error_behavior,
+                handler,
+                progress,
+                locks,
+                file_events,
+                progress_events,
+                fs,
+            )
+            if result == GatherResult.error_full_rollback:
+                return result
+            if result is not GatherResult.ok:
+                rollbacks += 1
+    finally:
+        locks.release_all()
+
+    handler.plan_execution_complete(len(plan), rollbacks)
+    if rollbacks != 0:
+        if rollbacks == len(plan):
+            return GatherResult.error_full_rollback
+        return GatherResult.error_partial_rollback
+    return GatherResult.ok
+
+
+def _execute_sequence(
+    parent,
+    sequence,
+    sequence_moves,
+    transactor,
+    error_behavior,
+    handler,
+    progress,
+    locks,
+    file_events,
+    progress_events,
+    fs,
+):
+    """
+    Moves one sequence, returning GatherResult.ok, or the kind of rollback
+    that an error caused.
+    """
+    token = None
+
+    try:
         try:
-            transactor.mkdirp(parent)
-            for path in paths:
+            # inside the try, so that failing to open a lock file rolls back
+            # like any other error
+            if locks.shared:
+                lock_paths = set(os.path.dirname(path) for path in sequence.paths)
+                lock_paths.add(parent)
+                token = locks.acquire(lock_paths)
+                if token is None:
+                    handler.sequence_skipped(parent, sequence, SkipReason.locked)
+                    return GatherResult.ok
+
+                # another process may have moved files since the scan
+                if not _sources_exist(sequence, sequence_moves, fs):
+                    handler.sequence_skipped(parent, sequence, SkipReason.changed)
+                    return GatherResult.ok
+
+            handler.before_sequence_move(parent)
+            handler.before_sequence_batch(parent, sequence)
+
+            gathered_dirs = sequence.gathered_dirs
+            if len(gathered_dirs) > 0 and gathered_dirs[0] != parent:
+                handler.before_directory_move(gathered_dirs[0], parent)
+                transactor.mkdirp(os.path.dirname(parent))
+                transactor.move(gathered_dirs[0], parent)
+                # the files below are moved into it
+                transactor.flush()
+            else:
+                transactor.mkdirp(parent)
+
+            for path, size in sequence_moves:
                 new_path = os.path.join(parent, os.path.basename(path))
-                handler.before_file_move(path, new_path)
-                transactor.move(path, new_path)
+                # a transaction may batch moves, so these are called as they
+                # are actually made
+                transactor.move(
+                    path,
+                    new_path,
+                    size,
+                    before = (
+                        functools.partial(handler.before_file_move, path, new_path)
+                        if file_events
+                        else None
+                    ),
+                    after = (
+                        functools.partial(progress.moved_file, size or 0)
+                        if progress_events
+                        else None
+                    ),
+                )
+
+            for emptied in gathered_dirs[1:]:
+                transactor.rmdir_if_empty(emptied)
+
+            transactor.flush()
+
             if error_behavior == RollbackBehavior.set:
                 transactor.commit()
             handler.after_sequence_move(parent)
+            return GatherResult.ok
 
         except OSError as ose:
             try:
@@ -112,19 +508,24 @@ def execute_plan(plan, transactor, error_behavior, handler):
                 handler.after_rollback()
                 if error_behavior == RollbackBehavior.all:
                     return GatherResult.error_full_rollback
-                else:
-                    rollbacks += 1
+                return GatherResult.error_partial_rollback
 
             except RollbackError as re:
                 handler.rollback_error(re)
                 raise re
 
-    handler.plan_execution_complete(len(plan), rollbacks)
-    if rollbacks != 0:
-        if rollbacks == len(plan):
-            return GatherResult.error_full_rollback
-        return GatherResult.error_partial_rollback
-    return GatherResult.ok
+    finally:
+        # with RollbackBehavior.all, a later error undoes this sequence too,
+        # so its locks are held until execute_plan releases them all
+        if token is not None and error_behavior == RollbackBehavior.set:
+            locks.release(token)
+
+
+def _sources_exist(sequence, sequence_moves, fs):
+    gathered_dirs = sequence.gathered_dirs
+    if len(gathered_dirs) > 0 and not fs.isdir(gathered_dirs[0]):
+        return False
+    return all(fs.lexists(path) for path, _ in sequence_moves)
 
 
 def sequence_name_generator(template):
@@ -0,0 +1,308 @@
+"""
+Estimates what a run would do, from a sample of a tree's directories.
+
+The tree is treated as a set of clusters: the directories at the shallowest
+level that has at least `min_clusters` of them. Everything above that level
+is listed in full, and a random sample of the clusters is scanned in full
+and analyzed as a normal run would. Sequences never span directories, so
+each cluster can be analyzed on its own, and totals are extrapolated with
+the usual estimator for one-stage cluster sampling.
+"""
+
+import collections
+import math
+import random
+import stat
+import time
+
+from gather.core import (
+    generate_plan,
+    make_collector,
+    planned_moves,
+    sequence_name_generator,
+)
+from gather.fs import OS_FILESYSTEM
+from gather.handlers import NoOpHandler
+from gather.params import CollectorEngine
+from gather.scan import Scanner, VisitedSet
+import gather.util as util
+
+
+__all__ = ("Estimate", "Interval", "describe", "estimate")
+
+
+# for 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+# the time to move one file, a rename within a local filesystem, by which
+# moves are projected. the estimate makes no changes, so it can't time them.
+# network filesystems, and moves between filesystems, take longer
+MOVE_SECONDS = 0.0001
+
+
+Interval = collections.namedtuple(
+    "Interval", (
+        "value",
+        "margin",
+    )
+)
+
+
+class Estimate(object):
+    """
+    :ivar cluster_count: The number of clusters in the tree.
+    :ivar sampled_count: The number of them that were scanned.
+    :ivar elapsed: Seconds taken to make the estimate.
+    :ivar totals: A dict of an `Interval` for each measure: "files",
+      "sequences", "moved_files", "bytes" and "seconds", the time a run
+      would take to scan and analyze the tree.
+    :ivar move_seconds: An `Interval` for the time a run would take to move
+      the files.
+    :ivar seconds_per_move: The time each move was projected to take.
+    :ivar warnings: A list of messages about options and paths the estimate
+      could not account for.
+    """
+    def __init__(
+        self,
+        cluster_count,
+        sampled_count,
+        elapsed,
+        totals,
+        move_seconds,
+        warnings = None,
+        seconds_per_move = MOVE_SECONDS,
+    ):
+        self.cluster_count = cluster_count
+        self.sampled_count = sampled_count
+        self.elapsed = elapsed
+        self.totals = totals
+        self.move_seconds = move_seconds
+        self.warnings = warnings or [ ]
+        self.seconds_per_move = seconds_per_move
+
+
+MEASURES = ("files", "sequences", "moved_files", "bytes", "seconds")
+
+
+def estimate(
+    roots,
+    config,
+    fraction = 0.01,
+    min_clusters = 100,
+    seed = None,
+    fs = OS_FILESYSTEM,
+    seconds_per_move = MOVE_SECONDS,
+    **scan_options
+):
+    """
+    :param roots: Directories to estimate a recursive run over. Files given
+      here are counted in full, as part of the levels above the clusters.
+    :param config: The `gather.params.Config` the run would use.
+    :param fraction: The fraction of clusters to sample. At least two are
+      sampled, if there are two.
+    :param seconds_per_move: The time to project for moving each file.
+    :param scan_options: Options for `gather.scan.Scanner`.
+
+    Nothing is changed on the filesystem.
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    warnings = [ ]
+    if config.collector == CollectorEngine.sqlite:
+        warnings.append(MSG_ESTIMATE_COLLECTOR)
+    max_depth = scan_options.pop("max_depth", None)
+    scanner = Scanner(fs=fs, **scan_options)
+    visited = VisitedSet()
+
+    # the levels above the clusters, which are always listed in full
+    certain_start = time.perf_counter()
+    certain_files = [ ]
+    level = [ ]
+    for root in roots:
+        try:
+            st = fs.stat(root)
+        except OSError:
+            continue
+        if not visited.add(st.st_dev, st.st_ino):
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            level.append((root, st.st_dev))
+        else:
+            certain_files.extend(scanner.files([ root ]))
+
+    depth = 0
+    clusters = [ ]
+    while len(level) > 0:
+        if len(level) >= min_clusters and depth > 0:
+            clusters = level
+            break
+        descend = max_depth is None or depth < max_depth
+        next_level = [ ]
+        for container, dev in level:
+            files, subdirs = scanner.list_directory(container, dev, visited, descend)
+            certain_files.extend(files)
+            next_level.extend(subdirs)
+        level = next_level
+        depth += 1
+
+    certain = _measure(certain_files, config, fs)
+    certain["seconds"] = time.perf_counter() - certain_start
+
+    sample_size = min(len(clusters), max(2, int(math.ceil(fraction * len(clusters)))))
+    sampled = rng.sample(clusters, sample_size)
+
+    cluster_scanner = Scanner(
+        max_depth = None if max_depth is None else max_depth - depth,
+        fs = fs,
+        **scan_options
+    )
+    measurements = [ ]
+    for container, _ in sampled:
+        cluster_start = time.perf_counter()
+        files = list(cluster_scanner.files([ container ]))
+        measurement = _measure(files, config, fs)
+        measurement["seconds"] = time.perf_counter() - cluster_start
+        measurements.append(measurement)
+
+    totals = {
+        measure: _extrapolate(
+            certain[measure],
+            [ m[measure] for m in measurements ],
+            len(clusters),
+        )
+        for measure in MEASURES
+    }
+
+    move_seconds = Interval(
+        totals["moved_files"].value * seconds_per_move,
+        None
+        if totals["moved_files"].margin is None
+        else totals["moved_files"].margin * seconds_per_move,
+    )
+
+    return Estimate(
+        len(clusters),
+        len(sampled),
+        time.perf_counter() - start,
+        totals,
+        move_seconds,
+        warnings,
+        seconds_per_move,
+    )
+
+
+def _measure(files, config, fs):
+    """
+    Analyzes `files` as a dry run would, and returns what it found.
+    """
+    collector = make_collector(
+        config._replace(collector=CollectorEngine.memory),
+        fs = fs,
+    )
+    collector.collect_all(files)
+
+    plan, _ = generate_plan(
+        collector,
+        sequence_name_generator(config.dir_template),
+        config.min_sequence_length,
+        config.ambiguity_behavior,
+        config.shared_directory_behavior,
+        NoOpHandler(),
+        min_bytes = config.min_bytes,
+        settle_seconds = config.settle_seconds,
+        fs = fs,
+    )
+
+    moves = [
+        (path, size)
+        for parent, sequence in plan
+        for path, size in planned_moves(parent, sequence)
+    ]
+    return {
+        "files": len(files),
+        "sequences": len(plan),
+        "moved_files": len(moves),
+        "bytes": sum(size or 0 for _, size in moves),
+    }
+
+
+def _extrapolate(certain, sample, cluster_count):
+    """
+    Estimates a total from the exact total over the certain levels, and
+    per-cluster totals from a simple random sample of the clusters.
+    """
+    sample_count = len(sample)
+    if sample_count == 0:
+        return Interval(certain, 0)
+
+    mean = sum(sample) / sample_count
+    value = certain + cluster_count * mean
+    if sample_count == cluster_count:
+        return Interval(value, 0)
+    if sample_count < 2:
+        return Interval(value, None)
+
+    variance = sum((y - mean) ** 2 for y in sample) / (sample_count - 1)
+    finite_population = 1 - sample_count / cluster_count
+    margin = CONFIDENCE_Z * cluster_count * math.sqrt(
+        finite_population * variance / sample_count
+    )
+    return Interval(value, margin)
+
+
+def describe(result):
+    """
+    Returns lines of text describing an `Estimate`.
+    """
+    def number(interval, formatter=_format_count):
+        if interval.margin is None:
+            return "%s (too few samples for a range)" % formatter(interval.value)
+        if interval.margin == 0:
+            return formatter(interval.value)
+        return "%s +/- %s" % (formatter(interval.value), formatter(interval.margin))
+
+    totals = result.totals
+    run_seconds = Interval(
+        totals["seconds"].value + result.move_seconds.value,
+        None
+        if totals["seconds"].margin is None or result.move_seconds.margin is None
+        else totals["seconds"].margin + result.move_seconds.margin,
+    )
+
+    lines = [
+        MSG_ESTIMATE_HEADER.format(
+            sampled = result.sampled_count,
+            clusters = result.cluster_count,
+            elapsed = _format_seconds(result.elapsed),
+        ),
+        "  files:          " + number(totals["files"]),
+        "  sequences:      " + number(totals["sequences"]),
+        "  files to move:  " + number(totals["moved_files"]),
+    ]
+    if totals["bytes"].value > 0:
+        lines.append("  size to move:   " + number(totals["bytes"], util.format_bytes))
+    lines.extend([
+        "  scan and plan:  " + number(totals["seconds"], _format_seconds),
+        "  moves:          " + number(result.move_seconds, _format_seconds),
+        "  projected run:  " + number(run_seconds, _format_seconds),
+        MSG_ESTIMATE_CONFIDENCE.format(
+            seconds_per_move = "%gms" % (result.seconds_per_move * 1000),
+        ),
+    ])
+    return lines
+
+
+MSG_ESTIMATE_HEADER = "Estimated from {sampled} of {clusters} directories in {elapsed}:"
+MSG_ESTIMATE_CONFIDENCE = "Ranges are 95% confidence intervals. Moves are projected at {seconds_per_move} each."
+MSG_ESTIMATE_COLLECTOR = "Names are analyzed in memory for the estimate, so the time to scan and plan with --collector sqlite will be longer."
+
+
+def _format_count(value):
+    return "{:,}".format(int(round(value)))
+
+
+def _format_seconds(seconds):
+    # estimates of short runs would all be 0:00:00 otherwise
+    if seconds < 60:
+        return "%.2fs" % seconds
+    return util.format_duration(seconds)
@@ -0,0 +1,337 @@
+"""
+Filesystem backends for scanning and for executing plans.
+
+`OsFilesystem` is the real filesystem. `MemoryFilesystem` keeps a tree in
+memory, so that planning and execution can be run at scale without creating
+real files, and can be made to fail chosen operations.
+"""
+
+import collections
+import errno
+import os
+import shutil
+import stat
+import time
+
+
+__all__ = ("MemoryFilesystem", "MemoryStat", "OsFilesystem", "OS_FILESYSTEM")
+
+
+class OsFilesystem(object):
+    def scandir(self, path):
+        return os.scandir(path or os.curdir)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def lstat(self, path):
+        return os.lstat(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def lexists(self, path):
+        return os.path.lexists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def move(self, src, dest):
+        shutil.move(src, dest)
+
+OS_FILESYSTEM = OsFilesystem()
+
+
+MemoryStat = collections.namedtuple(
+    "MemoryStat", (
+        "st_mode",
+        "st_ino",
+        "st_dev",
+        "st_size",
+        "st_mtime",
+    )
+)
+
+MEMORY_DEVICE = 1
+DIRECTORY_MODE = stat.S_IFDIR | 0o755
+FILE_MODE = stat.S_IFREG | 0o644
+
+
+class _Directory(dict):
+    """
+    The entries of a directory, by name. Each is a _Directory, or the inode
+    number of a file.
+    """
+    __slots__ = ("ino", "mtime")
+
+
+class _MemoryDirEntry(object):
+    __slots__ = ("name", "path", "_fs", "_node")
+
+    def __init__(self, fs, container, name, node):
+        self.name = name
+        self.path = os.path.join(container, name)
+        self._fs = fs
+        self._node = node
+
+    def is_dir(self, follow_symlinks=True):
+        return isinstance(self._node, _Directory)
+
+    def is_file(self, follow_symlinks=True):
+        return not self.is_dir()
+
+    def is_symlink(self):
+        return False
+
+    def inode(self):
+        return self._node.ino if self.is_dir() else self._node
+
+    def stat(self, follow_symlinks=True):
+        return self._fs._stat_node(self._node)
+
+
+class MemoryFilesystem(object):
+    """
+    A filesystem held in memory, with the operations of `OsFilesystem`.
+
+    Paths are all relative to the root of the in-memory tree, with any
+    leading separator ignored. There are no symlinks, and `move` only ever
+    renames: unlike `shutil.move`, it never moves into an existing
+    directory. Each file costs one dict entry, so trees of millions of
+    files are practical.
+
+    Every call of each operation is counted in `calls`, and `fail` makes a
+    chosen call fail.
+    """
+    def __init__(self):
+        self._root = _Directory()
+        self._root.ino = 1
+        self._root.mtime = time.time()
+        self._next_ino = 2
+        self._sizes = { }
+        self._mtimes = { }
+        # directory path as given -> _Directory, for the common case of
+        # many operations on files in the same few directories
+        self._dir_cache = { }
+
+        self.calls = collections.Counter()
+        # (operation, call number) -> errno
+        self._faults = { }
+
+    def fail(self, operation, nth=1, error=errno.EIO):
+        """
+        Makes the `nth` call of `operation` from now on, such as "move",
+        raise an OSError with errno `error` instead of doing anything.
+        """
+        self._faults[(operation, self.calls[operation] + nth)] = error
+
+    # setting up
+
+    def makedirs(self, path):
+        node = self._root
+        for part in _parts(path):
+            child = node.get(part)
+            if child is None:
+                child = node[part] = self._new_directory()
+                node.mtime = child.mtime
+            elif not isinstance(child, _Directory):
+                raise _error(errno.ENOTDIR, path)
+            node = child
+
+    def create_file(self, path, size=0, mtime=None):
+        parent, name = self._parent(path)
+        if name in parent:
+            raise _error(errno.EEXIST, path)
+        ino = self._next_ino
+        self._next_ino += 1
+        parent[name] = ino
+        parent.mtime = time.time()
+        if size:
+            self._sizes[ino] = size
+        if mtime is not None:
+            self._mtimes[ino] = mtime
+
+    def add_files(self, paths, size=0):
+        """
+        Creates a file at each of `paths`, along with any missing
+        directories.
+        """
+        for path in paths:
+            container = os.path.dirname(path)
+            if self._cached_directory(container) is None:
+                self.makedirs(container)
+            self.create_file(path, size)
+
+    # OsFilesystem operations
+
+    def scandir(self, path):
+        self._call("scandir", path)
+        node = self._lookup(path)
+        if not isinstance(node, _Directory):
+            raise _error(errno.ENOTDIR, path)
+        return [
+            _MemoryDirEntry(self, path, name, child)
+            for name, child in node.items()
+        ]
+
+    def stat(self, path):
+        self._call("stat", path)
+        return self._stat_node(self._lookup(path))
+
+    lstat = stat
+
+    def exists(self, path):
+        try:
+            parent, name = self._parent(path)
+        except OSError:
+            try:
+                self._lookup(path)
+            except OSError:
+                return False
+            return True
+        return name in parent
+
+    lexists = exists
+
+    def isdir(self, path):
+        try:
+            return isinstance(self._lookup(path), _Directory)
+        except OSError:
+            return False
+
+    def mkdir(self, path):
+        self._call("mkdir", path)
+        parent, name = self._parent(path)
+        if name in parent:
+            raise _error(errno.EEXIST, path)
+        parent[name] = self._new_directory()
+        parent.mtime = time.time()
+
+    def rmdir(self, path):
+        self._call("rmdir", path)
+        parent, name = self._parent(path)
+        node = parent.get(name)
+        if node is None:
+            raise _error(errno.ENOENT, path)
+        if not isinstance(node, _Directory):
+            raise _error(errno.ENOTDIR, path)
+        if len(node) > 0:
+            raise _error(errno.ENOTEMPTY, path)
+        del parent[name]
+        parent.mtime = time.time()
+        self._dir_cache.clear()
+
+    def move(self, src, dest):
+        self._call("move", src)
+        src_parent, src_name = self._parent(src)
+        node = src_parent.get(src_name)
+        if node is None:
+            raise _error(errno.ENOENT, src)
+
+        dest_parent, dest_name = self._parent(dest)
+        if dest_name in dest_parent:
+            raise _error(errno.EEXIST, dest)
+
+        if isinstance(node, _Directory):
+            # a directory can't go inside itself
+            if _is_within(dest, src):
+                raise _error(errno.EINVAL, src)
+            self._dir_cache.clear()
+
+        del src_parent[src_name]
+        dest_parent[dest_name] = node
+        src_parent.mtime = dest_parent.mtime = time.time()
+
+    # internals
+
+    def _call(self, operation, path):
+        self.calls[operation] += 1
+        if self._faults:
+            error = self._faults.pop((operation, self.calls[operation]), None)
+            if error is not None:
+                raise _error(error, path)
+
+    def _new_directory(self):
+        directory = _Directory()
+        directory.ino = self._next_ino
+        directory.mtime = time.time()
+        self._next_ino += 1
+        return directory
+
+    def _stat_node(self, node):
+        if isinstance(node, _Directory):
+            return MemoryStat(DIRECTORY_MODE, node.ino, MEMORY_DEVICE, 0, node.mtime)
+        return MemoryStat(
+            FILE_MODE,
+            node,
+            MEMORY_DEVICE,
+            self._sizes.get(node, 0),
+            self._mtimes.get(node, 0.0),
+        )
+
+    def _lookup(self, path):
+        node = self._root
+        for part in _parts(path):
+            if not isinstance(node, _Directory):
+                raise _error(errno.ENOTDIR, path)
+            try:
+                node = node[part]
+            except KeyError:
+                raise _error(errno.ENOENT, path) from None
+        return node
+
+    def _cached_directory(self, path):
+        directory = self._dir_cache.get(path)
+        if directory is None:
+            try:
+                directory = self._lookup(path)
+            except OSError:
+                return None
+            if not isinstance(directory, _Directory):
+                return None
+            self._dir_cache[path] = directory
+        return directory
+
+    def _parent(self, path):
+        """
+        Returns the _Directory that would contain `path`, and the name of
+        `path` within it.
+        """
+        container, _, name = path.rpartition(os.sep)
+        if name in ("", os.curdir, os.pardir):
+            normalized = os.path.normpath(path)
+            container, name = os.path.split(normalized)
+            if name in ("", os.curdir, os.pardir):
+                raise _error(errno.EINVAL, path)
+
+        parent = self._dir_cache.get(container)
+        if parent is None:
+            parent = self._cached_directory(container)
+        if parent is None:
+            # raises the right error for whatever is in the way
+            self._lookup(container)
+            raise _error(errno.ENOTDIR, container)
+        return parent, name
+
+
+def _parts(path):
+    return [
+        part for part in os.path.normpath(path).split(os.sep)
+        if part not in ("", os.curdir)
+    ]
+
+
+def _is_within(path, directory):
+    path_parts = _parts(path)
+    directory_parts = _parts(directory)
+    return path_parts[:len(directory_parts)] == directory_parts
+
+
+def _error(error, path):
+    return OSError(error, os.strerror(error), path)
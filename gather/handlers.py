@@ -3,20 +3,37 @@ from gather.params import (
     AmbiguityBehavior,
     CancelReason,
     SharedDirectoryBehavior,
+    SkipReason,
 )
 import gather.log as log
+import gather.util as util
 
 
 class Handler(object):
+    def handle_directory_sequences(self, sequences):
+        pass
+
     def handle_ambiguities(self, amb_iter):
         pass
 
     def handle_rejected_sequences(self, sequences):
         pass
 
+    def handle_small_sequences(self, sequences):
+        pass
+
+    def handle_unsettled_sequences(self, sequences):
+        pass
+
+    def handle_mixed_gathered_directories(self, directories):
+        pass
+
     def handle_shared_sequences(self, parent, dir_sequences):
         pass
 
+    def handle_conflicts(self, conflicts):
+        pass
+
     def handle_cancel_reasons(self, cancel_reasons):
         pass
 
@@ -26,12 +43,21 @@ class Handler(object):
     def before_sequence_move(self, target_dir):
         pass
 
+    def before_sequence_batch(self, target_dir, sequence):
+        pass
+
+    def before_directory_move(self, old_dir, new_dir):
+        pass
+
     def before_file_move(self, old_path, new_path):
         pass
 
     def after_sequence_move(self, target_dir):
         pass
 
+    def sequence_skipped(self, target_dir, sequence, reason):
+        pass
+
     def before_rollback(self, os_error):
         pass
 
@@ -44,27 +70,104 @@ class Handler(object):
     def plan_execution_complete(self, sequence_count, rollback_count):
         pass
 
+    def wants_file_events(self):
+        """
+        Returns True if `before_file_move` should be called for every file
+        moved. By default this is only the case if a subclass overrides it;
+        handlers that only need one event per sequence can use
+        `before_sequence_batch` instead.
+        """
+        return type(self).before_file_move is not Handler.before_file_move
+
 
 class NoOpHandler(Handler):
     pass
 
 
+class HandlerChain(Handler):
+    """
+    A Handler that passes every event on to each of `handlers` in turn.
+    """
+    def __init__(self, *handlers):
+        self._handlers = handlers
+
+    def handle_ambiguities(self, amb_iter):
+        # each handler needs its own pass over them
+        ambiguities = list(amb_iter)
+        for handler in self._handlers:
+            handler.handle_ambiguities(iter(ambiguities))
+
+    def wants_file_events(self):
+        return any(handler.wants_file_events() for handler in self._handlers)
+
+
+def _chained(name):
+    def method(self, *args):
+        for handler in self._handlers:
+            getattr(handler, name)(*args)
+    method.__name__ = name
+    return method
+
+for _name in (
+        "handle_directory_sequences",
+        "handle_rejected_sequences",
+        "handle_small_sequences",
+        "handle_unsettled_sequences",
+        "handle_mixed_gathered_directories",
+        "handle_shared_sequences",
+        "handle_conflicts",
+        "handle_cancel_reasons",
+        "plan_generation_complete",
+        "before_sequence_move",
+        "before_sequence_batch",
+        "before_directory_move",
+        "before_file_move",
+        "after_sequence_move",
+        "sequence_skipped",
+        "before_rollback",
+        "after_rollback",
+        "rollback_error",
+        "plan_execution_complete",
+    ):
+    setattr(HandlerChain, _name, _chained(_name))
+del _name
+
+
+MSG_DIRECTORY_SEQUENCES_HEADER = "The following directories are numbered in sequence:"
+
 MSG_AMBIGUOUS_HEADER = "The following files are ambiguous sequence members:"
 MSG_AMBIGUOUS_NEXT = "  {file} could be followed by {choices[0]} or {choices[1]}"
 MSG_AMBIGUOUS_PREVIOUS = "  {choices[0]} or {choices[1]} could precede {file}"
 
 MSG_SHORT_HEADER = "The following sequences will be skipped because they are shorter than the minimum length {min_sequence_length}"
 
+MSG_SMALL_HEADER = "The following sequences will be skipped because they are smaller than {min_bytes}:"
+MSG_FILES_MISSING = "files missing"
+MSG_UNSETTLED_HEADER = "The following sequences will be skipped because they were modified less than {settle_seconds} seconds ago:"
+MSG_MIXED_GATHERED_HEADER = "The following directories will be skipped because they hold files outside the sequence they were gathered for:"
+
 MSG_SHARED_HEADER_ALLOWED = "Directory will contain multiple sequences:"
 MSG_SHARED_HEADER_DISALLOWED = "Directory would contain multiple sequences:"
 MSG_SHARED_COACH = "Use the --template option to create distinct directory names, or allow directories to contain multiple sequences with --share allow"
 
+MSG_CONFLICT_HEADER = "The following destinations are already taken:"
+MSG_CONFLICT_EXISTS = "  {destination} exists and would be replaced by {sources[0]}"
+MSG_CONFLICT_EXISTS_PLANNED = "  {destination} exists and would be replaced"
+MSG_CONFLICT_PLANNED = "  {destination} would be the destination of {count} files:"
+MSG_CONFLICT_BLOCKED = "  {destination} is blocked by a file, and can't be the directory of {count} files:"
+
 MSG_CANCEL_REASONS = (
-    (CancelReason.ambiguities,        "ambiguous sequences"),
-    (CancelReason.shared_directories, "multiple sequences sharing a directory"),
+    (CancelReason.ambiguities,           "ambiguous sequences"),
+    (CancelReason.shared_directories,    "multiple sequences sharing a directory"),
+    (CancelReason.destination_conflicts, "destinations that are already taken"),
 )
 MSG_CANCEL_REASONS_REPORT = "Stopping because {reasons}"
 
+MSG_SKIPPED_REASONS = {
+    SkipReason.locked:  "Skipping {target_dir}: another process is working in its directories",
+    SkipReason.changed: "Skipping {target_dir}: files in {sequence} have been moved or removed",
+}
+
 MSG_ERROR = "Error: {error!s}. Rolling back..."
 MSG_ROLLBACK_OK = "Rollback complete"
 MSG_ROLLBACK_FAIL = """\
@@ -73,6 +176,10 @@ Error while rolling back - incomplete commands follow.
 MSG_ROLLBACK_FAIL_EPILOG = "# End incomplete commands"
 MSG_ROLLBACK_COUNT = "{count} of {total} sequences failed and were rolled back."
 
+MSG_DIRECTORY_MOVE = "  {old_dir} (renamed)"
+
+MSG_SUMMARY = "{target_dir} <- {sequence.prefix}[{sequence.first.number}-{sequence.last.number}]{sequence.suffix} ({count} files{size})"
+
 MSG_DRY_RUN = "--dry-run specified. No changes were made."
 
 
@@ -101,6 +208,21 @@ class CliReporter(Handler):
 
         self._show_share_coach = False
 
+    def handle_directory_sequences(self, sequences):
+        self._logger.info(MSG_DIRECTORY_SEQUENCES_HEADER)
+
+        stack = [ (sequence, 1) for sequence in reversed(sequences) ]
+        while len(stack) > 0:
+            sequence, depth = stack.pop()
+            self._logger.info(
+                "%s(%d) %s" % ("  " * depth, len(sequence.paths), sequence)
+            )
+            stack.extend(
+                (child, depth + 1) for child in reversed(sequence.children)
+            )
+
+        self._logger.info("")
+
     def handle_ambiguities(self, amb_iter):
         self._log_amb(MSG_AMBIGUOUS_HEADER)
         for amb in amb_iter:
@@ -131,6 +253,38 @@ class CliReporter(Handler):
 
         self._logger.log(header_level, "")
 
+    def handle_small_sequences(self, sequences):
+        self._logger.info(
+            MSG_SMALL_HEADER,
+            min_bytes = util.format_bytes(self._config.min_bytes)
+        )
+        for sequence in sequences:
+            self._logger.info("  (%s) %s" % (
+                MSG_FILES_MISSING
+                if sequence.size is None
+                else util.format_bytes(sequence.size),
+                sequence,
+            ))
+        self._logger.info("")
+
+    def handle_unsettled_sequences(self, sequences):
+        self._logger.info(
+            MSG_UNSETTLED_HEADER,
+            settle_seconds = self._config.settle_seconds
+        )
+        for sequence in sequences:
+            if sequence.newest_mtime is None:
+                self._logger.info("  (%s) %s" % (MSG_FILES_MISSING, sequence))
+            else:
+                self._logger.info("  %s" % sequence)
+        self._logger.info("")
+
+    def handle_mixed_gathered_directories(self, directories):
+        self._logger.warning(MSG_MIXED_GATHERED_HEADER)
+        for directory in directories:
+            self._logger.warning("  %s" % directory)
+        self._logger.warning("")
+
     def handle_shared_sequences(self, parent, dir_sequences):
         allow_shared = self._config.shared_directory_behavior == SharedDirectoryBehavior.allow
 
@@ -148,6 +302,36 @@ class CliReporter(Handler):
         if not allow_shared:
             self._show_share_coach = True
 
+    def handle_conflicts(self, conflicts):
+        self._logger.error(MSG_CONFLICT_HEADER)
+        for conflict in conflicts:
+            count = len(conflict.sources)
+            # each reason is reported on its own, and a list of the sources
+            # follows the last
+            if conflict.blocked:
+                self._logger.error(
+                    MSG_CONFLICT_BLOCKED,
+                    count = count,
+                    **conflict._asdict()
+                )
+            elif conflict.exists and count == 1:
+                self._logger.error(MSG_CONFLICT_EXISTS, **conflict._asdict())
+                continue
+            else:
+                if conflict.exists:
+                    self._logger.error(
+                        MSG_CONFLICT_EXISTS_PLANNED,
+                        **conflict._asdict()
+                    )
+                self._logger.error(
+                    MSG_CONFLICT_PLANNED,
+                    count = count,
+                    **conflict._asdict()
+                )
+            for source in conflict.sources:
+                self._logger.error("    %s" % source)
+        self._logger.error("")
+
     def handle_cancel_reasons(self, cancel_reasons):
         reasons_text = ", ".join(
             message for reason, message in MSG_CANCEL_REASONS
@@ -163,12 +347,22 @@ class CliReporter(Handler):
     def before_sequence_move(self, target_dir):
         self._logger.info(target_dir)
 
+    def before_directory_move(self, old_dir, new_dir):
+        self._logger.info(MSG_DIRECTORY_MOVE, old_dir=old_dir)
+
     def before_file_move(self, old_path, new_path):
         self._logger.info("  %s" % old_path)
 
     def after_sequence_move(self, target_dir):
         self._logger.info("")
 
+    def sequence_skipped(self, target_dir, sequence, reason):
+        self._logger.warning(
+            MSG_SKIPPED_REASONS[reason],
+            target_dir = target_dir,
+            sequence = sequence,
+        )
+
     def before_rollback(self, os_error):
         self._logger.error(MSG_ERROR, error=os_error)
 
@@ -191,3 +385,30 @@ class CliReporter(Handler):
 
         if self._config.dry_run:
             self._logger.info(MSG_DRY_RUN)
+
+
+class SummaryReporter(CliReporter):
+    """
+    A CliReporter that reports one line per sequence moved, rather than a
+    line per file.
+    """
+    before_file_move = Handler.before_file_move
+
+    def before_sequence_move(self, target_dir):
+        pass
+
+    def before_sequence_batch(self, target_dir, sequence):
+        self._logger.info(
+            MSG_SUMMARY,
+            target_dir = target_dir,
+            sequence = sequence,
+            count = len(sequence.paths),
+            size = (
+                ""
+                if sequence.size is None
+                else ", " + util.format_bytes(sequence.size)
+            ),
+        )
+
+    def after_sequence_move(self, target_dir):
+        pass
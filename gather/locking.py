@@ -0,0 +1,100 @@
+import errno
+import fcntl
+import hashlib
+import os
+
+
+__all__ = ("DirectoryLocks", "NoOpLocks")
+
+
+class NoOpLocks(object):
+    # whether other processes may be working on the same tree
+    shared = False
+
+    def acquire(self, paths):
+        """
+        Tries to lock every directory in `paths`, without waiting.
+
+        :return: A token to pass to `release`, or None if any of the
+          directories is locked by another process, in which case none of
+          them are left locked.
+        """
+        return ()
+
+    def release(self, token):
+        pass
+
+    def release_all(self):
+        pass
+
+
+class DirectoryLocks(NoOpLocks):
+    """
+    Advisory locks on directories, shared between processes, and between
+    hosts that mount `lock_dir` over a filesystem that supports POSIX
+    record locks, such as NFS.
+
+    Each directory is locked through a file in `lock_dir` named after a
+    hash of its absolute path, so every process must see the tree at the
+    same path. Lock files are never removed, because a process could be
+    waiting to lock a file just as another removes it.
+
+    Locks are tried in a single global order, that of their lock file names,
+    and a process never waits for one: if any is taken, the ones already
+    acquired are released and the caller moves on. No process can block
+    another indefinitely, so there can be no deadlock.
+    """
+    shared = True
+
+    def __init__(self, lock_dir):
+        self._lock_dir = lock_dir
+        # lock file name -> open file descriptor
+        self._held = { }
+
+    def acquire(self, paths):
+        names = sorted(set(self._lock_name(path) for path in paths))
+        acquired = [ ]
+
+        for name in names:
+            if name in self._held:
+                # fcntl locks belong to the process, so locking a file again
+                # would succeed, and closing either descriptor would release it
+                continue
+
+            try:
+                fd = os.open(
+                    os.path.join(self._lock_dir, name),
+                    os.O_RDWR | os.O_CREAT,
+                    0o666,
+                )
+            except OSError:
+                self.release(acquired)
+                raise
+
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as ose:
+                os.close(fd)
+                self.release(acquired)
+                if ose.errno in (errno.EACCES, errno.EAGAIN):
+                    return None
+                raise
+
+            self._held[name] = fd
+            acquired.append(name)
+
+        return acquired
+
+    def release(self, token):
+        for name in token:
+            fd = self._held.pop(name, None)
+            if fd is not None:
+                # closing the file releases its lock
+                os.close(fd)
+
+    def release_all(self):
+        self.release(list(self._held))
+
+    def _lock_name(self, path):
+        key = os.fsencode(os.path.abspath(path))
+        return hashlib.sha1(key).hexdigest() + ".lock"
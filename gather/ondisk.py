@@ -0,0 +1,256 @@
+"""
+A Collector that keeps parsed names in an sqlite database on disk, rather
+than in a graph in memory.
+"""
+
+import os.path
+import sqlite3
+
+from gather.analyze import (
+    Ambiguity,
+    Collector,
+    Direction,
+    NameInfo,
+)
+from gather.fs import OS_FILESYSTEM
+
+
+__all__ = ("SqliteCollector",)
+
+
+SCHEMA = """
+CREATE TABLE names (
+    container   TEXT NOT NULL,
+    prefix      TEXT NOT NULL,
+    suffix      TEXT NOT NULL,
+    digit_count INTEGER NOT NULL,
+    number      TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    size        INTEGER,
+    mtime       REAL
+)
+"""
+
+# numbers are kept as text, so values too large for an sqlite integer still
+# work. digit strings of the same length sort the same way as their values
+INDEX = """
+CREATE INDEX IF NOT EXISTS names_order
+ON names (container, prefix, suffix, digit_count, number)
+"""
+
+INSERT = "INSERT INTO names VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+SELECT_ORDERED = """
+SELECT container, prefix, suffix, digit_count, number, path, size, mtime
+FROM names
+ORDER BY container, prefix, suffix, digit_count, number
+"""
+
+# the only file that can have two predecessors is a 1 followed by zeros,
+# such as 100, which can follow both 099 and 99. CROSS JOIN keeps sqlite
+# from scanning the other tables first, which would make this quadratic
+SELECT_AMBIGUITIES = """
+SELECT DISTINCT ten.path, padded.path, shorter.path
+FROM names AS ten
+CROSS JOIN names AS padded
+    ON  padded.container = ten.container
+    AND padded.prefix = ten.prefix
+    AND padded.suffix = ten.suffix
+    AND padded.digit_count = ten.digit_count
+    AND padded.number = '0' || replace(substr(ten.number, 2), '0', '9')
+CROSS JOIN names AS shorter
+    ON  shorter.container = ten.container
+    AND shorter.prefix = ten.prefix
+    AND shorter.suffix = ten.suffix
+    AND shorter.digit_count = ten.digit_count - 1
+    AND shorter.number = replace(substr(ten.number, 2), '0', '9')
+WHERE substr(ten.number, 1, 1) = '1'
+    AND ltrim(substr(ten.number, 2), '0') = ''
+"""
+
+
+class SqliteCollector(Collector):
+    """
+    A Collector that stores parsed names in an sqlite database instead of a
+    graph in memory, so that the state of name analysis is on disk. The
+    scanned paths, and the plan and moves made from the sequences found,
+    are still held in memory as with any other Collector.
+
+    Names are inserted in batches of `batch_size`, each in one transaction,
+    and indexed by set key and number once collection is done. Sequences
+    are then found in a single ordered pass over the index, holding only the
+    sequence being built and, at most, one that may continue into longer
+    numbers.
+
+    :param path: The database file to use. The default is a temporary file,
+      in the directory named by SQLITE_TMPDIR or TMPDIR, which is deleted
+      when the collector is closed.
+    :param cache_size: The most memory, in bytes, for sqlite to use for
+      caching pages.
+    """
+    def __init__(
+        self,
+        progress = None,
+        hierarchical = False,
+        gathered = None,
+        path = "",
+        batch_size = 100000,
+        cache_size = 64 * 1024 * 1024,
+        fs = OS_FILESYSTEM,
+    ):
+        super().__init__(progress, hierarchical, gathered, fs)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("PRAGMA cache_size = -%d" % (cache_size // 1024))
+        self._db.execute("DROP TABLE IF EXISTS names")
+        self._db.execute(SCHEMA)
+
+        self._batch = [ ]
+        self._batch_size = batch_size
+        self._indexed = False
+        self._found_ambiguities = None
+
+    def close(self):
+        self._db.close()
+
+    def has_ambiguities(self):
+        return len(self._load_ambiguities()) > 0
+
+    def ambiguities(self):
+        yield from self._load_ambiguities()
+
+    def _add(self, name_info):
+        self._batch.append((
+            name_info.container,
+            name_info.prefix,
+            name_info.suffix,
+            name_info.digit_count,
+            name_info.number,
+            name_info.path,
+            name_info.size,
+            name_info.mtime,
+        ))
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if len(self._batch) > 0:
+            with self._db:
+                self._db.executemany(INSERT, self._batch)
+            self._batch = [ ]
+            self._indexed = False
+            self._found_ambiguities = None
+
+    def _finish_collecting(self):
+        self._flush()
+        if not self._indexed:
+            # building the index once, from a full table, is much faster than
+            # keeping it up to date through every insert
+            with self._db:
+                self._db.execute(INDEX)
+            self._indexed = True
+
+    def _load_ambiguities(self):
+        self._finish_collecting()
+        if self._found_ambiguities is None:
+            self._found_ambiguities = [
+                Ambiguity(Direction.previous, ten, (padded, shorter))
+                for ten, padded, shorter
+                in self._db.execute(SELECT_AMBIGUITIES)
+            ]
+        return self._found_ambiguities
+
+    def _sequences(self):
+        self._finish_collecting()
+
+        last = None
+        # the chain being built, and whether it touches an ambiguity
+        chain, poisoned = [ ], False
+        # a chain from the previous digit count that ended in all 9s, and so
+        # may continue with the 1 followed by zeros in this one
+        pending, pending_poisoned = None, False
+
+        for row in self._db.execute(SELECT_ORDERED):
+            name_info = _row_name_info(row)
+
+            if last is not None and name_info.set_key == last.set_key:
+                if (name_info.digit_count == last.digit_count and
+                        name_info.number == last.number):
+                    # the same name collected twice
+                    continue
+                new_digit_count = name_info.digit_count != last.digit_count
+            else:
+                yield from self._finish_chain(pending, pending_poisoned)
+                pending = None
+                new_digit_count = True
+
+            if new_digit_count:
+                # only a pending chain from the digit count before last could
+                # still be here, and it can't go on any more
+                yield from self._finish_chain(pending, pending_poisoned)
+                pending = None
+                if (len(chain) > 0 and
+                        chain[-1].set_key == name_info.set_key and
+                        chain[-1].digit_count + 1 == name_info.digit_count and
+                        _is_all_nines(chain[-1])):
+                    pending, pending_poisoned = chain, poisoned
+                else:
+                    yield from self._finish_chain(chain, poisoned)
+                chain, poisoned = [ ], False
+
+            if pending is not None:
+                if name_info.value == pending[-1].value + 1:
+                    if len(chain) > 0 and chain[-1].value + 1 == name_info.value:
+                        # it follows both the zero padded number before it
+                        # and the pending chain, so neither can be used
+                        chain.append(name_info)
+                        poisoned = True
+                        yield from self._finish_chain(pending, True)
+                    else:
+                        yield from self._finish_chain(chain, poisoned)
+                        chain = pending + [ name_info ]
+                        poisoned = pending_poisoned
+                    pending = None
+                    last = name_info
+                    continue
+
+                if name_info.value > pending[-1].value + 1:
+                    yield from self._finish_chain(pending, pending_poisoned)
+                    pending = None
+
+            if len(chain) > 0 and chain[-1].value + 1 == name_info.value:
+                chain.append(name_info)
+            else:
+                yield from self._finish_chain(chain, poisoned)
+                chain, poisoned = [ name_info ], False
+
+            last = name_info
+
+        yield from self._finish_chain(chain, poisoned)
+        yield from self._finish_chain(pending, pending_poisoned)
+
+    def _finish_chain(self, chain, poisoned):
+        if chain and not poisoned:
+            yield self._make_sequence(chain)
+
+
+def _is_all_nines(name_info):
+    return name_info.number.strip("9") == ""
+
+
+def _row_name_info(row):
+    container, prefix, suffix, digit_count, number, path, size, mtime = row
+    return NameInfo(
+        path = path,
+        container = container,
+        name = os.path.basename(path),
+        number = number,
+        value = int(number),
+        digit_count = digit_count,
+        prefix = prefix,
+        suffix = suffix,
+        set_key = (container, prefix, suffix),
+        size = size,
+        mtime = mtime,
+    )
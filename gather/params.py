@@ -15,11 +15,25 @@ class SharedDirectoryBehavior(Enum):
 class CancelReason(Enum):
     ambiguities = 1
     shared_directories = 2
+    destination_conflicts = 3
 
 class RollbackBehavior(Enum):
     set = 1
     all = 2
 
+class ExecutionEngine(Enum):
+    path = 1
+    dirfd = 2
+    uring = 3
+
+class CollectorEngine(Enum):
+    memory = 1
+    sqlite = 2
+
+class SkipReason(Enum):
+    locked = 1
+    changed = 2
+
 class GatherResult(Enum):
     ok = 0
     cancel = 2
@@ -28,6 +42,19 @@ class GatherResult(Enum):
     error_failed_rollback = 5
 
 
+Conflict = collections.namedtuple(
+    "Conflict", (
+        "destination",
+        "sources",
+        "exists",
+        "blocked",
+    )
+)
+# blocked is True if something that isn't a directory is in the way of the
+# destination's directory
+Conflict.__new__.__defaults__ = (False,)
+
+
 DEFAULT_DIR_TEMPLATE = "{path_prefix}[{first}-{last}]{suffix}"
 
 
@@ -39,5 +66,25 @@ Config = collections.namedtuple(
         "shared_directory_behavior",
         "rollback_behavior",
         "dry_run",
+        "hierarchical",
+        "min_bytes",
+        "settle_seconds",
+        "engine",
+        "auto_field",
+        "append",
+        "collector",
+        "rollback_workers",
     )
 )
+# for the fields added since the first six, so that code that builds a Config
+# from those alone keeps working, and keeps the same behavior
+Config.__new__.__defaults__ = (
+    False,
+    0,
+    0,
+    ExecutionEngine.path,
+    False,
+    False,
+    CollectorEngine.memory,
+    1,
+)
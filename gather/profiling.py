@@ -0,0 +1,117 @@
+import cProfile
+import contextlib
+import os
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from gather.util import format_bytes
+
+
+__all__ = ("NoOpProfiler", "PhaseProfiler")
+
+
+class NoOpProfiler(object):
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield
+
+    def finish(self):
+        pass
+
+
+class PhaseProfiler(NoOpProfiler):
+    """
+    Profiles each phase of a run with cProfile and tracemalloc, and writes
+    the results to `directory`:
+
+    - `NN-phase.pstats`, which can be loaded with the `pstats` module
+    - `NN-phase-alloc.txt`, listing the `top` lines that allocated the most
+      memory during the phase and still held it at the end
+    - `summary.txt`, with the wall time and peak traced memory of every
+      phase, how much it raised the peak resident set size, and the peak
+      resident set size of the process as of its end
+
+    The operating system only reports the peak RSS of the whole process
+    over its lifetime, so a phase that used less memory than an earlier one
+    shows no rise at all, even if it used a lot.
+    """
+    def __init__(self, directory, top=25):
+        self._directory = directory
+        self._top = top
+        self._records = [ ]
+        os.makedirs(directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        basename = "%02d-%s" % (len(self._records) + 1, name)
+        profiler = cProfile.Profile()
+
+        start_rss = _max_rss()
+        tracemalloc.start()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            _, traced_peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            profiler.dump_stats(self._path(basename + ".pstats"))
+            self._write_allocations(basename + "-alloc.txt", snapshot)
+            self._records.append(
+                (name, seconds, traced_peak, start_rss, _max_rss())
+            )
+
+    def finish(self):
+        with open(self._path("summary.txt"), "w") as stream:
+            print(
+                "%-16s %10s %12s %14s %14s" % (
+                    "phase",
+                    "seconds",
+                    "traced peak",
+                    "peak RSS rise",
+                    "process peak",
+                ),
+                file = stream
+            )
+            for name, seconds, traced_peak, start_rss, end_rss in self._records:
+                print(
+                    "%-16s %10.3f %12s %14s %14s" % (
+                        name,
+                        seconds,
+                        format_bytes(traced_peak),
+                        "-" if end_rss is None else format_bytes(end_rss - start_rss),
+                        "-" if end_rss is None else format_bytes(end_rss),
+                    ),
+                    file = stream
+                )
+
+    def _write_allocations(self, filename, snapshot):
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+        ))
+        with open(self._path(filename), "w") as stream:
+            for stat in snapshot.statistics("lineno")[:self._top]:
+                print(stat, file=stream)
+
+    def _path(self, filename):
+        return os.path.join(self._directory, filename)
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == "Darwin":
+        return max_rss
+    # everywhere else reports kilobytes
+    return max_rss * 1024
@@ -0,0 +1,195 @@
+import sys
+import time
+
+from gather.util import format_bytes, format_duration
+
+
+__all__ = ("NoOpProgress", "ProgressMeter")
+
+
+class NoOpProgress(object):
+    def begin_scan(self):
+        pass
+
+    def scanned_directory(self):
+        pass
+
+    def parsed_file(self):
+        pass
+
+    def begin_analysis(self):
+        pass
+
+    def found_sequence(self):
+        pass
+
+    def begin_execution(self, file_count, byte_count):
+        pass
+
+    def moved_file(self, byte_count):
+        pass
+
+    def finish(self):
+        pass
+
+    def wants_moved_files(self):
+        """
+        Returns True if `moved_file` should be called for every file moved.
+        By default this is only the case if a subclass overrides it.
+        """
+        return type(self).moved_file is not NoOpProgress.moved_file
+
+
+PHASE_SCAN = "Scanning"
+PHASE_ANALYSIS = "Analyzing"
+PHASE_EXECUTION = "Moving"
+
+
+class ProgressMeter(NoOpProgress):
+    """
+    Counts work done in each phase of a run and reports it at most once per
+    `interval` seconds.
+
+    Every event only decrements a countdown; the clock is read once per
+    `check_every` events, so the cost of reporting doesn't grow with the
+    number of files. On a terminal the report is redrawn in place, otherwise
+    it is written as a new line each time.
+    """
+    def __init__(
+        self,
+        stream = None,
+        interval = 0.25,
+        check_every = 64,
+        clock = time.monotonic,
+    ):
+        self._stream = stream or sys.stderr
+        self._interval = interval
+        self._check_every = check_every
+        self._clock = clock
+
+        isatty = getattr(self._stream, "isatty", None)
+        self._redraw = isatty is not None and isatty()
+
+        self.directories = 0
+        self.files = 0
+        self.sequences = 0
+        self.moved_files = 0
+        self.moved_bytes = 0
+        self.total_files = 0
+        self.total_bytes = 0
+
+        self._phase = None
+        self._phase_start = self._clock()
+        self._countdown = self._check_every
+        self._next_draw = self._phase_start
+        self._line_width = 0
+
+    def begin_scan(self):
+        self._begin_phase(PHASE_SCAN)
+
+    def scanned_directory(self):
+        self.directories += 1
+        self._tick()
+
+    def parsed_file(self):
+        self.files += 1
+        self._tick()
+
+    def begin_analysis(self):
+        self._begin_phase(PHASE_ANALYSIS)
+
+    def found_sequence(self):
+        self.sequences += 1
+        self._tick()
+
+    def begin_execution(self, file_count, byte_count):
+        self.total_files = file_count
+        self.total_bytes = byte_count
+        self._begin_phase(PHASE_EXECUTION)
+
+    def moved_file(self, byte_count):
+        self.moved_files += 1
+        self.moved_bytes += byte_count
+        self._tick()
+
+    def finish(self):
+        self._end_phase()
+        self._phase = None
+
+    def _begin_phase(self, phase):
+        self._end_phase()
+        self._phase = phase
+        self._phase_start = self._clock()
+        self._countdown = self._check_every
+        self._next_draw = self._phase_start + self._interval
+
+    def _end_phase(self):
+        if self._phase is not None:
+            self._draw(self._clock())
+            if self._redraw:
+                self._stream.write("\n")
+                self._line_width = 0
+            self._stream.flush()
+
+    def _tick(self):
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+
+        self._countdown = self._check_every
+        now = self._clock()
+        if now >= self._next_draw:
+            self._next_draw = now + self._interval
+            self._draw(now)
+
+    def _draw(self, now):
+        line = self.describe(now - self._phase_start)
+        if self._redraw:
+            padding = " " * max(0, self._line_width - len(line))
+            self._stream.write("\r" + line + padding)
+            self._line_width = len(line)
+        else:
+            self._stream.write(line + "\n")
+        self._stream.flush()
+
+    def describe(self, elapsed):
+        if self._phase == PHASE_SCAN:
+            return "%s: %d directories, %d files, %s files/s" % (
+                self._phase,
+                self.directories,
+                self.files,
+                _rate(self.files, elapsed),
+            )
+
+        if self._phase == PHASE_ANALYSIS:
+            return "%s: %d sequences" % (self._phase, self.sequences)
+
+        if self._phase == PHASE_EXECUTION:
+            return "%s: %d/%d files, %s/%s, %s files/s, %s/s, ETA %s" % (
+                self._phase,
+                self.moved_files,
+                self.total_files,
+                format_bytes(self.moved_bytes),
+                format_bytes(self.total_bytes),
+                _rate(self.moved_files, elapsed),
+                format_bytes(self.moved_bytes / elapsed if elapsed > 0 else 0),
+                self._eta(elapsed),
+            )
+
+        return ""
+
+    def _eta(self, elapsed):
+        if self.total_bytes > 0 and self.moved_bytes > 0:
+            done, total = self.moved_bytes, self.total_bytes
+        elif self.moved_files > 0:
+            done, total = self.moved_files, self.total_files
+        else:
+            return "--:--:--"
+
+        return format_duration(elapsed * (total - done) / done)
+
+
+def _rate(count, elapsed):
+    if elapsed <= 0:
+        return "0"
+    return "%.0f" % (count / elapsed)
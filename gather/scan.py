@@ -0,0 +1,323 @@
+import collections
+import fnmatch
+import os
+import re
+import stat
+
+from gather.fs import OS_FILESYSTEM
+from gather.progress import NoOpProgress
+from gather.throttle import NoOpThrottle
+
+
+__all__ = (
+    "NameFilter",
+    "ScannedFile",
+    "Scanner",
+    "VisitedSet",
+    "filter_paths",
+    "recurse_file_iterator",
+)
+
+
+REGEX_PATTERN_PREFIX = "re:"
+
+
+class NameFilter(object):
+    """
+    Include and exclude patterns for file and directory names.
+
+    Patterns are shell-style globs unless they start with "re:", in which
+    case the remainder is a regular expression that may match anywhere in
+    the name. Patterns are only ever matched against a single name, never a
+    full path. All patterns of each kind are compiled into one regular
+    expression up front.
+
+    :param include: Patterns a file name must match to be accepted. If
+      empty, all file names are accepted. Directories are not affected.
+    :param exclude: Patterns that reject any file or directory whose name
+      matches.
+    """
+    def __init__(self, include=(), exclude=()):
+        self._include = _compile_patterns(include)
+        self._exclude = _compile_patterns(exclude)
+
+    def accepts_directory(self, name):
+        return self._exclude is None or self._exclude.match(name) is None
+
+    def accepts_file(self, name):
+        if self._include is not None and self._include.match(name) is None:
+            return False
+        return self._exclude is None or self._exclude.match(name) is None
+
+
+def _compile_patterns(patterns):
+    expressions = [ ]
+    for pattern in patterns:
+        if pattern.startswith(REGEX_PATTERN_PREFIX):
+            expressions.append(".*?(?:%s)" % pattern[len(REGEX_PATTERN_PREFIX):])
+        else:
+            expressions.append(fnmatch.translate(pattern))
+
+    if len(expressions) == 0:
+        return None
+    return re.compile("|".join("(?:%s)" % e for e in expressions))
+
+
+ACCEPT_ALL = NameFilter()
+
+
+def filter_paths(
+    paths,
+    name_filter,
+    capture_stat = False,
+    fs = OS_FILESYSTEM,
+    shard = None,
+):
+    """
+    Yields the paths in `paths` accepted by `name_filter`, and in
+    directories owned by `shard` if it is given. If `capture_stat` is True,
+    yields a `ScannedFile` for each instead.
+    """
+    for path in paths:
+        if shard is not None and not shard.owns_directory(os.path.dirname(path)):
+            continue
+        if name_filter.accepts_file(os.path.basename(path)):
+            if capture_stat:
+                try:
+                    st = fs.lstat(path)
+                except OSError:
+                    st = None
+                yield _scanned_file(path, st)
+            else:
+                yield path
+
+
+class VisitedSet(object):
+    """
+    A set of filesystem objects identified by (st_dev, st_ino).
+
+    Each pair is packed into a single int rather than stored as a tuple, which
+    keeps the per-entry cost to one small object when tracking millions of
+    files.
+    """
+    def __init__(self):
+        self._keys = set()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, dev, ino):
+        """
+        Records the object identified by `dev` and `ino`. Returns True if it
+        had not been seen before, False if it had.
+        """
+        key = (dev << 64) | ino
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+
+ScannedFile = collections.namedtuple(
+    "ScannedFile", (
+        "path",
+        "size",
+        "mtime",
+    )
+)
+
+
+def _scanned_file(path, st):
+    if st is None:
+        return ScannedFile(path, None, None)
+    return ScannedFile(path, st.st_size, st.st_mtime)
+
+
+def recurse_file_iterator(roots, **options):
+    """
+    Yields the files in `roots`, descending into directories. Accepts the
+    same options as `Scanner`.
+    """
+    return Scanner(**options).files(roots)
+
+
+class Scanner(object):
+    """
+    Finds files in directory trees.
+
+    Every directory and file is visited at most once, even if roots overlap,
+    or the tree contains bind mounts, hard links, or (if `follow_links` is
+    True) symlinks that form a cycle.
+
+    :param follow_links: If True, descend into symlinks to directories.
+    :param progress: An optional `gather.progress.NoOpProgress` to notify
+      of each directory scanned.
+    :param name_filter: A `NameFilter`. Rejected directories are not listed
+      and rejected files are not yielded.
+    :param max_depth: If not None, the number of levels below each root to
+      descend. 0 yields only files immediately inside each root.
+    :param capture_stat: If True, yield a `ScannedFile` with the size and
+      modification time of each file, instead of only its path. The stat
+      data is taken from the directory entry, so no extra calls are made on
+      platforms that return it from a directory listing.
+    :param throttle: An optional `gather.throttle.Throttle`. Each directory
+      listing counts as one operation.
+    :param fs: The filesystem to scan. The default is the real one.
+    :param shard: An optional `gather.shard.Shard`. Only directories it owns
+      are scanned, and directories at its depth that it doesn't own are not
+      descended into.
+    """
+    def __init__(
+        self,
+        follow_links = False,
+        progress = None,
+        name_filter = ACCEPT_ALL,
+        max_depth = None,
+        capture_stat = False,
+        throttle = None,
+        fs = OS_FILESYSTEM,
+        shard = None,
+    ):
+        self._follow_links = follow_links
+        self._progress = progress or NoOpProgress()
+        self._name_filter = name_filter
+        self._max_depth = max_depth
+        self._capture_stat = capture_stat
+        self._throttle = throttle or NoOpThrottle()
+        self._fs = fs
+        self._shard = shard
+
+    def files(self, roots):
+        """
+        :param roots: An iterable of file and directory paths.
+        """
+        visited = VisitedSet()
+
+        for path in roots:
+            try:
+                st = self._fs.stat(path)
+            except OSError:
+                continue
+
+            if not visited.add(st.st_dev, st.st_ino):
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+                if (self._shard is not None and
+                        self._shard.depth == 0 and
+                        not self._shard.owns_directory(path)):
+                    continue
+                yield from self._walk(path, st.st_dev, visited)
+            elif (stat.S_ISREG(st.st_mode) and
+                  self._name_filter.accepts_file(os.path.basename(path)) and
+                  (self._shard is None or
+                   self._shard.owns_directory(os.path.dirname(path)))):
+                yield self._result(path, st)
+
+    def _result(self, path, st):
+        if self._capture_stat:
+            return _scanned_file(path, st)
+        return path
+
+    def list_directory(self, container, dev=None, visited=None, descend=True):
+        """
+        Lists the single directory `container`.
+
+        :param dev: The device `container` is on, if known.
+        :param visited: A `VisitedSet` shared with other listings, if any.
+        :param descend: If False, subdirectories are not returned.
+        :return: A tuple of a list of the accepted files, as `files` yields
+          them, and a list of (path, dev) tuples for the subdirectories to
+          descend into.
+        """
+        if visited is None:
+            visited = VisitedSet()
+
+        files = [ ]
+        subdirs = [ ]
+
+        try:
+            if dev is None:
+                dev = self._fs.stat(container).st_dev
+            with self._throttle.operation():
+                entries = list(self._fs.scandir(container))
+        except OSError:
+            return files, subdirs
+
+        self._progress.scanned_directory()
+
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if (not descend or
+                        not self._name_filter.accepts_directory(entry.name) or
+                        (entry.is_symlink() and not self._follow_links)):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if visited.add(st.st_dev, st.st_ino):
+                    subdirs.append((entry.path, st.st_dev))
+                continue
+
+            if not self._name_filter.accepts_file(entry.name):
+                continue
+
+            if entry.is_symlink():
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # a broken link. it's still a name, so pass it on as
+                    # os.walk would have
+                    files.append(self._result(entry.path, None))
+                    continue
+                is_new = visited.add(st.st_dev, st.st_ino)
+            elif self._capture_stat:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                is_new = visited.add(st.st_dev, st.st_ino)
+            else:
+                # files share their directory's device, so DirEntry.inode()
+                # is enough to identify them without a stat call
+                st = None
+                is_new = visited.add(dev, entry.inode())
+
+            if is_new:
+                files.append(self._result(entry.path, st))
+
+        return files, subdirs
+
+    def _walk(self, top, top_dev, visited):
+        stack = [ (top, top_dev, 0) ]
+
+        while len(stack) > 0:
+            container, dev, depth = stack.pop()
+            descend = self._max_depth is None or depth < self._max_depth
+
+            files, subdirs = self.list_directory(container, dev, visited, descend)
+
+            shard = self._shard
+            if shard is not None and depth < shard.depth:
+                # above the level the tree is divided at, each directory's
+                # own files are divided
+                if shard.owns_directory(container):
+                    yield from files
+                if depth + 1 == shard.depth:
+                    subdirs = [
+                        (path, subdir_dev) for path, subdir_dev in subdirs
+                        if shard.owns_directory(path)
+                    ]
+            else:
+                yield from files
+
+            stack.extend(
+                (path, subdir_dev, depth + 1)
+                for path, subdir_dev in reversed(subdirs)
+            )
@@ -0,0 +1,524 @@
+"""
+A long-running service that keeps the sequences in a set of directory trees
+indexed, and answers queries about them over a Unix domain socket.
+
+Each request is one line of JSON, and gets one line of JSON in reply. A
+connection may send any number of requests. Requests have an "op", and
+replies have "ok", which is False if the request failed, with the reason in
+"error".
+
+  {"op": "lookup", "path": PATH}
+    The sequence the file at PATH belongs to, as "sequence", or null.
+  {"op": "list", "dir": DIR, "recursive": false}
+    The sequences in DIR, and with "recursive", below it, as "sequences".
+  {"op": "gather", "dir": DIR, "recursive": true, "dry_run": false}
+    Gathers the sequences in DIR, and below it unless "recursive" is
+    false, and returns a summary of the run as "summary".
+  {"op": "refresh"}
+    Brings the index up to date now, rather than at the next interval.
+
+Sequences are given as objects with "directory", "prefix", "suffix",
+"first", "last" and "count". Only sequences of at least the configured
+minimum length are reported. Files in a directory that a sequence was
+gathered into are reported as part of that sequence, in the directory above,
+so gathering again adds to the directory rather than nesting another in it.
+
+Run the service with `gather -r --serve SOCKET ROOTS`, and send a request
+from the command line with `python -m gather.service SOCKET REQUEST`.
+"""
+
+import errno
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from gather import core
+from gather.analyze import GatheredDirectoryPattern
+from gather.fs import OS_FILESYSTEM
+from gather.params import CollectorEngine
+from gather.scan import Scanner, VisitedSet
+from gather.shard import ShardSummary
+from gather.transaction import RollbackError
+
+
+__all__ = ("SequenceService", "query")
+
+
+# the longest request line accepted
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# directories modified this recently before they were listed may have
+# changed again within the same mtime, so they are listed again next time
+MTIME_SETTLE_SECONDS = 2.0
+
+
+class _Directory(object):
+    """
+    What is known about one directory as of the last time it was listed.
+    """
+    __slots__ = (
+        "mtime",
+        "listed_at",
+        "subdirs",
+        "gathered",
+        "files",
+        "sequences",
+        "by_path",
+    )
+
+    def __init__(self, mtime, listed_at, subdirs, gathered, files, sequences):
+        self.mtime = mtime
+        self.listed_at = listed_at
+        self.subdirs = subdirs
+        # (path, mtime) of each gathered directory whose files are listed
+        # with this one's
+        self.gathered = gathered
+        self.files = files
+        self.sequences = sequences
+        # path of each file in a sequence -> its SequenceInfo
+        self.by_path = {
+            path: sequence
+            for sequence in sequences
+            for path in sequence.paths
+        }
+
+    def unchanged(self, mtime, fs):
+        if not _settled(mtime, self.mtime, self.listed_at):
+            return False
+        for path, mtime in self.gathered:
+            try:
+                current = fs.stat(path).st_mtime
+            except OSError:
+                return False
+            if not _settled(current, mtime, self.listed_at):
+                return False
+        return True
+
+
+def _settled(mtime, listed_mtime, listed_at):
+    return mtime == listed_mtime and listed_at - listed_mtime > MTIME_SETTLE_SECONDS
+
+
+class SequenceService(object):
+    """
+    Keeps an index of the sequences in the directory trees `roots`, each
+    directory's sequences found by a Collector of their own, and refreshes
+    it every `interval` seconds.
+
+    A refresh checks the modification time of every directory, and only
+    lists and analyzes again those that have changed, since adding,
+    removing or renaming a file changes the time of its directory. Looking
+    up a file takes a dict lookup by its directory, and another by its path.
+
+    If the directory template puts each sequence beside its files, the
+    directories it names are indexed with the directory above them, as
+    `--append` does, so that repeated gather requests add to them rather
+    than gathering their contents into another directory inside.
+
+    :param config: The `gather.params.Config` to gather with. Its minimum
+      sequence length applies to queries as well.
+    :param scan_options: Options for `gather.scan.Scanner`.
+    """
+    def __init__(
+        self,
+        roots,
+        config,
+        interval = 30.0,
+        fs = OS_FILESYSTEM,
+        **scan_options
+    ):
+        self._roots = [ os.path.abspath(root) for root in roots ]
+        try:
+            self._gathered = GatheredDirectoryPattern(config.dir_template)
+        except ValueError:
+            self._gathered = None
+        else:
+            config = config._replace(append=True)
+        self._config = config
+        # each directory is indexed on its own, so isn't worth a database
+        self._index_config = config._replace(
+            collector = CollectorEngine.memory,
+            hierarchical = False,
+        )
+        self._interval = interval
+        self._fs = fs
+        self._max_depth = scan_options.pop("max_depth", None)
+        self._scanner = Scanner(fs=fs, **scan_options)
+
+        # directory path -> _Directory. replaced rather than changed, so
+        # queries can read it without locking
+        self._directories = { }
+        # depth below its root of each directory, for max_depth
+        self._depths = { }
+        # held while refreshing or gathering
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # queries
+
+    def lookup(self, path):
+        """
+        Returns the SequenceInfo that the file at `path` belongs to, or None.
+        """
+        path = os.path.abspath(path)
+        container = os.path.dirname(path)
+        directory = self._directories.get(container)
+        if directory is None:
+            # gathered directories are indexed with the one above
+            directory = self._directories.get(os.path.dirname(container))
+            if directory is None:
+                return None
+        return directory.by_path.get(path)
+
+    def list_sequences(self, path, recursive=False):
+        """
+        Returns the SequenceInfos in the directory at `path`, and if
+        `recursive` is True, in every directory below it.
+        """
+        sequences = [ ]
+        for directory in self._directories_in(os.path.abspath(path), recursive):
+            sequences.extend(directory.sequences)
+        return sequences
+
+    def gather(self, path, recursive=True, dry_run=False):
+        """
+        Gathers the sequences in the directory at `path`, and below it if
+        `recursive` is True, from the files already indexed.
+
+        :return: A summary of the run, as from
+          `gather.shard.ShardSummary.summary`.
+        """
+        path = os.path.abspath(path)
+        if not any(_is_within(path, root) for root in self._roots):
+            raise ValueError("%s is not in any of the service's roots" % path)
+        config = self._config._replace(dry_run=dry_run)
+        summary = ShardSummary(config, [ path ])
+
+        with self._lock:
+            if self._stopped.is_set():
+                raise ValueError("The service is stopping")
+
+            # only the directories that changed since the last refresh are
+            # listed again
+            self._refresh([ path ])
+            files = [
+                f
+                for directory in self._directories_in(path, recursive)
+                for f in directory.files
+            ]
+
+            result = None
+            try:
+                result = core.gather(files, config, summary, fs=self._fs)
+            finally:
+                if not dry_run:
+                    self._refresh([ path ])
+
+        return summary.summary(result)
+
+    def refresh(self):
+        with self._lock:
+            self._refresh(self._roots)
+
+    def _directories_in(self, path, recursive):
+        directories = self._directories
+        if not recursive:
+            directory = directories.get(path)
+            return [ ] if directory is None else [ directory ]
+
+        return [
+            directory for dir_path, directory in directories.items()
+            if _is_within(dir_path, path)
+        ]
+
+    # indexing
+
+    def _refresh(self, tops):
+        """
+        Brings the index up to date for the trees at `tops`, which must be
+        roots or directories already indexed.
+        """
+        old = self._directories
+        new = dict(old)
+        depths = dict(self._depths)
+        visited = VisitedSet()
+
+        stack = [ ]
+        for top in tops:
+            # everything below is found again, or is gone
+            for dir_path in list(new):
+                if _is_within(dir_path, top):
+                    del new[dir_path]
+            stack.append((top, None, depths.get(top, 0)))
+
+        while len(stack) > 0:
+            path, dev, depth = stack.pop()
+            if path in new:
+                continue
+
+            try:
+                st = self._fs.stat(path)
+            except OSError:
+                continue
+
+            directory = old.get(path)
+            if directory is None or not directory.unchanged(st.st_mtime, self._fs):
+                directory = self._index_directory(path, st, depth, visited)
+            new[path] = directory
+            depths[path] = depth
+
+            stack.extend(
+                (subdir, subdir_dev, depth + 1)
+                for subdir, subdir_dev in reversed(directory.subdirs)
+            )
+
+        self._depths = {
+            dir_path: depth for dir_path, depth in depths.items()
+            if dir_path in new
+        }
+        self._directories = new
+
+    def _index_directory(self, path, st, depth, visited):
+        listed_at = time.time()
+        descend = self._max_depth is None or depth < self._max_depth
+        files, subdirs = self._scanner.list_directory(
+            path,
+            st.st_dev,
+            visited,
+            descend,
+        )
+
+        gathered = [ ]
+        if self._gathered is not None and descend:
+            subdirs, gathered = self._list_gathered(subdirs, files, visited)
+
+        collector = core.make_collector(self._index_config, fs=self._fs)
+        collector.collect_all(files)
+        sequences = [
+            sequence for sequence in collector.sequences()
+            if len(sequence.paths) >= self._config.min_sequence_length
+        ]
+        return _Directory(
+            st.st_mtime,
+            listed_at,
+            subdirs,
+            gathered,
+            files,
+            sequences,
+        )
+
+    def _list_gathered(self, subdirs, files, visited):
+        """
+        Adds the files in the gathered directories among `subdirs` to
+        `files`, and returns the other subdirectories, and the path and
+        modification time of each gathered one.
+        """
+        others = [ ]
+        gathered = [ ]
+        for subdir, dev in subdirs:
+            if self._gathered.match(os.path.basename(subdir)) is None:
+                others.append((subdir, dev))
+                continue
+
+            try:
+                st = self._fs.stat(subdir)
+            except OSError:
+                continue
+            subdir_files, _ = self._scanner.list_directory(
+                subdir,
+                dev,
+                visited,
+                False,
+            )
+            files.extend(subdir_files)
+            gathered.append((subdir, st.st_mtime))
+        return others, gathered
+
+    # serving
+
+    def serve(self, socket_path):
+        """
+        Indexes the roots, then answers requests on a Unix domain socket at
+        `socket_path`, refreshing the index in the background, until
+        interrupted.
+        """
+        self.refresh()
+
+        _remove_stale_socket(socket_path)
+        server = _Server(socket_path, _RequestHandler)
+        server.service = self
+        # gathering can be triggered through the socket, so only the owner
+        # may connect
+        os.chmod(socket_path, 0o600)
+
+        refresher = threading.Thread(target=self._refresh_periodically)
+        refresher.daemon = True
+        refresher.start()
+
+        try:
+            server.serve_forever()
+        finally:
+            self._stopped.set()
+            server.server_close()
+            try:
+                os.unlink(socket_path)
+            except OSError:
+                pass
+            # request threads are daemons, and would be killed on exit, so
+            # wait for any gather under way to finish, or roll back, first.
+            # none can start once stopped is set
+            with self._lock:
+                pass
+
+    def _refresh_periodically(self):
+        while not self._stopped.wait(self._interval):
+            self.refresh()
+
+    def handle_request(self, request):
+        """
+        Returns the reply to `request`, a dict decoded from JSON.
+        """
+        op = request.get("op")
+        if op == "lookup":
+            sequence = self.lookup(_required(request, "path"))
+            return {
+                "ok": True,
+                "sequence": None if sequence is None else _describe(sequence),
+            }
+        if op == "list":
+            sequences = self.list_sequences(
+                _required(request, "dir"),
+                bool(request.get("recursive", False)),
+            )
+            return {
+                "ok": True,
+                "sequences": [ _describe(sequence) for sequence in sequences ],
+            }
+        if op == "gather":
+            summary = self.gather(
+                _required(request, "dir"),
+                bool(request.get("recursive", True)),
+                bool(request.get("dry_run", False)),
+            )
+            return { "ok": True, "summary": summary }
+        if op == "refresh":
+            self.refresh()
+            return { "ok": True }
+        raise ValueError("Unknown op: %r" % (op,))
+
+
+def _is_within(path, directory):
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _required(request, key):
+    value = request.get(key)
+    if not isinstance(value, str):
+        raise ValueError("%r must be a string" % key)
+    return value
+
+
+def _describe(sequence):
+    return {
+        "directory": sequence.container,
+        "prefix": sequence.prefix,
+        "suffix": sequence.suffix,
+        "first": sequence.first.number,
+        "last": sequence.last.number,
+        "count": len(sequence.paths),
+    }
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_BYTES:
+                self._reply({ "ok": False, "error": "Request too long" })
+                return
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise ValueError("Request must be a JSON object")
+                reply = self.server.service.handle_request(request)
+            except (ValueError, OSError) as error:
+                reply = { "ok": False, "error": str(error) }
+            except RollbackError as error:
+                reply = {
+                    "ok": False,
+                    "error": "%s: %d actions could not be undone" % (
+                        error.args[0],
+                        len(error.actions),
+                    ),
+                }
+            self._reply(reply)
+
+    def _reply(self, reply):
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+def _remove_stale_socket(socket_path):
+    """
+    Removes a socket left at `socket_path` by a service that is no longer
+    running. Raises OSError if one is still running there.
+    """
+    if not os.path.exists(socket_path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise OSError(errno.EADDRINUSE, "A service is already running", socket_path)
+    finally:
+        probe.close()
+
+
+def query(socket_path, request):
+    """
+    Sends `request`, a dict, to the service at `socket_path`, and returns
+    its reply.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        stream = connection.makefile("rwb")
+        stream.write(json.dumps(request).encode("utf-8") + b"\n")
+        stream.flush()
+        line = stream.readline()
+    finally:
+        connection.close()
+
+    if not line:
+        raise OSError(errno.ECONNRESET, "The service closed the connection", socket_path)
+    return json.loads(line.decode("utf-8"))
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write("usage: %s SOCKET REQUEST\n" % os.path.basename(sys.argv[0]))
+        return 2
+
+    reply = query(sys.argv[1], json.loads(sys.argv[2]))
+    sys.stdout.write(json.dumps(reply, indent=2, sort_keys=True) + "\n")
+    return 0 if reply.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
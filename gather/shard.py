@@ -0,0 +1,371 @@
+"""
+Splits one run over a tree between independent processes, possibly on
+different hosts, without any coordination between them.
+
+Each process is given a `Shard`, the same shard count and the same
+options, and gathers only its own share of the sequences. Every sequence
+that would be moved to the same directory belongs to the same shard, so
+shared directories and conflicts are found just as they would be by a
+single run.
+
+Each process can write a JSON summary of what it did with --json-summary,
+and `python -m gather.shard` merges the summaries from every shard.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import string
+import sys
+import time
+
+from gather.analyze import GatheredDirectoryPattern
+from gather.handlers import Handler
+from gather.params import GatherResult, RollbackBehavior
+
+
+__all__ = (
+    "Shard",
+    "ShardSummary",
+    "merge_summaries",
+    "parse_shard",
+)
+
+
+DIGITS_PATTERN = re.compile(r"\d+")
+
+
+class Shard(object):
+    """
+    One of `count` disjoint shares of a run, numbered from 0.
+
+    The tree itself is divided: every directory `depth` levels below a root
+    is hashed, and the shard that owns it scans, analyzes and gathers
+    everything beneath it. Files above that level go to the shard that owns
+    their directory.
+
+    Directories that must be analyzed together are kept together.
+    Directories made from the template go with the directory they are in,
+    so that one shard never scans what another has just gathered, and with
+    `append`, their files can be added to. With `hierarchical`, numbered
+    directories go with the others numbered the same way beside them.
+
+    :param template: The directory template the run uses. It must put each
+      sequence's directory beside its files, as templates starting with
+      {path_prefix} and with no path separators do. Any other template can
+      put sequences from different directories, owned by different shards,
+      into the same directory, while other shards are still scanning it, so
+      ValueError is raised.
+    :param depth: The level, below each root, at which the tree is divided.
+    """
+    def __init__(
+        self,
+        index,
+        count,
+        template,
+        depth = 1,
+        hierarchical = False,
+    ):
+        if count < 1:
+            raise ValueError("Shard count must be at least 1")
+        if not 0 <= index < count:
+            raise ValueError("Shard index must be from 0 to %d" % (count - 1))
+        if depth < 0:
+            raise ValueError("Shard depth must not be negative")
+
+        if not _targets_beside_files(template):
+            raise ValueError(
+                "Sharding needs a template that starts with {path_prefix} "
+                "and has no path separators"
+            )
+
+        self.index = index
+        self.count = count
+        self.depth = depth
+        try:
+            self._gathered = GatheredDirectoryPattern(template)
+        except ValueError:
+            # made with fields that can't be recognized, and never appended to
+            self._gathered = None
+        self._hierarchical = hierarchical
+
+    def __str__(self):
+        return "%d/%d" % (self.index, self.count)
+
+    def owns_directory(self, path):
+        """
+        Returns True if this shard should scan the files in the directory
+        at `path`, and, if it is at the shard depth, everything below it.
+        """
+        return self._owns(self._directory_key(path))
+
+    def _directory_key(self, path):
+        path = os.path.normpath(os.path.abspath(path))
+        parent, name = os.path.split(path)
+        if not name:
+            return path
+
+        if self._gathered is not None and self._gathered.match(name) is not None:
+            # it may have been made from files in the directory it's in
+            return self._directory_key(parent)
+        if self._hierarchical:
+            return os.path.join(parent, DIGITS_PATTERN.sub("#", name))
+        return path
+
+    def _owns(self, key):
+        digest = hashlib.sha1(os.fsencode(os.path.abspath(key))).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+
+def _targets_beside_files(template):
+    """
+    Returns True if every directory made from `template` is in the same
+    directory as the files it was made for, so that sequences from
+    different directories can never share one.
+    """
+    parts = list(string.Formatter().parse(template))
+    if len(parts) == 0 or parts[0][:2] != ("", "path_prefix"):
+        return False
+    return not any(
+        os.sep in literal or (os.altsep and os.altsep in literal)
+        for literal, _field, _spec, _conversion in parts
+    )
+
+
+def parse_shard(text):
+    """
+    Parses a shard given as `INDEX/COUNT`, such as `0/8`, into a tuple of
+    ints.
+    """
+    index, separator, count = text.partition("/")
+    if not separator:
+        raise ValueError("Shard must be given as INDEX/COUNT")
+    index, count = int(index), int(count)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Shard index must be from 0 to COUNT-1")
+    return index, count
+
+
+class ShardSummary(Handler):
+    """
+    A Handler that records what happened to each sequence, for writing as a
+    JSON summary with `write`.
+    """
+    def __init__(self, config, paths, shard=None):
+        self._config = config
+        self._paths = list(paths)
+        self._shard = shard
+        self._start = time.time()
+
+        self._attempted = 0
+        self._cancel_reasons = [ ]
+        self._skipped = { }
+        # target directories moved, and not since rolled back
+        self._moved = [ ]
+        self._moved_files = 0
+        self._moved_bytes = 0
+        self._current = None
+        self._rolled_back = 0
+        self._rollback_failed = False
+
+    def handle_cancel_reasons(self, cancel_reasons):
+        self._cancel_reasons = sorted(reason.name for reason in cancel_reasons)
+
+    def before_sequence_batch(self, target_dir, sequence):
+        self._attempted += 1
+        self._current = (target_dir, sequence)
+
+    def after_sequence_move(self, target_dir):
+        target_dir, sequence = self._current
+        self._current = None
+        self._moved.append(target_dir)
+        self._moved_files += len(sequence.paths)
+        self._moved_bytes += sequence.size or 0
+
+    def sequence_skipped(self, target_dir, sequence, reason):
+        self._attempted += 1
+        self._skipped[reason.name] = self._skipped.get(reason.name, 0) + 1
+
+    def after_rollback(self):
+        self._current = None
+        self._rolled_back += 1
+        if self._config.rollback_behavior == RollbackBehavior.all:
+            # everything moved so far was rolled back with it
+            self._rolled_back += len(self._moved)
+            self._moved = [ ]
+            self._moved_files = 0
+            self._moved_bytes = 0
+
+    def rollback_error(self, rollback_error):
+        self._rollback_failed = True
+
+    def summary(self, result):
+        """
+        Returns the summary as a dict that can be written as JSON.
+
+        :param result: The GatherResult of the run, or None if it stopped
+          with an exception.
+        """
+        return {
+            "shard": (
+                None
+                if self._shard is None
+                else { "index": self._shard.index, "count": self._shard.count }
+            ),
+            "paths": self._paths,
+            "dry_run": self._config.dry_run,
+            "result": None if result is None else result.name,
+            "cancel_reasons": self._cancel_reasons,
+            "sequences": {
+                "attempted": self._attempted,
+                "moved": len(self._moved),
+                "skipped": sum(self._skipped.values()),
+                "rolled_back": self._rolled_back,
+            },
+            "skipped": self._skipped,
+            "rollback_failed": self._rollback_failed,
+            "files_moved": self._moved_files,
+            "bytes_moved": self._moved_bytes,
+            "seconds": round(time.time() - self._start, 3),
+            "targets": self._moved,
+        }
+
+    def write(self, path, result):
+        with open(path, "w") as stream:
+            json.dump(self.summary(result), stream, indent=2, sort_keys=True)
+            stream.write("\n")
+
+
+def merge_summaries(summaries):
+    """
+    Combines the summaries written by each shard of a run into one. The
+    merged summary lists the shards that are missing or appear more than
+    once, and any directory moved by more than one shard, which can only
+    happen if the shards were run with different options.
+    """
+    counts = set()
+    indices = [ ]
+    totals = {
+        "attempted": 0,
+        "moved": 0,
+        "skipped": 0,
+        "rolled_back": 0,
+    }
+    skipped = { }
+    cancel_reasons = set()
+    results = [ ]
+    seen_targets = set()
+    duplicate_targets = set()
+    merged = {
+        "files_moved": 0,
+        "bytes_moved": 0,
+        "seconds": 0,
+    }
+    rollback_failed = False
+    dry_run = False
+
+    for summary in summaries:
+        shard = summary.get("shard")
+        if shard is not None:
+            counts.add(shard["count"])
+            indices.append(shard["index"])
+
+        for key in totals:
+            totals[key] += summary["sequences"][key]
+        for reason, count in summary["skipped"].items():
+            skipped[reason] = skipped.get(reason, 0) + count
+        cancel_reasons.update(summary["cancel_reasons"])
+        results.append(summary["result"])
+        merged["files_moved"] += summary["files_moved"]
+        merged["bytes_moved"] += summary["bytes_moved"]
+        # the shards may have run at the same time, so the slowest one is
+        # how long the run took
+        merged["seconds"] = max(merged["seconds"], summary["seconds"])
+        rollback_failed = rollback_failed or summary["rollback_failed"]
+        dry_run = dry_run or summary["dry_run"]
+
+        for target in summary["targets"]:
+            if target in seen_targets:
+                duplicate_targets.add(target)
+            seen_targets.add(target)
+
+    count = max(counts) if counts else len(indices)
+    missing = sorted(set(range(count)) - set(indices))
+    repeated = sorted(set(i for i in indices if indices.count(i) > 1))
+
+    merged.update({
+        "shard_counts": sorted(counts),
+        "shards": len(results),
+        "missing_shards": missing,
+        "repeated_shards": repeated,
+        "dry_run": dry_run,
+        "result": _worst_result(results),
+        "cancel_reasons": sorted(cancel_reasons),
+        "sequences": totals,
+        "skipped": skipped,
+        "rollback_failed": rollback_failed,
+        "duplicate_targets": sorted(duplicate_targets),
+    })
+    return merged
+
+
+def _worst_result(results):
+    if len(results) == 0:
+        return None
+    if None in results:
+        # a shard stopped with an exception
+        return None
+    return max(
+        (GatherResult[name] for name in results),
+        key = lambda result: result.value
+    ).name
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description = """Merge the JSON summaries written by each shard of a
+        run with --shard and --json-summary."""
+    )
+    p.add_argument(
+        "summaries",
+        nargs = "+",
+        metavar = "FILE",
+        help = """Summaries to merge."""
+    )
+
+    p.add_argument(
+        "-o", "--output",
+        default = None,
+        metavar = "FILE",
+        help = """Write the merged summary to %(metavar)s. The default is
+        standard output."""
+    )
+
+    args = p.parse_args()
+
+    summaries = [ ]
+    for path in args.summaries:
+        with open(path, "r") as stream:
+            summaries.append(json.load(stream))
+
+    merged = merge_summaries(summaries)
+    text = json.dumps(merged, indent=2, sort_keys=True) + "\n"
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w") as stream:
+            stream.write(text)
+
+    complete = (
+        len(merged["missing_shards"]) == 0 and
+        len(merged["repeated_shards"]) == 0 and
+        len(merged["duplicate_targets"]) == 0 and
+        len(merged["shard_counts"]) <= 1
+    )
+    return 0 if complete and merged["result"] == GatherResult.ok.name else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
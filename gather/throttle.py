@@ -0,0 +1,221 @@
+import contextlib
+import threading
+import time
+
+
+__all__ = ("NoOpThrottle", "Throttle", "TokenBucket", "AdaptiveBackoff")
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of some quantity to `rate` units per second, allowing
+    bursts of up to `capacity` units.
+
+    The default capacity is a tenth of a second's worth, so that throughput
+    stays close to the limit at all times rather than alternating between
+    bursts and long waits. Acquiring more than the capacity at once is
+    allowed; the bucket goes into debt and the caller waits it out.
+    """
+    def __init__(
+        self,
+        rate,
+        capacity = None,
+        clock = time.monotonic,
+        sleep = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self._rate = float(rate)
+        self._capacity = (
+            float(capacity)
+            if capacity is not None
+            else max(1.0, self._rate / 10)
+        )
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self._tokens = self._capacity
+        self._last = self._clock()
+
+    def acquire(self, amount=1):
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._last) * self._rate
+            )
+            self._last = now
+            self._tokens -= amount
+            deficit = -self._tokens
+
+        if deficit > 0:
+            self._sleep(deficit / self._rate)
+
+
+BASELINE_DRIFT = 0.001
+
+
+class AdaptiveBackoff(object):
+    """
+    Slows operations down when their latency rises.
+
+    A smoothed latency is compared against a slowly adapting baseline. While
+    it exceeds `threshold` times the baseline, the duty cycle is halved (no
+    more than once per `cooldown` seconds) down to `min_factor`; otherwise it
+    recovers a step at a time. Running at a factor of f means pausing after
+    each operation for long enough that operations take up only f of the
+    time.
+    """
+    def __init__(
+        self,
+        threshold = 3.0,
+        min_factor = 1.0 / 32,
+        recovery = 0.01,
+        cooldown = 1.0,
+        smoothing = 0.1,
+        clock = time.monotonic,
+        sleep = time.sleep,
+    ):
+        self._threshold = threshold
+        self._min_factor = min_factor
+        self._recovery = recovery
+        self._cooldown = cooldown
+        self._smoothing = smoothing
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self.factor = 1.0
+        self._latency = None
+        self._baseline = None
+        self._next_decrease = 0.0
+
+    def record(self, latency, count=1):
+        """
+        Records that `count` operations, done together, took `latency`
+        seconds, and pauses as necessary.
+        """
+        with self._lock:
+            total = latency
+            latency = latency / count
+            if self._latency is None:
+                self._latency = latency
+                self._baseline = latency
+            else:
+                self._latency += (latency - self._latency) * self._smoothing
+                # the baseline follows drops immediately and rises very
+                # slowly, so a sustained slowdown stays visible for a while
+                if self._latency < self._baseline:
+                    self._baseline = self._latency
+                else:
+                    self._baseline += (
+                        (self._latency - self._baseline) * BASELINE_DRIFT
+                    )
+
+            now = self._clock()
+            if self._latency > self._baseline * self._threshold:
+                if now >= self._next_decrease:
+                    self.factor = max(self._min_factor, self.factor / 2)
+                    self._next_decrease = now + self._cooldown
+            else:
+                self.factor = min(1.0, self.factor + self._recovery)
+
+            pause = total * (1.0 / self.factor - 1.0)
+
+        if pause > 0:
+            self._sleep(pause)
+
+
+class NoOpThrottle(object):
+    # True if byte counts given to operations are limited
+    limits_bytes = False
+
+    def operation(self, byte_count=0):
+        return _NULL_CONTEXT
+
+    def batch(self, count, byte_count=0):
+        return _NULL_CONTEXT
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+
+class Throttle(NoOpThrottle):
+    """
+    Limits the rate of filesystem operations, and of bytes moved by them.
+    A single Throttle can be shared by everything that touches one
+    filesystem, and is safe to use from multiple threads.
+
+    :param max_ops_per_sec: If not None, the maximum number of operations
+      per second.
+    :param max_bytes_per_sec: If not None, the maximum number of bytes per
+      second.
+    :param backoff: An optional `AdaptiveBackoff`, which slows operations
+      further when their latency rises.
+    """
+    def __init__(
+        self,
+        max_ops_per_sec = None,
+        max_bytes_per_sec = None,
+        backoff = None,
+        clock = time.monotonic,
+    ):
+        self._ops = (
+            TokenBucket(max_ops_per_sec, clock=clock)
+            if max_ops_per_sec
+            else None
+        )
+        self._bytes = (
+            TokenBucket(max_bytes_per_sec, clock=clock)
+            if max_bytes_per_sec
+            else None
+        )
+        self._backoff = backoff
+        self._clock = clock
+        self.limits_bytes = self._bytes is not None
+
+    @contextlib.contextmanager
+    def operation(self, byte_count=0):
+        """
+        A context manager to wrap around a single operation, which waits as
+        necessary beforehand and records its latency afterward.
+        """
+        if self._ops is not None:
+            self._ops.acquire(1)
+        if self._bytes is not None and byte_count > 0:
+            self._bytes.acquire(byte_count)
+
+        start = self._clock()
+        yield
+        if self._backoff is not None:
+            self._backoff.record(self._clock() - start)
+
+    @contextlib.contextmanager
+    def batch(self, count, byte_count=0):
+        """
+        Like `operation`, for `count` operations submitted together, such as
+        a batch of renames, which are waited for all at once and timed from
+        submission to completion.
+        """
+        if count == 0:
+            yield
+            return
+
+        if self._ops is not None:
+            self._ops.acquire(count)
+        if self._bytes is not None and byte_count > 0:
+            self._bytes.acquire(byte_count)
+
+        start = self._clock()
+        yield
+        if self._backoff is not None:
+            self._backoff.record(self._clock() - start, count)
@@ -1,5 +1,13 @@
+import collections
+import concurrent.futures
+import ctypes
+import errno
 import os
-import shutil
+import threading
+
+from gather.fs import OS_FILESYSTEM
+from gather.throttle import NoOpThrottle
+from gather import uring
 
 
 class TransactionError(OSError):
@@ -24,30 +32,96 @@ class Action(object):
 
     __str__ = __repr__
 
-    def execute(self):
+    # the number of bytes of file data the action may have to move
+    byte_count = 0
+
+    def execute(self, fs=OS_FILESYSTEM):
+        """
+        :param fs: The `gather.fs.OsFilesystem` or other backend to act on.
+        """
         raise NotImplementedError()
 
     def undo_action(self):
         raise NotImplementedError()
 
+    def changed_paths(self):
+        """
+        Returns the paths of the directory entries the action creates or
+        removes. Their parent directories must exist while it runs.
+        """
+        raise NotImplementedError()
+
 
 class Move(Action):
-    def __init__(self, src, dest):
+    def __init__(self, src, dest, size=None):
         super().__init__(src, dest)
         self._src = src
         self._dest = dest
+        self._size = size
+        self.byte_count = size or 0
+
+    @property
+    def src(self):
+        return self._src
+
+    @property
+    def dest(self):
+        return self._dest
 
     def __str__(self):
         return "mv %s %s" % (self._src, self._dest)
 
-    def execute(self):
-        if not os.path.exists(self._dest):
-            shutil.move(self._src, self._dest)
+    def execute(self, fs=OS_FILESYSTEM):
+        if not fs.exists(self._dest):
+            fs.move(self._src, self._dest)
         else:
             raise TransactionError("Moving %s: Destination exists: %s" % (self._src, self._dest))
 
     def undo_action(self):
-        return Move(self._dest, self._src)
+        return Move(self._dest, self._src, self._size)
+
+    def changed_paths(self):
+        return (self._src, self._dest)
+
+
+class DirFdMove(Move):
+    """
+    A Move that renames relative to already open directory file
+    descriptors, so the kernel doesn't have to resolve the full path of
+    each file again. Its undo action is an ordinary Move, as the
+    descriptors may have been closed by the time it runs.
+    """
+    def __init__(self, src, dest, size, src_dir_fd, dest_dir_fd):
+        super().__init__(src, dest, size)
+        self._src_name = os.path.basename(src)
+        self._dest_name = os.path.basename(dest)
+        self._src_dir_fd = src_dir_fd
+        self._dest_dir_fd = dest_dir_fd
+
+    def execute(self, fs=OS_FILESYSTEM):
+        try:
+            os.stat(
+                self._dest_name,
+                dir_fd = self._dest_dir_fd,
+                follow_symlinks = False
+            )
+        except FileNotFoundError:
+            pass
+        else:
+            raise TransactionError("Moving %s: Destination exists: %s" % (self._src, self._dest))
+
+        try:
+            os.rename(
+                self._src_name,
+                self._dest_name,
+                src_dir_fd = self._src_dir_fd,
+                dst_dir_fd = self._dest_dir_fd
+            )
+        except OSError as ose:
+            if ose.errno != errno.EXDEV:
+                raise
+            # different filesystems, so the data has to be copied
+            fs.move(self._src, self._dest)
 
 
 class Mkdir(Action):
@@ -55,15 +129,22 @@ class Mkdir(Action):
         super().__init__(path)
         self._path = path
 
+    @property
+    def path(self):
+        return self._path
+
     def __str__(self):
         return "mkdir %s" % self._path
 
-    def execute(self):
-        os.mkdir(self._path)
+    def execute(self, fs=OS_FILESYSTEM):
+        fs.mkdir(self._path)
 
     def undo_action(self):
         return Rmdir(self._path)
 
+    def changed_paths(self):
+        return (self._path,)
+
 
 class Rmdir(Action):
     def __init__(self, path):
@@ -73,12 +154,15 @@ class Rmdir(Action):
     def __str__(self):
         return "rmdir %s" % self._path
 
-    def execute(self):
-        os.rmdir(self._path)
+    def execute(self, fs=OS_FILESYSTEM):
+        fs.rmdir(self._path)
 
     def undo_action(self):
         return Mkdir(self._path)
 
+    def changed_paths(self):
+        return (self._path,)
+
 
 class DryRunner(object):
     def rollback(self):
@@ -87,25 +171,75 @@ class DryRunner(object):
     def commit(self):
         pass
 
-    def move(self, src, dest):
-        pass
+    def move(self, src, dest, size=None, before=None, after=None):
+        if before is not None:
+            before()
+        if after is not None:
+            after()
 
     def mkdirp(self, path):
         pass
 
+    def rmdir_if_empty(self, path):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
 
 class FilesystemTransaction(object):
-    def __init__(self):
+    """
+    Executes filesystem actions, recording how to undo them.
+
+    :param throttle: An optional `gather.throttle.Throttle` to limit the
+      rate of actions, including those performed during rollback.
+    :param fs: The filesystem to act on. The default is the real one.
+    :param rollback_workers: The number of threads to undo actions with
+      during rollback. With more than one, actions that don't depend on each
+      other, such as moves out of the same directory, are undone
+      concurrently.
+    """
+    def __init__(self, throttle=None, fs=None, rollback_workers=1):
         self._undo = [ ]
+        self._throttle = throttle or NoOpThrottle()
+        self._fs = fs or OS_FILESYSTEM
+        self._rollback_workers = rollback_workers
+
+        # directories known to exist, so that mkdirp doesn't have to ask the
+        # filesystem again for every sequence that shares a parent
+        self._known_dirs = set()
+        # (source directory, destination directory) -> whether they are on
+        # different filesystems
+        self._crosses_devices = { }
 
     def commit(self):
         self._undo = [ ]
 
+    def flush(self):
+        """
+        Waits for every action so far to be done. Errors from actions that
+        are done in batches are raised from here.
+        """
+        pass
+
+    def close(self):
+        pass
+
     def rollback(self):
+        # undoing may remove directories
+        self._known_dirs.clear()
+
+        if self._rollback_workers > 1 and len(self._undo) > 1:
+            self._parallel_rollback()
+            return
+
         while len(self._undo) > 0:
             action = self._undo[-1]
             try:
-                action.execute()
+                self._execute(action)
             except OSError as ose:
                 raise RollbackError(
                     "Error rolling back",
@@ -114,13 +248,106 @@ class FilesystemTransaction(object):
 
             self._undo.pop()
 
-    def move(self, src, dest):
-        self._execute_with_undo(Move(src, dest))
+    def _parallel_rollback(self):
+        """
+        Undoes every action, running each as soon as the ones it depends on
+        are done, on up to `rollback_workers` threads. After a failure no
+        more actions are started, and every action that isn't done is left
+        in the undo log and listed in the RollbackError, in the order they
+        would have been undone.
+        """
+        actions = self._undo[::-1]
+        dependents = [ [ ] for _ in actions ]
+        waiting = [ ]
+        for index, dependencies in enumerate(_undo_dependencies(actions)):
+            for dependency in dependencies:
+                dependents[dependency].append(index)
+            waiting.append(len(dependencies))
+
+        ready = collections.deque(
+            index for index, count in enumerate(waiting) if count == 0
+        )
+        done = [ False ] * len(actions)
+        first_error = None
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self._rollback_workers) as executor:
+                # future -> index of its action
+                running = { }
+                while True:
+                    while (first_error is None and
+                            len(ready) > 0 and
+                            len(running) < self._rollback_workers):
+                        index = ready.popleft()
+                        future = executor.submit(self._execute, actions[index])
+                        running[future] = index
+
+                    if len(running) == 0:
+                        break
+
+                    finished, _ = concurrent.futures.wait(
+                        running,
+                        return_when = concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        index = running.pop(future)
+                        try:
+                            future.result()
+                        except OSError as ose:
+                            if first_error is None:
+                                first_error = ose
+                            continue
+
+                        done[index] = True
+                        for dependent in dependents[index]:
+                            waiting[dependent] -= 1
+                            if waiting[dependent] == 0:
+                                ready.append(dependent)
+        finally:
+            remaining = [
+                action for action, is_done in zip(actions, done)
+                if not is_done
+            ]
+            self._undo = remaining[::-1]
+
+        if first_error is not None:
+            raise RollbackError("Error rolling back", remaining) from first_error
+
+    def move(self, src, dest, size=None, before=None, after=None):
+        """
+        Moves `src` to `dest`.
+
+        :param before: Called with no arguments just before the move is made.
+        :param after: Called with no arguments once it has been made.
+        """
+        # src may be a directory
+        self._known_dirs.discard(src)
+        if before is not None:
+            before()
+        self._execute_with_undo(Move(src, dest, size))
+        if after is not None:
+            after()
+
+    def rmdir_if_empty(self, path):
+        """
+        Removes the directory at `path` if it has nothing left in it.
+        Returns True if it was removed.
+        """
+        try:
+            self._execute_with_undo(Rmdir(path))
+        except OSError as ose:
+            if ose.errno in (errno.ENOTEMPTY, errno.EEXIST):
+                return False
+            raise
+
+        self._known_dirs.discard(path)
+        return True
 
     def mkdirp(self, path):
-        if path == "":
+        if path == "" or path in self._known_dirs:
             return
 
+        target = path
         stack = [ ]
 
         while True:
@@ -144,15 +371,311 @@ class FilesystemTransaction(object):
                 parent_path = os.path.dirname(path)
                 if parent_path == path:
                     raise TransactionError("Reached a root while trying to create parent directories")
-                elif parent_path == "":
+                elif parent_path == "" or parent_path in self._known_dirs:
                     break
+                path = parent_path
 
         while len(stack) > 0:
-            self._execute_with_undo(stack.pop())
+            maker = stack.pop()
+            self._execute_with_undo(maker)
+            self._known_dirs.add(maker.path)
+
+        self._known_dirs.add(target)
 
     def _execute_with_undo(self, action):
-        action.execute()
+        self._execute(action)
         self._push_undo(action)
 
+    def _execute(self, action):
+        with self._throttle.operation(self._copied_bytes(action)):
+            action.execute(self._fs)
+
+    def _copied_bytes(self, action):
+        """
+        Returns the number of bytes `action` will copy, which is none unless
+        it is a move between filesystems.
+        """
+        if action.byte_count == 0 or not self._throttle.limits_bytes:
+            return 0
+
+        directories = (
+            os.path.dirname(action.src),
+            os.path.dirname(action.dest),
+        )
+        crosses = self._crosses_devices.get(directories)
+        if crosses is None:
+            try:
+                crosses = (
+                    self._fs.stat(directories[0] or os.curdir).st_dev !=
+                    self._fs.stat(directories[1] or os.curdir).st_dev
+                )
+            except OSError:
+                # the move will fail on its own
+                return 0
+            self._crosses_devices[directories] = crosses
+        return action.byte_count if crosses else 0
+
     def _push_undo(self, action):
         self._undo.append(action.undo_action())
+
+
+def _undo_dependencies(actions):
+    """
+    Returns, for each of `actions` in the order they are to be run, the set
+    of indices of earlier actions that must be done before it can start.
+
+    An action depends on the last earlier action to change its paths or any
+    directory above them, and, for each path it changes, on every earlier
+    action since then that used that path or anything below it. So moves
+    into or out of the same directory are independent, while removing a
+    directory waits for everything moved out of it, and moving into a
+    directory waits for it to be created.
+    """
+    changed = [
+        [ os.path.normpath(path) for path in action.changed_paths() ]
+        for action in actions
+    ]
+    # only paths that some action changes need their users tracked
+    changeable = set(path for paths in changed for path in paths)
+
+    # path -> index of the last action to change it
+    last_change = { }
+    # path -> indices of actions since its last change that used it, or
+    # anything below it
+    users = collections.defaultdict(list)
+
+    dependencies = [ ]
+    for index, paths in enumerate(changed):
+        before = set()
+        for path in paths:
+            for ancestor in _path_and_ancestors(path):
+                last = last_change.get(ancestor)
+                if last is not None:
+                    before.add(last)
+            before.update(users.pop(path, ()))
+
+        for path in paths:
+            last_change[path] = index
+            for ancestor in _path_and_ancestors(path):
+                if ancestor in changeable:
+                    users[ancestor].append(index)
+
+        before.discard(index)
+        dependencies.append(before)
+
+    return dependencies
+
+
+def _path_and_ancestors(path):
+    while True:
+        yield path
+        parent = os.path.dirname(path)
+        if parent == path or parent == "":
+            return
+        path = parent
+
+
+DIRFD_SUPPORTED = (
+    os.rename in os.supports_dir_fd and
+    os.stat in os.supports_dir_fd
+)
+DIRECTORY_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+
+class DirFdTransaction(FilesystemTransaction):
+    """
+    A FilesystemTransaction that moves files with renames relative to
+    directory file descriptors. Descriptors are opened once and reused while
+    moving files between the same directories, and up to `max_open` are kept
+    open at once. It always acts on the real filesystem.
+    """
+    def __init__(self, throttle=None, max_open=32, rollback_workers=1):
+        super().__init__(throttle, rollback_workers=rollback_workers)
+        self._max_open = max_open
+        self._dir_fds = collections.OrderedDict()
+
+    def close(self):
+        while len(self._dir_fds) > 0:
+            _, fd = self._dir_fds.popitem()
+            os.close(fd)
+
+    def rollback(self):
+        # directories may be removed and recreated, leaving descriptors
+        # pointing at the old ones
+        self.close()
+        super().rollback()
+
+    def move(self, src, dest, size=None, before=None, after=None):
+        # if src is a directory, a descriptor for it would still refer to it
+        # after the move, under the wrong path
+        self._close_dir_fd(src)
+        self._known_dirs.discard(src)
+        if before is not None:
+            before()
+        self._execute_with_undo(DirFdMove(
+            src,
+            dest,
+            size,
+            self._dir_fd(os.path.dirname(src)),
+            self._dir_fd(os.path.dirname(dest)),
+        ))
+        if after is not None:
+            after()
+
+    def rmdir_if_empty(self, path):
+        self._close_dir_fd(path)
+        return super().rmdir_if_empty(path)
+
+    def _close_dir_fd(self, path):
+        fd = self._dir_fds.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _dir_fd(self, path):
+        fd = self._dir_fds.get(path)
+        if fd is not None:
+            self._dir_fds.move_to_end(path)
+            return fd
+
+        fd = os.open(path or os.curdir, DIRECTORY_OPEN_FLAGS)
+        self._dir_fds[path] = fd
+        if len(self._dir_fds) > self._max_open:
+            _, oldest = self._dir_fds.popitem(last=False)
+            os.close(oldest)
+        return fd
+
+
+class UringTransaction(FilesystemTransaction):
+    """
+    A FilesystemTransaction that queues moves and submits them to io_uring
+    in batches of up to `batch_size`, rather than making a system call for
+    each. Directories are created through io_uring as well.
+
+    Moves are renames that fail rather than replace an existing
+    destination. The result of each is matched back to its Move once the
+    batch is done: successful moves are recorded for undo in the order they
+    were queued, and the first failure is raised, so rollback works as it
+    does for any other transaction. Moves across filesystems are left to
+    `Move.execute`.
+
+    Rate limits from `throttle` are applied to each batch as it is
+    submitted, and its latency is measured from submission to completion.
+    The `before` and `after` callbacks of each move are called when its
+    batch is submitted and once it has completed. It always acts on the real
+    filesystem.
+    """
+    def __init__(self, throttle=None, batch_size=256, rollback_workers=1):
+        super().__init__(throttle, rollback_workers=rollback_workers)
+        self._ring = uring.Ring(batch_size)
+        # rollback may create directories from several threads
+        self._ring_lock = threading.Lock()
+        self._batch_size = batch_size
+        self._queued = [ ]
+
+    def commit(self):
+        self.flush()
+        super().commit()
+
+    def close(self):
+        # moves are only made by flush and commit. anything still queued
+        # here was abandoned, as by an interrupt, and must not be made
+        # outside of rollback
+        self._queued = [ ]
+        self._ring.close()
+
+    def rollback(self):
+        # anything still queued was never started, so there's nothing to undo
+        self._queued = [ ]
+        super().rollback()
+
+    def move(self, src, dest, size=None, before=None, after=None):
+        self._known_dirs.discard(src)
+        self._queued.append((Move(src, dest, size), before, after))
+        if len(self._queued) >= self._batch_size:
+            self.flush()
+
+    def mkdirp(self, path):
+        # moves into the directory's parent may be queued
+        self.flush()
+        super().mkdirp(path)
+
+    def rmdir_if_empty(self, path):
+        self.flush()
+        return super().rmdir_if_empty(path)
+
+    def flush(self):
+        if len(self._queued) == 0:
+            return
+        queued = self._queued
+        self._queued = [ ]
+        moves = [ move for move, _before, _after in queued ]
+
+        # every path in the batch goes in one buffer, each ending in a null
+        encoded = [ ]
+        for move in moves:
+            encoded.append(os.fsencode(move.src) + b"\0")
+            encoded.append(os.fsencode(move.dest) + b"\0")
+        paths = ctypes.create_string_buffer(b"".join(encoded))
+        address = ctypes.addressof(paths)
+
+        operations = [ ]
+        for src, dest in zip(encoded[0::2], encoded[1::2]):
+            dest_address = address + len(src)
+            operations.append((
+                uring.IORING_OP_RENAMEAT,
+                uring.AT_FDCWD,
+                address,
+                uring.AT_FDCWD,
+                dest_address,
+                uring.RENAME_NOREPLACE,
+            ))
+            address = dest_address + len(dest)
+
+        for _move, before, _after in queued:
+            if before is not None:
+                before()
+        with self._throttle.batch(len(operations)):
+            results = self._ring.run(operations)
+
+        first_error = None
+        for (move, _before, after), result in zip(queued, results):
+            try:
+                if result == -errno.EXDEV or result == -errno.EINVAL:
+                    # a different filesystem, or one that can't rename
+                    # without replacing
+                    super()._execute(move)
+                elif result < 0:
+                    raise _move_error(move, -result)
+            except OSError as ose:
+                if first_error is None:
+                    first_error = ose
+                continue
+            self._push_undo(move)
+            if after is not None:
+                after()
+
+        if first_error is not None:
+            raise first_error
+
+    def _execute(self, action):
+        if not isinstance(action, Mkdir):
+            super()._execute(action)
+            return
+
+        path = ctypes.create_string_buffer(os.fsencode(action.path))
+        with self._throttle.operation(), self._ring_lock:
+            result, = self._ring.run([ (
+                uring.IORING_OP_MKDIRAT,
+                uring.AT_FDCWD,
+                ctypes.addressof(path),
+                0o777,
+                0,
+                0,
+            ) ])
+        if result < 0:
+            raise OSError(-result, os.strerror(-result), action.path)
+
+
+def _move_error(move, error):
+    if error == errno.EEXIST:
+        return TransactionError("Moving %s: Destination exists: %s" % (move.src, move.dest))
+    return OSError(error, os.strerror(error), move.src, None, move.dest)
@@ -0,0 +1,394 @@
+"""
+A minimal io_uring interface, through ctypes, for submitting batches of
+renames and directory creations on Linux.
+
+Only what `gather.transaction.UringTransaction` needs is here: one ring,
+used from one thread, with each batch submitted and then waited on until
+every operation in it has completed.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+import platform
+import struct
+import sys
+
+
+__all__ = ("Ring", "uring_supported")
+
+
+# io_uring_setup, io_uring_enter and io_uring_register, by platform.machine().
+# most architectures share the generic numbers, but not all: alpha has its
+# own, and on mips they depend on the ABI, which the machine name doesn't
+# tell, so io_uring isn't used there
+GENERIC_SYSCALLS = (425, 426, 427)
+SYSCALLS = {
+    "x86_64": GENERIC_SYSCALLS,
+    "amd64": GENERIC_SYSCALLS,
+    "i386": GENERIC_SYSCALLS,
+    "i486": GENERIC_SYSCALLS,
+    "i586": GENERIC_SYSCALLS,
+    "i686": GENERIC_SYSCALLS,
+    "aarch64": GENERIC_SYSCALLS,
+    "arm64": GENERIC_SYSCALLS,
+    "armv6l": GENERIC_SYSCALLS,
+    "armv7l": GENERIC_SYSCALLS,
+    "armv8l": GENERIC_SYSCALLS,
+    "ppc": GENERIC_SYSCALLS,
+    "ppc64": GENERIC_SYSCALLS,
+    "ppc64le": GENERIC_SYSCALLS,
+    "s390x": GENERIC_SYSCALLS,
+    "riscv64": GENERIC_SYSCALLS,
+    "loongarch64": GENERIC_SYSCALLS,
+    "alpha": (535, 536, 537),
+}
+
+SYS_IO_URING_SETUP, SYS_IO_URING_ENTER, SYS_IO_URING_REGISTER = SYSCALLS.get(
+    platform.machine(),
+    (None, None, None),
+)
+
+# memory orders for libatomic
+ATOMIC_ACQUIRE = 2
+ATOMIC_RELEASE = 3
+
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+
+IORING_FEAT_SINGLE_MMAP = 1 << 0
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_REGISTER_PROBE = 8
+IO_URING_OP_SUPPORTED = 1 << 0
+
+IORING_OP_RENAMEAT = 35
+IORING_OP_MKDIRAT = 37
+
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1 << 0
+
+
+class _SqringOffsets(ctypes.Structure):
+    _fields_ = [
+        ("head", ctypes.c_uint32),
+        ("tail", ctypes.c_uint32),
+        ("ring_mask", ctypes.c_uint32),
+        ("ring_entries", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("dropped", ctypes.c_uint32),
+        ("array", ctypes.c_uint32),
+        ("resv1", ctypes.c_uint32),
+        ("user_addr", ctypes.c_uint64),
+    ]
+
+
+class _CqringOffsets(ctypes.Structure):
+    _fields_ = [
+        ("head", ctypes.c_uint32),
+        ("tail", ctypes.c_uint32),
+        ("ring_mask", ctypes.c_uint32),
+        ("ring_entries", ctypes.c_uint32),
+        ("overflow", ctypes.c_uint32),
+        ("cqes", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("resv1", ctypes.c_uint32),
+        ("user_addr", ctypes.c_uint64),
+    ]
+
+
+class _Params(ctypes.Structure):
+    _fields_ = [
+        ("sq_entries", ctypes.c_uint32),
+        ("cq_entries", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("sq_thread_cpu", ctypes.c_uint32),
+        ("sq_thread_idle", ctypes.c_uint32),
+        ("features", ctypes.c_uint32),
+        ("wq_fd", ctypes.c_uint32),
+        ("resv", ctypes.c_uint32 * 3),
+        ("sq_off", _SqringOffsets),
+        ("cq_off", _CqringOffsets),
+    ]
+
+
+class _Sqe(ctypes.Structure):
+    _fields_ = [
+        ("opcode", ctypes.c_uint8),
+        ("flags", ctypes.c_uint8),
+        ("ioprio", ctypes.c_uint16),
+        ("fd", ctypes.c_int32),
+        ("off", ctypes.c_uint64),
+        ("addr", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("op_flags", ctypes.c_uint32),
+        ("user_data", ctypes.c_uint64),
+        ("buf_index", ctypes.c_uint16),
+        ("personality", ctypes.c_uint16),
+        ("file_index", ctypes.c_int32),
+        ("addr3", ctypes.c_uint64),
+        ("pad", ctypes.c_uint64),
+    ]
+
+
+# the layout of _Sqe, for writing entries with one call each
+SQE_STRUCT = struct.Struct("=BBHiQQIIQHHiQQ")
+assert SQE_STRUCT.size == ctypes.sizeof(_Sqe)
+
+
+class _Cqe(ctypes.Structure):
+    _fields_ = [
+        ("user_data", ctypes.c_uint64),
+        ("res", ctypes.c_int32),
+        ("flags", ctypes.c_uint32),
+    ]
+
+
+class _ProbeOp(ctypes.Structure):
+    _fields_ = [
+        ("op", ctypes.c_uint8),
+        ("resv", ctypes.c_uint8),
+        ("flags", ctypes.c_uint16),
+        ("resv2", ctypes.c_uint32),
+    ]
+
+
+PROBE_OP_COUNT = 256
+
+class _Probe(ctypes.Structure):
+    _fields_ = [
+        ("last_op", ctypes.c_uint8),
+        ("ops_len", ctypes.c_uint8),
+        ("resv", ctypes.c_uint16),
+        ("resv2", ctypes.c_uint32 * 3),
+        ("ops", _ProbeOp * PROBE_OP_COUNT),
+    ]
+
+
+_libc = None
+
+def _syscall(*args):
+    global _libc
+    if args[0] is None:
+        raise OSError(errno.ENOSYS, "io_uring system calls are unknown on %s" % platform.machine())
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.syscall.restype = ctypes.c_long
+
+    while True:
+        result = _libc.syscall(*args)
+        if result >= 0:
+            return result
+        error = ctypes.get_errno()
+        if error != errno.EINTR:
+            raise OSError(error, os.strerror(error))
+
+
+_libatomic = None
+
+def _atomics():
+    """
+    Returns libatomic's 32-bit load and store functions, for the ring
+    indices that must not be reordered with the entries they refer to.
+    Raises OSError if it can't be loaded.
+    """
+    global _libatomic
+    if _libatomic is None:
+        name = ctypes.util.find_library("atomic")
+        if name is None:
+            raise OSError(errno.ENOSYS, "libatomic is needed for io_uring")
+        libatomic = ctypes.CDLL(name)
+        load = libatomic.__atomic_load_4
+        load.restype = ctypes.c_uint32
+        load.argtypes = (ctypes.c_void_p, ctypes.c_int)
+        store = libatomic.__atomic_store_4
+        store.restype = None
+        store.argtypes = (ctypes.c_void_p, ctypes.c_uint32, ctypes.c_int)
+        _libatomic = (load, store)
+    return _libatomic
+
+
+class Ring(object):
+    """
+    An io_uring instance with room for `entries` operations in flight.
+
+    Operations are tuples of (opcode, fd, addr, len, off, op_flags), the
+    fields of a submission queue entry that renames and directory creations
+    use.
+    """
+    def __init__(self, entries=256):
+        self._load_acquire, self._store_release = _atomics()
+
+        params = _Params()
+        self._fd = _syscall(SYS_IO_URING_SETUP, entries, ctypes.byref(params))
+
+        try:
+            self._map_rings(params)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _map_rings(self, params):
+        sq_off = params.sq_off
+        cq_off = params.cq_off
+
+        self.entries = params.sq_entries
+        sq_size = sq_off.array + params.sq_entries * ctypes.sizeof(ctypes.c_uint32)
+        cq_size = cq_off.cqes + params.cq_entries * ctypes.sizeof(_Cqe)
+        flags = mmap.MAP_SHARED
+        protection = mmap.PROT_READ | mmap.PROT_WRITE
+
+        if params.features & IORING_FEAT_SINGLE_MMAP:
+            sq_size = cq_size = max(sq_size, cq_size)
+        self._sq_map = mmap.mmap(self._fd, sq_size, flags, protection, offset=IORING_OFF_SQ_RING)
+        if params.features & IORING_FEAT_SINGLE_MMAP:
+            self._cq_map = self._sq_map
+        else:
+            self._cq_map = mmap.mmap(self._fd, cq_size, flags, protection, offset=IORING_OFF_CQ_RING)
+        self._sqe_map = mmap.mmap(
+            self._fd,
+            params.sq_entries * ctypes.sizeof(_Sqe),
+            flags,
+            protection,
+            offset = IORING_OFF_SQES,
+        )
+
+        uint32 = ctypes.c_uint32
+        self._sq_tail = uint32.from_buffer(self._sq_map, sq_off.tail)
+        self._sq_mask = uint32.from_buffer(self._sq_map, sq_off.ring_mask).value
+        # each slot in the submission queue always holds the entry with the
+        # same index, so this only has to be filled in once
+        sq_array = (uint32 * params.sq_entries).from_buffer(
+            self._sq_map, sq_off.array
+        )
+        for index in range(params.sq_entries):
+            sq_array[index] = index
+        del sq_array
+
+        self._cq_head = uint32.from_buffer(self._cq_map, cq_off.head)
+        self._cq_tail = uint32.from_buffer(self._cq_map, cq_off.tail)
+        self._cq_mask = uint32.from_buffer(self._cq_map, cq_off.ring_mask).value
+        self._cqes = (_Cqe * params.cq_entries).from_buffer(
+            self._cq_map, cq_off.cqes
+        )
+
+    def close(self):
+        if self._fd < 0:
+            return
+        # the ctypes views have to go before the maps they point into
+        del self._sq_tail
+        del self._cq_head, self._cq_tail, self._cqes
+        for ring_map in set((self._sq_map, self._cq_map, self._sqe_map)):
+            ring_map.close()
+        os.close(self._fd)
+        self._fd = -1
+
+    def supports(self, opcode):
+        probe = _Probe()
+        _syscall(
+            SYS_IO_URING_REGISTER,
+            self._fd,
+            IORING_REGISTER_PROBE,
+            ctypes.byref(probe),
+            PROBE_OP_COUNT,
+        )
+        return (
+            opcode <= probe.last_op and
+            bool(probe.ops[opcode].flags & IO_URING_OP_SUPPORTED)
+        )
+
+    def run(self, operations):
+        """
+        Submits `operations` and waits for them all to complete, at most
+        `entries` at a time.
+
+        :return: A list with the result of each operation, in order: 0 or
+          more for success, or a negated errno.
+        """
+        results = [ None ] * len(operations)
+        for start in range(0, len(operations), self.entries):
+            self._run_chunk(operations, start, results)
+        return results
+
+    def _run_chunk(self, operations, start, results):
+        chunk = operations[start:start + self.entries]
+        tail = self._sq_tail.value
+
+        pack_into = SQE_STRUCT.pack_into
+        for offset, (opcode, fd, addr, length, off, op_flags) in enumerate(chunk):
+            index = (tail + offset) & self._sq_mask
+            pack_into(
+                self._sqe_map,
+                index * SQE_STRUCT.size,
+                # len holds the second directory fd for renames, which may
+                # be negative
+                opcode, 0, 0, fd, off, addr, length & 0xffffffff, op_flags,
+                start + offset, 0, 0, 0, 0, 0,
+            )
+
+        # published with release ordering, so the kernel never sees the new
+        # tail before the entries above
+        self._store_release(
+            ctypes.addressof(self._sq_tail),
+            (tail + len(chunk)) & 0xffffffff,
+            ATOMIC_RELEASE,
+        )
+
+        to_submit = len(chunk)
+        remaining = len(chunk)
+        while remaining > 0:
+            submitted = _syscall(
+                SYS_IO_URING_ENTER,
+                self._fd,
+                to_submit,
+                remaining,
+                IORING_ENTER_GETEVENTS,
+                None,
+                0,
+            )
+            to_submit -= min(to_submit, submitted)
+            remaining -= self._reap(results)
+
+    def _reap(self, results):
+        head = self._cq_head.value
+        # the entries up to the tail are only read after it
+        tail = self._load_acquire(ctypes.addressof(self._cq_tail), ATOMIC_ACQUIRE)
+        count = (tail - head) & 0xffffffff
+        for position in range(head, head + count):
+            cqe = self._cqes[position & self._cq_mask]
+            results[cqe.user_data] = cqe.res
+        # and the kernel may only reuse them once they have been read
+        self._store_release(ctypes.addressof(self._cq_head), tail, ATOMIC_RELEASE)
+        return count
+
+
+_supported = None
+
+def uring_supported():
+    """
+    Returns True if io_uring can be used here for renames and directory
+    creations, which needs Linux 5.15 or later on an architecture whose
+    system call numbers are known, libatomic, and for io_uring not to be
+    disabled or blocked.
+    """
+    global _supported
+    if _supported is None:
+        _supported = False
+        if sys.platform.startswith("linux") and SYS_IO_URING_SETUP is not None:
+            try:
+                ring = Ring(1)
+            except (OSError, AttributeError, ValueError):
+                pass
+            else:
+                try:
+                    _supported = (
+                        ring.supports(IORING_OP_RENAMEAT) and
+                        ring.supports(IORING_OP_MKDIRAT)
+                    )
+                except OSError:
+                    pass
+                finally:
+                    ring.close()
+    return _supported
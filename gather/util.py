@@ -1,5 +1,4 @@
 import collections
-import os
 
 
 def enum_name_set(enum_class):
@@ -31,16 +30,6 @@ def group(iterable, key_function):
         yield key, item_list
 
 
-def recurse_file_iterator(roots):
-    for path in roots:
-        if os.path.isfile(path):
-            yield path
-        elif os.path.isdir(path):
-            for container, _dirnames, filenames in os.walk(path):
-                for filename in filenames:
-                    yield os.path.join(container, filename)
-
-
 def filter_partition(func, iterable):
     trues = [ ]
     falses = [ ]
@@ -50,3 +39,43 @@ def filter_partition(func, iterable):
         target.append(m)
 
     return trues, falses
+
+
+BYTE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+def format_bytes(byte_count):
+    value = float(byte_count)
+    for unit in BYTE_UNITS[:-1]:
+        if abs(value) < 1000:
+            break
+        value /= 1000
+    else:
+        unit = BYTE_UNITS[-1]
+
+    if unit == BYTE_UNITS[0]:
+        return "%d %s" % (value, unit)
+    return "%.1f %s" % (value, unit)
+
+
+def parse_bytes(text):
+    """
+    Parses a byte count with an optional decimal unit suffix, such as `500`,
+    `20K` or `1.5GB`.
+    """
+    number = text.strip().upper()
+    if number.endswith("B"):
+        number = number[:-1]
+
+    multiplier = 1
+    for power, unit in enumerate(BYTE_UNITS[1:], 1):
+        if number.endswith(unit[0]):
+            number = number[:-1]
+            multiplier = 1000 ** power
+            break
+
+    return int(float(number) * multiplier)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
@@ -42,6 +42,8 @@ setup(
     entry_points={
         "console_scripts": [
             "gather = gather.cli:main",
+            "gather-merge-summaries = gather.shard:main",
+            "gather-query = gather.service:main",
         ]
     },
     # test_suite="tests"
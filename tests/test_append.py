@@ -0,0 +1,108 @@
+import unittest
+
+from gather import core
+from gather.fs import MemoryFilesystem
+from gather.handlers import Handler
+from gather.params import (
+    AmbiguityBehavior,
+    Config,
+    DEFAULT_DIR_TEMPLATE,
+    GatherResult,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+from gather.scan import Scanner
+
+
+GATHERED = "/r/f_[1-3].exr"
+
+
+def config(**fields):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        RollbackBehavior.set,
+        False,
+        append = True,
+    )._replace(**fields)
+
+
+def snapshot(fs, path="/"):
+    paths = [ ]
+    for entry in fs.scandir(path):
+        paths.append(entry.path)
+        if entry.is_dir():
+            paths.extend(snapshot(fs, entry.path))
+    return sorted(paths)
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.mixed = [ ]
+
+    def handle_mixed_gathered_directories(self, directories):
+        self.mixed.extend(directories)
+
+
+class AppendTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        self.fs.add_files([ GATHERED + "/f_%d.exr" % i for i in range(1, 4) ])
+        self.handler = RecordingHandler()
+
+    def gather(self, **fields):
+        files = list(Scanner(fs=self.fs).files([ "/r" ]))
+        return core.gather(files, config(**fields), self.handler, fs=self.fs)
+
+    def test_new_files_join_gathered_directory(self):
+        self.fs.add_files([ "/r/f_4.exr", "/r/f_5.exr" ])
+        self.assertEqual(self.gather(), GatherResult.ok)
+        self.assertEqual(
+            snapshot(self.fs),
+            [ "/r", "/r/f_[1-5].exr" ] +
+            [ "/r/f_[1-5].exr/f_%d.exr" % i for i in range(1, 6) ],
+        )
+
+    def test_nothing_new(self):
+        before = snapshot(self.fs)
+        self.assertEqual(self.gather(), GatherResult.ok)
+        self.assertEqual(snapshot(self.fs), before)
+        self.assertEqual(self.fs.calls["move"], 0)
+
+    def test_gathered_directories_merge(self):
+        self.fs.add_files([ "/r/f_[4-5].exr/f_4.exr", "/r/f_[4-5].exr/f_5.exr" ])
+        self.assertEqual(self.gather(), GatherResult.ok)
+        self.assertEqual(
+            snapshot(self.fs),
+            [ "/r", "/r/f_[1-5].exr" ] +
+            [ "/r/f_[1-5].exr/f_%d.exr" % i for i in range(1, 6) ],
+        )
+
+    def test_out_of_range_file_is_skipped(self):
+        self.fs.add_files([ GATHERED + "/f_9.exr" ])
+        self.fs.add_files([ "/r/f_%d.exr" % i for i in range(4, 7) ])
+        self.assertEqual(self.gather(), GatherResult.ok)
+
+        # renaming the directory would take f_9 with it, so it's left as it
+        # was, and the new files are gathered on their own
+        self.assertEqual(self.handler.mixed, [ GATHERED ])
+        self.assertEqual(
+            snapshot(self.fs),
+            [ "/r", GATHERED ] +
+            [ GATHERED + "/f_%d.exr" % i for i in (1, 2, 3, 9) ] +
+            [ "/r/f_[4-6].exr" ] +
+            [ "/r/f_[4-6].exr/f_%d.exr" % i for i in range(4, 7) ],
+        )
+
+    def test_other_sequence_is_skipped(self):
+        self.fs.add_files([ GATHERED + "/g_1.exr", "/r/f_4.exr" ])
+        before = snapshot(self.fs)
+        self.assertEqual(self.gather(), GatherResult.ok)
+        self.assertEqual(self.handler.mixed, [ GATHERED ])
+        self.assertEqual(snapshot(self.fs), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from gather import core
+from gather.analyze import Collector, FieldSelectingCollector
+from gather.fs import MemoryFilesystem
+from gather.params import (
+    AmbiguityBehavior,
+    Config,
+    DEFAULT_DIR_TEMPLATE,
+    GatherResult,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+from tests.test_collectors import generate_names, normalize
+
+
+RENDERS = [ "/r/render_%04d_v2.exr" % i for i in range(1, 6) ]
+SHOTS = [
+    "/r/shot010_v%d_f%02d.exr" % (version, frame)
+    for version in (3, 4)
+    for frame in range(1, 4)
+]
+
+
+def config(**fields):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        RollbackBehavior.set,
+        False,
+    )._replace(**fields)
+
+
+def describe(collector):
+    return sorted(
+        (sequence.prefix, sequence.suffix, len(sequence.paths))
+        for sequence in collector.sequences()
+    )
+
+
+class FieldSelectingCollectorTest(unittest.TestCase):
+    def test_selects_field_per_family(self):
+        collector = FieldSelectingCollector()
+        collector.collect_all(RENDERS + SHOTS)
+        self.assertEqual(describe(collector), [
+            ("render_", "_v2.exr", 5),
+            ("shot010_v3_f", ".exr", 3),
+            ("shot010_v4_f", ".exr", 3),
+        ])
+
+    def test_last_field_is_used_by_collector(self):
+        collector = Collector()
+        collector.collect_all(RENDERS)
+        self.assertEqual(
+            [ count for _, _, count in describe(collector) ],
+            [ 1 ] * len(RENDERS),
+        )
+
+    def test_single_field_names_match_collector(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                # those generated with a single run of digits
+                names = [
+                    name for name in generate_names(300, seed)
+                    if "shot010" not in name and not name.endswith(".v2")
+                ]
+                reference = Collector()
+                reference.collect_all(names)
+                selecting = FieldSelectingCollector()
+                selecting.collect_all(names)
+                self.assertEqual(normalize(selecting), normalize(reference))
+
+
+class AutoFieldGatherTest(unittest.TestCase):
+    def test_gather(self):
+        fs = MemoryFilesystem()
+        fs.add_files(RENDERS)
+
+        result = core.gather(RENDERS, config(auto_field=True), fs=fs)
+        self.assertEqual(result, GatherResult.ok)
+        for path in RENDERS:
+            self.assertTrue(fs.exists(path.replace("/r/", "/r/render_[0001-0005]_v2.exr/")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+Randomized differential and scaling checks for sequence detection engines.
+
+Any engine that can stand in for `gather.analyze.Collector` - that is, it
+has `collect_all`, `sequences` and `ambiguities` - is compared against the
+reference Collector on adversarial sets of names, and its work is counted
+to check that it grows linearly with the number of names.
+"""
+
+import os.path
+import random
+import sys
+import unittest
+
+from gather.analyze import Collector
+from gather.ondisk import SqliteCollector
+
+
+# alternative engines, by name. each value is a callable that returns a new,
+# empty engine
+ENGINES = {
+    "sqlite": SqliteCollector,
+}
+
+
+CONTAINERS = ("", "a", os.path.join("a", "b"), "c")
+PREFIXES = ("", "f", "f_", "f.", "shot010_v", "0")
+SUFFIXES = ("", ".exr", "_final.dpx", ".v2")
+
+DIFFERENTIAL_ROUNDS = 20
+DIFFERENTIAL_SIZE = 300
+
+SCALING_BASE_SIZE = 1000
+SCALING_DOUBLINGS = 3
+# work is counted rather than timed, so doubling the names of a linear
+# engine comes to very close to twice the work. a quadratic one would be
+# near four times
+SCALING_MAX_RATIO = 2.5
+# sqlite virtual machine instructions per count
+SQLITE_STEP = 100
+
+
+def _random_number(rng):
+    """
+    Returns the digits of a number chosen to land near the places where
+    sequence linking is subtle: rollovers from 9... to 10..., varying
+    widths of zero padding, and zero itself.
+    """
+    choice = rng.random()
+    if choice < 0.35:
+        # around a power of ten, which is where _insert looks at shorter and
+        # longer neighbors
+        power = rng.randint(1, 4)
+        value = 10 ** power + rng.randint(-3, 2)
+    elif choice < 0.45:
+        value = rng.randint(0, 3)
+    else:
+        value = rng.randint(0, 150)
+
+    value = max(0, value)
+    width = len(str(value))
+    if rng.random() < 0.5:
+        width += rng.randint(0, 2)
+    return str(value).zfill(width)
+
+
+def generate_names(count, seed=None):
+    """
+    Generates `count` distinct paths, biased towards numbering that the
+    Collector has to handle specially, and towards dense runs so that long
+    sequences form alongside the ambiguities.
+    """
+    rng = random.Random(seed)
+    names = set()
+
+    while len(names) < count:
+        container = rng.choice(CONTAINERS)
+        prefix = rng.choice(PREFIXES)
+        suffix = rng.choice(SUFFIXES)
+
+        if rng.random() < 0.7:
+            # a contiguous run
+            start = int(_random_number(rng))
+            width = rng.randint(1, 4)
+            for value in range(start, start + rng.randint(1, 30)):
+                number = str(value).zfill(width)
+                names.add(os.path.join(container, prefix + number + suffix))
+        else:
+            number = _random_number(rng)
+            names.add(os.path.join(container, prefix + number + suffix))
+
+    names = sorted(names)[:count]
+    rng.shuffle(names)
+    return names
+
+
+def normalize(engine):
+    """
+    Reduces an engine's results to a form that can be compared exactly.
+
+    Sequences are compared as their paths in order. Which side of an
+    ambiguity is reported depends on the order names were collected, so
+    each ambiguity is compared as the set of every file it involves.
+    """
+    sequences = frozenset(s.paths for s in engine.sequences())
+    ambiguities = frozenset(
+        frozenset((a.file,) + tuple(a.choices))
+        for a in engine.ambiguities()
+    )
+    return sequences, ambiguities
+
+
+def collect(engine_factory, names):
+    engine = engine_factory()
+    try:
+        engine.collect_all(names)
+        return normalize(engine)
+    finally:
+        engine.close()
+
+
+def count_work(engine_factory, names):
+    """
+    Returns how much work an engine does to collect and analyze `names`:
+    the number of function calls it makes, and for an engine backed by
+    sqlite, the number of SQLITE_STEP instructions sqlite runs. Unlike
+    timings, these are the same from run to run.
+    """
+    calls = [ 0 ]
+    steps = [ 0 ]
+
+    def count_call(frame, event, arg):
+        if event in ("call", "c_call"):
+            calls[0] += 1
+
+    def count_steps():
+        steps[0] += 1
+        return 0
+
+    engine = engine_factory()
+    db = getattr(engine, "_db", None)
+    if db is not None:
+        db.set_progress_handler(count_steps, SQLITE_STEP)
+
+    sys.setprofile(count_call)
+    try:
+        engine.collect_all(names)
+        for _ in engine.sequences():
+            pass
+        for _ in engine.ambiguities():
+            pass
+    finally:
+        sys.setprofile(None)
+        engine.close()
+
+    return calls[0], steps[0]
+
+
+class DifferentialTest(unittest.TestCase):
+    def test_engines_match_reference(self):
+        for name, engine_factory in sorted(ENGINES.items()):
+            with self.subTest(engine=name):
+                rng = random.Random(0)
+                for _ in range(DIFFERENTIAL_ROUNDS):
+                    names = generate_names(DIFFERENTIAL_SIZE, rng.getrandbits(32))
+                    shuffled = list(names)
+                    rng.shuffle(shuffled)
+
+                    # in two different orders
+                    for ordered in (names, shuffled):
+                        self.assertEqual(
+                            collect(engine_factory, ordered),
+                            collect(Collector, ordered),
+                        )
+
+
+class ScalingTest(unittest.TestCase):
+    def test_work_grows_linearly(self):
+        engines = dict(ENGINES, reference=Collector)
+        for name, engine_factory in sorted(engines.items()):
+            with self.subTest(engine=name):
+                size = SCALING_BASE_SIZE
+                work = count_work(engine_factory, generate_names(size, 0))
+                for _ in range(SCALING_DOUBLINGS):
+                    size *= 2
+                    larger = count_work(engine_factory, generate_names(size, 0))
+                    for small, large in zip(work, larger):
+                        if small > 0:
+                            self.assertLess(
+                                large / small,
+                                SCALING_MAX_RATIO,
+                                "%d names: %r, then %d names: %r" % (
+                                    size // 2, work, size, larger,
+                                ),
+                            )
+                    work = larger
+
+
+if __name__ == "__main__":
+    unittest.main()
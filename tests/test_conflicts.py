@@ -0,0 +1,165 @@
+import unittest
+
+from gather import core
+from gather.fs import MemoryFilesystem
+from gather.handlers import CliReporter, Handler
+from gather.log import LogMethodsMixin
+from gather.params import (
+    AmbiguityBehavior,
+    CancelReason,
+    Config,
+    Conflict,
+    DEFAULT_DIR_TEMPLATE,
+    GatherResult,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+
+
+def config(**fields):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        RollbackBehavior.set,
+        False,
+    )._replace(**fields)
+
+
+def snapshot(fs, path="/"):
+    paths = [ ]
+    for entry in fs.scandir(path):
+        paths.append(entry.path)
+        if entry.is_dir():
+            paths.extend(snapshot(fs, entry.path))
+    return sorted(paths)
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.conflicts = [ ]
+        self.cancel_reasons = set()
+
+    def handle_conflicts(self, conflicts):
+        self.conflicts.extend(conflicts)
+
+    def handle_cancel_reasons(self, cancel_reasons):
+        self.cancel_reasons |= set(cancel_reasons)
+
+
+class RecordingLogger(LogMethodsMixin):
+    def __init__(self):
+        self.level = 0
+        self.messages = [ ]
+
+    def _log(self, level, message):
+        self.messages.append(message)
+
+
+SEQUENCE = [ "/root/a/f_%d.exr" % i for i in range(1, 4) ]
+TARGET = "/root/a/f_[1-3].exr"
+
+
+class FindConflictsTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        self.fs.add_files(SEQUENCE)
+        self.handler = RecordingHandler()
+
+    def gather(self, paths, **fields):
+        before = snapshot(self.fs)
+        result = core.gather(paths, config(**fields), self.handler, fs=self.fs)
+        if result == GatherResult.cancel:
+            # conflicts are found before anything is moved
+            self.assertEqual(snapshot(self.fs), before)
+        return result
+
+    def test_no_conflicts(self):
+        self.assertEqual(self.gather(SEQUENCE), GatherResult.ok)
+        self.assertEqual(self.handler.conflicts, [ ])
+
+    def test_existing_file(self):
+        self.fs.add_files([ TARGET + "/f_2.exr" ])
+        self.assertEqual(self.gather(SEQUENCE), GatherResult.cancel)
+        self.assertEqual(
+            self.handler.conflicts,
+            [ Conflict(TARGET + "/f_2.exr", ("/root/a/f_2.exr",), True) ],
+        )
+        self.assertIn(CancelReason.destination_conflicts, self.handler.cancel_reasons)
+
+    def test_blocked_directory(self):
+        self.fs.create_file(TARGET)
+        self.assertEqual(self.gather(SEQUENCE), GatherResult.cancel)
+        self.assertEqual(
+            self.handler.conflicts,
+            [ Conflict(TARGET, tuple(SEQUENCE), False, True) ],
+        )
+
+    def test_planned_twice(self):
+        other = [ "/root/b/f_%d.exr" % i for i in range(1, 4) ]
+        self.fs.add_files(other)
+        self.fs.add_files([ "/out/f_[1-3].exr/f_1.exr" ])
+
+        result = self.gather(
+            SEQUENCE + other,
+            dir_template = "/out/{name_prefix}[{first}-{last}]{suffix}",
+        )
+        self.assertEqual(result, GatherResult.cancel)
+
+        conflicts = {
+            conflict.destination: conflict for conflict in self.handler.conflicts
+        }
+        self.assertEqual(len(conflicts), 3)
+        for i in range(1, 4):
+            conflict = conflicts["/out/f_[1-3].exr/f_%d.exr" % i]
+            self.assertEqual(
+                sorted(conflict.sources),
+                [ "/root/a/f_%d.exr" % i, "/root/b/f_%d.exr" % i ],
+            )
+            self.assertEqual(conflict.exists, i == 1)
+
+    def test_dry_run_reports_conflicts(self):
+        self.fs.add_files([ TARGET + "/f_2.exr" ])
+        self.gather(SEQUENCE, dry_run=True)
+        self.assertEqual(len(self.handler.conflicts), 1)
+
+
+class ReportConflictsTest(unittest.TestCase):
+    def report(self, conflicts):
+        logger = RecordingLogger()
+        CliReporter(config(), logger).handle_conflicts(conflicts)
+        # the header, and the blank line after
+        self.assertEqual(logger.messages[-1], "")
+        return logger.messages[1:-1]
+
+    def test_existing(self):
+        self.assertEqual(
+            self.report([ Conflict("/t/f_1.exr", ("/f_1.exr",), True) ]),
+            [ "  /t/f_1.exr exists and would be replaced by /f_1.exr" ],
+        )
+
+    def test_planned(self):
+        self.assertEqual(
+            self.report([ Conflict("/t/f_1.exr", ("/a/f_1.exr", "/b/f_1.exr"), True) ]),
+            [
+                "  /t/f_1.exr exists and would be replaced",
+                "  /t/f_1.exr would be the destination of 2 files:",
+                "    /a/f_1.exr",
+                "    /b/f_1.exr",
+            ],
+        )
+
+    def test_blocked(self):
+        self.assertEqual(
+            self.report([ Conflict("/t", ("/f_1.exr", "/f_2.exr"), False, True) ]),
+            [
+                "  /t is blocked by a file, and can't be the directory of 2 files:",
+                "    /f_1.exr",
+                "    /f_2.exr",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
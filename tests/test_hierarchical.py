@@ -0,0 +1,43 @@
+import unittest
+
+from gather.analyze import Collector
+
+
+def spanning(names):
+    """
+    Returns the paths of each sequence found across directories.
+    """
+    collector = Collector(hierarchical=True)
+    collector.collect_all(names)
+    return sorted(
+        child.paths
+        for dir_sequence in collector.directory_sequences()
+        for child in dir_sequence.children
+    )
+
+
+class SpanningSequenceTest(unittest.TestCase):
+    def test_joined_across_consecutive_directories(self):
+        names = [ "/r/d1/f_1.exr", "/r/d1/f_2.exr", "/r/d2/f_3.exr", "/r/d2/f_4.exr" ]
+        self.assertEqual(spanning(names), [ tuple(names) ])
+
+    def test_not_joined_across_a_gap(self):
+        # d3 isn't a sequence directory, since it holds no sequence
+        names = [
+            "/r/d1/f_1.exr", "/r/d1/f_2.exr",
+            "/r/d2/f_3.exr", "/r/d2/f_4.exr",
+            "/r/d3/notes.txt",
+            "/r/d4/f_5.exr", "/r/d4/f_6.exr",
+        ]
+        self.assertEqual(spanning(names), [
+            tuple(names[:4]),
+            tuple(names[5:]),
+        ])
+
+    def test_not_joined_if_numbering_restarts(self):
+        names = [ "/r/d1/f_1.exr", "/r/d1/f_2.exr", "/r/d2/f_1.exr", "/r/d2/f_2.exr" ]
+        self.assertEqual(spanning(names), [ tuple(names[:2]), tuple(names[2:]) ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import unittest
+
+from gather import core
+from gather.fs import MemoryFilesystem
+from gather.locking import NoOpLocks
+from gather.params import (
+    AmbiguityBehavior,
+    Config,
+    DEFAULT_DIR_TEMPLATE,
+    GatherResult,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+
+
+FILE_COUNT = 5
+
+
+class RecordingLocks(NoOpLocks):
+    """
+    Locks that are always free, and record which directories are held.
+    """
+    shared = True
+
+    def __init__(self):
+        self.held = set()
+
+    def acquire(self, paths):
+        token = set(paths) - self.held
+        self.held |= token
+        return token
+
+    def release(self, token):
+        self.held -= token
+
+    def release_all(self):
+        self.held.clear()
+
+
+class CheckedFilesystem(MemoryFilesystem):
+    """
+    A MemoryFilesystem that fails a test that moves a file between
+    directories that aren't locked.
+    """
+    def __init__(self, test, locks):
+        super().__init__()
+        self._test = test
+        self._locks = locks
+
+    def move(self, src, dest):
+        for path in (src, dest):
+            self._test.assertIn(os.path.dirname(path), self._locks.held)
+        super().move(src, dest)
+
+
+def config(rollback_behavior):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        rollback_behavior,
+        False,
+    )
+
+
+class LockingTest(unittest.TestCase):
+    def setUp(self):
+        self.locks = RecordingLocks()
+        self.fs = CheckedFilesystem(self, self.locks)
+        self.paths = [
+            "/root/%s/f_%d.exr" % (d, i)
+            for d in ("a", "b")
+            for i in range(1, FILE_COUNT + 1)
+        ]
+        self.fs.add_files(self.paths)
+
+    def gather(self, rollback_behavior):
+        return core.gather(
+            self.paths,
+            config(rollback_behavior),
+            locks = self.locks,
+            fs = self.fs,
+        )
+
+    def test_rollback_of_all_holds_every_lock(self):
+        # the second sequence fails, undoing the first as well
+        self.fs.fail("move", FILE_COUNT + 2)
+        result = self.gather(RollbackBehavior.all)
+
+        self.assertEqual(result, GatherResult.error_full_rollback)
+        for path in self.paths:
+            self.assertTrue(self.fs.exists(path))
+        self.assertEqual(self.locks.held, set())
+
+    def test_rollback_of_set_holds_its_own_locks(self):
+        self.fs.fail("move", FILE_COUNT + 2)
+        result = self.gather(RollbackBehavior.set)
+
+        self.assertEqual(result, GatherResult.error_partial_rollback)
+        self.assertEqual(self.locks.held, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
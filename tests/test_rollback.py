@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+
+from gather.fs import MemoryFilesystem
+from gather.transaction import (
+    FilesystemTransaction,
+    Move,
+    RollbackError,
+    UringTransaction,
+)
+from gather.uring import uring_supported
+
+
+DIRECTORY_COUNT = 5
+FILE_COUNT = 20
+
+
+def build(fs):
+    for d in range(DIRECTORY_COUNT):
+        container = "/root/d%d" % d
+        fs.add_files(
+            [ os.path.join(container, "f%02d" % i) for i in range(FILE_COUNT) ] +
+            [ os.path.join(container, "old", "x"), os.path.join(container, "g") ]
+        )
+        fs.makedirs(os.path.join(container, "empty"))
+
+
+def change(transaction):
+    for d in range(DIRECTORY_COUNT):
+        container = "/root/d%d" % d
+        target = os.path.join(container, "seq", "deep")
+        transaction.mkdirp(target)
+        for i in range(FILE_COUNT):
+            name = "f%02d" % i
+            transaction.move(
+                os.path.join(container, name),
+                os.path.join(target, name),
+            )
+        # a directory, and then a file into it under its new name
+        transaction.move(
+            os.path.join(container, "old"),
+            os.path.join(container, "renamed"),
+        )
+        transaction.move(
+            os.path.join(container, "g"),
+            os.path.join(container, "renamed", "g"),
+        )
+        transaction.rmdir_if_empty(os.path.join(container, "empty"))
+
+
+def snapshot(fs, path="/"):
+    paths = [ ]
+    for entry in fs.scandir(path):
+        paths.append(entry.path)
+        if entry.is_dir():
+            paths.extend(snapshot(fs, entry.path))
+    return sorted(paths)
+
+
+class RollbackTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        build(self.fs)
+        self.before = snapshot(self.fs)
+
+    def test_rollback_restores_tree(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                transaction = FilesystemTransaction(
+                    fs = self.fs,
+                    rollback_workers = workers,
+                )
+                change(transaction)
+                self.assertNotEqual(snapshot(self.fs), self.before)
+
+                transaction.rollback()
+                self.assertEqual(snapshot(self.fs), self.before)
+
+    def test_failed_rollback_can_be_retried(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                transaction = FilesystemTransaction(
+                    fs = self.fs,
+                    rollback_workers = workers,
+                )
+                change(transaction)
+
+                self.fs.fail("move", FILE_COUNT * 2)
+                with self.assertRaises(RollbackError) as caught:
+                    transaction.rollback()
+                self.assertGreater(len(caught.exception.actions), 0)
+                self.assertNotEqual(snapshot(self.fs), self.before)
+
+                # only what wasn't undone is left to do
+                transaction.rollback()
+                self.assertEqual(snapshot(self.fs), self.before)
+
+    def test_failed_move_is_not_undone(self):
+        transaction = FilesystemTransaction(fs=self.fs)
+        transaction.mkdirp("/root/d0/seq")
+        transaction.move("/root/d0/f00", "/root/d0/seq/f00")
+
+        self.fs.fail("move")
+        with self.assertRaises(OSError):
+            transaction.move("/root/d0/f01", "/root/d0/seq/f01")
+
+        transaction.rollback()
+        self.assertEqual(snapshot(self.fs), self.before)
+
+    def test_execute_defaults_to_real_filesystem(self):
+        move = Move("/nonexistent/gather-test/a", "/nonexistent/gather-test/b")
+        with self.assertRaises(OSError):
+            move.execute()
+
+
+@unittest.skipUnless(uring_supported(), "io_uring is not available")
+class UringTransactionTest(unittest.TestCase):
+    def test_close_abandons_queued_moves(self):
+        with tempfile.TemporaryDirectory() as root:
+            src = os.path.join(root, "a")
+            dest = os.path.join(root, "b")
+            open(src, "w").close()
+
+            transaction = UringTransaction()
+            transaction.move(src, dest)
+            transaction.close()
+            self.assertTrue(os.path.exists(src))
+            self.assertFalse(os.path.exists(dest))
+
+    def test_commit_makes_queued_moves(self):
+        with tempfile.TemporaryDirectory() as root:
+            src = os.path.join(root, "a")
+            dest = os.path.join(root, "b")
+            open(src, "w").close()
+
+            transaction = UringTransaction()
+            try:
+                transaction.move(src, dest)
+                transaction.commit()
+            finally:
+                transaction.close()
+            self.assertFalse(os.path.exists(src))
+            self.assertTrue(os.path.exists(dest))
+
+
+if __name__ == "__main__":
+    unittest.main()
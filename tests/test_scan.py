@@ -0,0 +1,119 @@
+import unittest
+
+from gather.fs import MemoryFilesystem
+from gather.scan import NameFilter, Scanner, VisitedSet, filter_paths
+
+
+def build(fs):
+    fs.add_files(
+        [ "/root/f_%d.exr" % i for i in range(1, 4) ] +
+        [ "/root/a/g_%d.exr" % i for i in range(1, 4) ] +
+        [ "/root/a/b/h_%d.exr" % i for i in range(1, 4) ]
+    )
+
+
+class VisitedSetTest(unittest.TestCase):
+    def test_add(self):
+        visited = VisitedSet()
+        self.assertTrue(visited.add(1, 2))
+        self.assertFalse(visited.add(1, 2))
+        # neither half of the key can be mistaken for the other
+        self.assertTrue(visited.add(2, 1))
+        self.assertTrue(visited.add(1, 2 ** 40))
+        self.assertEqual(len(visited), 3)
+
+
+class DeduplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        build(self.fs)
+        self.all_files = sorted(Scanner(fs=self.fs).files([ "/root" ]))
+
+    def test_overlapping_roots(self):
+        files = list(Scanner(fs=self.fs).files([
+            "/root/a",
+            "/root",
+            "/root/a/b",
+            "/root/f_1.exr",
+            "/root",
+        ]))
+        self.assertEqual(len(files), len(set(files)))
+        self.assertEqual(sorted(files), self.all_files)
+        self.assertEqual(len(files), 9)
+
+    def test_directories_listed_once(self):
+        self.fs.calls.clear()
+        list(Scanner(fs=self.fs).files([ "/root/a", "/root", "/root/a/b" ]))
+        self.assertEqual(self.fs.calls["scandir"], 3)
+
+    def test_overlapping_roots_with_stat(self):
+        files = list(Scanner(fs=self.fs, capture_stat=True).files([
+            "/root/a/b/h_1.exr",
+            "/root",
+        ]))
+        self.assertEqual(sorted(f.path for f in files), self.all_files)
+
+    def test_missing_root(self):
+        files = list(Scanner(fs=self.fs).files([ "/missing", "/root/a/b" ]))
+        self.assertEqual(len(files), 3)
+
+
+class NameFilterTest(unittest.TestCase):
+    def test_include(self):
+        name_filter = NameFilter(include=[ "*.exr", "re:^g_" ])
+        self.assertTrue(name_filter.accepts_file("f_1.exr"))
+        self.assertTrue(name_filter.accepts_file("g_1.dpx"))
+        self.assertFalse(name_filter.accepts_file("f_1.dpx"))
+        # includes only apply to files
+        self.assertTrue(name_filter.accepts_directory("tmp"))
+
+    def test_exclude(self):
+        name_filter = NameFilter(exclude=[ "*.tmp", "re:~$" ])
+        self.assertTrue(name_filter.accepts_file("f_1.exr"))
+        self.assertFalse(name_filter.accepts_file("f_1.exr.tmp"))
+        self.assertFalse(name_filter.accepts_file("f_1.exr~"))
+        self.assertFalse(name_filter.accepts_directory("x.tmp"))
+
+    def test_exclude_overrides_include(self):
+        name_filter = NameFilter(include=[ "*.exr" ], exclude=[ "g_*" ])
+        self.assertTrue(name_filter.accepts_file("f_1.exr"))
+        self.assertFalse(name_filter.accepts_file("g_1.exr"))
+
+
+class TraversalTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        build(self.fs)
+        self.fs.add_files([ "/root/a/b/h_1.tmp", "/root/a/b/c/i_1.exr" ])
+
+    def files(self, **options):
+        return sorted(Scanner(fs=self.fs, **options).files([ "/root" ]))
+
+    def test_excluded_directories_are_not_listed(self):
+        files = self.files(name_filter=NameFilter(exclude=[ "b" ]))
+        self.assertEqual(
+            files,
+            [ "/root/a/g_%d.exr" % i for i in range(1, 4) ] +
+            [ "/root/f_%d.exr" % i for i in range(1, 4) ],
+        )
+        self.assertEqual(self.fs.calls["scandir"], 2)
+
+    def test_included_files(self):
+        files = self.files(name_filter=NameFilter(include=[ "*.tmp" ]))
+        self.assertEqual(files, [ "/root/a/b/h_1.tmp" ])
+
+    def test_max_depth(self):
+        for max_depth, count in ((0, 3), (1, 6), (2, 10), (3, 11)):
+            with self.subTest(max_depth=max_depth):
+                self.assertEqual(len(self.files(max_depth=max_depth)), count)
+
+    def test_filter_paths(self):
+        paths = [ "/root/f_1.exr", "/root/a/b/h_1.tmp", "/root/a/g_1.exr" ]
+        self.assertEqual(
+            list(filter_paths(paths, NameFilter(exclude=[ "*.tmp" ]))),
+            [ "/root/f_1.exr", "/root/a/g_1.exr" ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import unittest
+
+from gather.fs import MemoryFilesystem
+from gather.params import (
+    AmbiguityBehavior,
+    Config,
+    DEFAULT_DIR_TEMPLATE,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+from gather.service import SequenceService
+
+
+def config(**fields):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        RollbackBehavior.set,
+        False,
+    )._replace(**fields)
+
+
+def snapshot(fs, path="/"):
+    paths = [ ]
+    for entry in fs.scandir(path):
+        paths.append(entry.path)
+        if entry.is_dir():
+            paths.extend(snapshot(fs, entry.path))
+    return sorted(paths)
+
+
+class SequenceServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        self.fs.add_files(
+            [ "/root/a/f_%d.exr" % i for i in range(1, 6) ] +
+            [ "/root/a/b/g.%04d.dpx" % i for i in range(10, 14) ] +
+            [ "/root/a/notes.txt" ]
+        )
+        self.service = SequenceService([ "/root" ], config(), fs=self.fs)
+        self.service.refresh()
+
+    def test_lookup(self):
+        sequence = self.service.lookup("/root/a/f_3.exr")
+        self.assertIsNotNone(sequence)
+        self.assertEqual(len(sequence.paths), 5)
+        self.assertEqual(sequence.container, "/root/a")
+
+        self.assertIsNone(self.service.lookup("/root/a/notes.txt"))
+        self.assertIsNone(self.service.lookup("/root/a/f_9.exr"))
+        self.assertIsNone(self.service.lookup("/elsewhere/f_1.exr"))
+
+    def test_list_sequences(self):
+        self.assertEqual(len(self.service.list_sequences("/root/a")), 1)
+        self.assertEqual(
+            len(self.service.list_sequences("/root/a", recursive=True)),
+            2,
+        )
+
+    def test_dry_run_changes_nothing(self):
+        before = snapshot(self.fs)
+        summary = self.service.gather("/root", dry_run=True)
+        self.assertEqual(snapshot(self.fs), before)
+        self.assertEqual(summary["sequences"]["attempted"], 2)
+
+    def test_gather_outside_roots(self):
+        with self.assertRaises(ValueError):
+            self.service.gather("/elsewhere")
+
+    def test_repeated_gather_adds_to_gathered_directory(self):
+        self.service.gather("/root")
+        gathered = "/root/a/f_[1-5].exr"
+        self.assertTrue(self.fs.isdir(gathered))
+        sequence = self.service.lookup(os.path.join(gathered, "f_3.exr"))
+        self.assertIsNotNone(sequence)
+        self.assertEqual(sequence.container, "/root/a")
+
+        # nothing new: gathering again changes nothing
+        after = snapshot(self.fs)
+        self.service.gather("/root")
+        self.assertEqual(snapshot(self.fs), after)
+
+        # new files join the directory, which is renamed for the new range
+        self.fs.add_files([ "/root/a/f_6.exr", "/root/a/f_7.exr" ])
+        self.service.gather("/root")
+        self.assertFalse(self.fs.exists(gathered))
+        self.assertEqual(
+            [ p for p in snapshot(self.fs) if p.startswith("/root/a/f_") ],
+            [ "/root/a/f_[1-7].exr" ] + [
+                "/root/a/f_[1-7].exr/f_%d.exr" % i for i in range(1, 8)
+            ],
+        )
+        self.assertEqual(
+            len(self.service.lookup("/root/a/f_[1-7].exr/f_7.exr").paths),
+            7,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
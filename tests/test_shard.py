@@ -0,0 +1,145 @@
+import os
+import unittest
+
+from gather import core
+from gather.fs import MemoryFilesystem
+from gather.params import (
+    AmbiguityBehavior,
+    Config,
+    DEFAULT_DIR_TEMPLATE,
+    GatherResult,
+    RollbackBehavior,
+    SharedDirectoryBehavior,
+)
+from gather.scan import Scanner
+from gather.shard import Shard
+
+
+SHARD_COUNT = 3
+DIRECTORY_COUNT = 12
+
+
+def config(**fields):
+    return Config(
+        DEFAULT_DIR_TEMPLATE,
+        3,
+        AmbiguityBehavior.report,
+        SharedDirectoryBehavior.allow,
+        RollbackBehavior.set,
+        False,
+    )._replace(**fields)
+
+
+def build(fs):
+    paths = [ "/root/f_%d.exr" % i for i in range(1, 4) ]
+    for d in range(DIRECTORY_COUNT):
+        container = "/root/d%02d" % d
+        paths.extend(os.path.join(container, "f_%d.exr" % i) for i in range(1, 4))
+        paths.extend(
+            os.path.join(container, "sub", "g_%d.exr" % i) for i in range(1, 4)
+        )
+    fs.add_files(paths)
+
+
+def snapshot(fs, path="/"):
+    paths = [ ]
+    for entry in fs.scandir(path):
+        paths.append(entry.path)
+        if entry.is_dir():
+            paths.extend(snapshot(fs, entry.path))
+    return sorted(paths)
+
+
+def shards(**options):
+    return [
+        Shard(index, SHARD_COUNT, DEFAULT_DIR_TEMPLATE, **options)
+        for index in range(SHARD_COUNT)
+    ]
+
+
+class ShardTest(unittest.TestCase):
+    def test_invalid(self):
+        for index, count, depth in ((0, 0, 1), (3, 3, 1), (-1, 3, 1), (0, 3, -1)):
+            with self.subTest(index=index, count=count, depth=depth):
+                with self.assertRaises(ValueError):
+                    Shard(index, count, DEFAULT_DIR_TEMPLATE, depth)
+
+    def test_template_must_put_targets_beside_files(self):
+        for template in (
+            "/out/{name_prefix}[{first}-{last}]{suffix}",
+            "{path_prefix}/[{first}-{last}]{suffix}",
+            "seq_{path_prefix}",
+        ):
+            with self.subTest(template=template):
+                with self.assertRaises(ValueError):
+                    Shard(0, SHARD_COUNT, template)
+        Shard(0, SHARD_COUNT, "{path_prefix}{field}{suffix}")
+
+    def test_each_directory_has_one_owner(self):
+        all_shards = shards()
+        for d in range(100):
+            path = "/root/d%02d" % d
+            owners = [ s for s in all_shards if s.owns_directory(path) ]
+            self.assertEqual(len(owners), 1, path)
+        # and they're spread out
+        for shard in all_shards:
+            self.assertTrue(any(
+                shard.owns_directory("/root/d%02d" % d) for d in range(100)
+            ))
+
+    def test_gathered_directory_goes_with_its_parent(self):
+        for shard in shards():
+            for d in range(20):
+                path = "/root/d%02d" % d
+                self.assertEqual(
+                    shard.owns_directory(os.path.join(path, "f_[1-3].exr")),
+                    shard.owns_directory(path),
+                )
+
+    def test_hierarchical(self):
+        for shard in shards(hierarchical=True):
+            owner = shard.owns_directory("/root/shot010")
+            for name in ("shot020", "shot1000"):
+                self.assertEqual(
+                    shard.owns_directory(os.path.join("/root", name)),
+                    owner,
+                )
+
+
+class ShardCompositionTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = MemoryFilesystem()
+        build(self.fs)
+
+    def test_scans_are_disjoint_and_complete(self):
+        for depth in (0, 1, 2):
+            with self.subTest(depth=depth):
+                scanned = [
+                    list(Scanner(fs=self.fs, shard=shard).files([ "/root" ]))
+                    for shard in shards(depth=depth)
+                ]
+                everything = [ p for files in scanned for p in files ]
+                self.assertEqual(len(everything), len(set(everything)))
+                self.assertEqual(
+                    sorted(everything),
+                    sorted(Scanner(fs=self.fs).files([ "/root" ])),
+                )
+
+    def test_sharded_run_matches_single_run(self):
+        single = MemoryFilesystem()
+        build(single)
+        files = list(Scanner(fs=single).files([ "/root" ]))
+        self.assertEqual(core.gather(files, config(), fs=single), GatherResult.ok)
+
+        # each shard in turn, seeing the others' work when it scans, and
+        # then all of them again, which finds nothing more to do
+        for _ in range(2):
+            for shard in shards():
+                files = list(Scanner(fs=self.fs, shard=shard).files([ "/root" ]))
+                result = core.gather(files, config(append=True), fs=self.fs)
+                self.assertEqual(result, GatherResult.ok)
+            self.assertEqual(snapshot(self.fs), snapshot(single))
+
+
+if __name__ == "__main__":
+    unittest.main()